@@ -0,0 +1,118 @@
+"""
+Checks and times the ROI colour pipeline of SkinAnalyzer (crop, mask, lighting
+correction and Cr/Cb/a/b means) against the original full-frame implementation.
+
+    python -m benchmarks.bench_color_metrics [--images 200] [--size 1280x960] [--repeat 5]
+
+Faces are synthetic: random skin-like photos with a landmark polygon around a
+random centre, so no models are needed. The legacy mode (masked_metrics=False)
+must reproduce the original means within --tolerance; the report also shows how
+far the masked means move away from them.
+"""
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from services.analysis_logic import ROI_HALF_SIZE, SkinAnalyzer
+
+
+# ==================================================
+# ORIGINAL PIPELINE (reference)
+# ==================================================
+def reference_metrics(image, points, cx, cy):
+    mask = np.zeros_like(image)
+    cv2.fillConvexPoly(mask, np.array(points, dtype=np.int32), (255, 255, 255))
+    skin_region = cv2.bitwise_and(image, mask)
+    roi = skin_region[cy - ROI_HALF_SIZE:cy + ROI_HALF_SIZE, cx - ROI_HALF_SIZE:cx + ROI_HALF_SIZE]
+
+    ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCrCb)
+    y, cr, cb = cv2.split(ycrcb)
+    y = cv2.equalizeHist(y)
+    roi = cv2.cvtColor(cv2.merge([y, cr, cb]), cv2.COLOR_YCrCb2BGR)
+
+    ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCrCb)
+    lab = cv2.cvtColor(roi, cv2.COLOR_BGR2LAB)
+    _, cr, cb = cv2.split(ycrcb)
+    _, a, b = cv2.split(lab)
+    return np.mean(cr), np.mean(cb), np.mean(a), np.mean(b)
+
+
+# ==================================================
+# SYNTHETIC FACES
+# ==================================================
+def make_case(rng, width, height):
+    skin = rng.normal((120, 150, 190), 25, size=(height, width, 3))
+    image = np.clip(skin, 0, 255).astype(np.uint8)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+
+    cx = int(rng.integers(ROI_HALF_SIZE, width - ROI_HALF_SIZE))
+    cy = int(rng.integers(ROI_HALF_SIZE, height - ROI_HALF_SIZE))
+    # 68 points on a jittered ellipse, roughly the size of a face at this resolution
+    angles = np.sort(rng.uniform(0, 2 * np.pi, 68))
+    rx, ry = rng.uniform(30, 120), rng.uniform(40, 150)
+    points = [(int(cx + rx * np.cos(t)), int(cy + ry * np.sin(t))) for t in angles]
+    return image, points, cx, cy
+
+
+def timed(fn, cases, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [fn(*case) for case in cases]
+        samples.append((time.perf_counter() - start) / len(cases))
+    return outputs, min(samples) * 1e6
+
+
+def run(n_images, width, height, repeat, tolerance, seed):
+    rng = np.random.default_rng(seed)
+    cases = [make_case(rng, width, height) for _ in range(n_images)]
+    legacy = SkinAnalyzer(cache=None, masked_metrics=False)
+    masked = SkinAnalyzer(cache=None, masked_metrics=True)
+
+    reference, reference_us = timed(reference_metrics, cases, repeat)
+    legacy_out, legacy_us = timed(legacy._measure, cases, repeat)
+    masked_out, masked_us = timed(masked._measure, cases, repeat)
+
+    reference = np.array(reference)
+    legacy_diff = np.abs(np.array(legacy_out) - reference)
+    masked_diff = np.abs(np.array(masked_out) - reference)
+    parity = bool(legacy_diff.max() <= tolerance)
+
+    report = {
+        "images": n_images,
+        "image_size": f"{width}x{height}",
+        "per_image_us": {
+            "reference": round(reference_us, 1),
+            "legacy": round(legacy_us, 1),
+            "masked": round(masked_us, 1),
+        },
+        "speedup_legacy": round(reference_us / legacy_us, 2),
+        "legacy_max_abs_diff": [round(float(v), 4) for v in legacy_diff.max(axis=0)],
+        "masked_mean_abs_diff": [round(float(v), 4) for v in masked_diff.mean(axis=0)],
+        "tolerance": tolerance,
+        "parity": parity,
+    }
+    print(json.dumps(report, indent=2))
+    assert parity, f"legacy means differ from the reference by up to {legacy_diff.max():.4f}"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--size", default="1280x960", help="WIDTHxHEIGHT of the synthetic photos.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1e-6,
+                        help="Max per-channel difference of the legacy means.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    run(args.images, width, height, args.repeat, args.tolerance, args.seed)
+
+
+if __name__ == "__main__":
+    main()
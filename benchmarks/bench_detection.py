@@ -0,0 +1,86 @@
+"""
+Compares full-resolution and downscaled face detection in SkinAnalyzer.
+
+    python -m benchmarks.bench_detection --images path/to/photos [--max-edge 800] [--repeat 3]
+
+For every image both modes run the complete analysis; the script reports
+detection and end-to-end latency percentiles per mode and how often the
+downscaled path agrees with the full-resolution one on tone and condition.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+
+from benchmarks.fixtures import percentiles
+from services.analysis_logic import SkinAnalyzer
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def run(image_paths, max_edge, repeat):
+    analyzer = SkinAnalyzer(detection_mode="full", detect_max_edge=max_edge)
+    timings = {"full": {"detect": [], "total": []}, "downscaled": {"detect": [], "total": []}}
+    outcomes = {"full": [], "downscaled": []}
+
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        for mode in ("full", "downscaled"):
+            analyzer.detection_mode = mode
+            for _ in range(repeat):
+                start = time.perf_counter()
+                analyzer._detect_faces(gray)
+                timings[mode]["detect"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                result = analyzer.analyze_array(image, "benchmark", path)
+                timings[mode]["total"].append(time.perf_counter() - start)
+            outcomes[mode].append((result.face_detected, result.skin_tone, result.skin_condition))
+
+    compared = len(outcomes["full"])
+    agreement = {
+        "face_detected": sum(f[0] == d[0] for f, d in zip(outcomes["full"], outcomes["downscaled"])),
+        "tone": sum(f[1] == d[1] for f, d in zip(outcomes["full"], outcomes["downscaled"])),
+        "condition": sum(f[2] == d[2] for f, d in zip(outcomes["full"], outcomes["downscaled"])),
+    }
+    return {
+        "images": compared,
+        "max_edge": max_edge,
+        "repeat": repeat,
+        "latency": {
+            mode: {stage: percentiles(samples) for stage, samples in stages.items() if samples}
+            for mode, stages in timings.items()
+        },
+        "agreement_rate": {k: round(v / compared, 4) if compared else None for k, v in agreement.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Directory with face photos.")
+    parser.add_argument("--max-edge", type=int, default=800, help="Long edge of the detection copy.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image and mode.")
+    parser.add_argument("--output", help="Optional path for the JSON report.")
+    args = parser.parse_args()
+
+    image_paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(args.images, pattern)))
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    report = run(image_paths, args.max_edge, args.repeat)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Compares plain decoding of uploads with the preprocessing stage.
+
+    python -m benchmarks.bench_preprocess [--sizes vga hd 12mp] [--images path/to/photos]
+                                          [--orientations 1 3 6 8] [--repeat 5]
+
+Every fixture is stored sideways/upside down as a camera would, tagged with the
+EXIF orientation that turns it upright, and decoded both with a plain
+cv2.imdecode and with ImagePreprocessor. The report lists decode latency,
+decoded and working pixels, and whether the result came out upright. With the
+dlib models available it also runs the analysis on both and counts failed
+detections, i.e. the uploads a user would have had to retry.
+"""
+import argparse
+import json
+import struct
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.fixtures import SYNTHETIC_SIZES, load_fixtures, percentiles, write_results
+from services.analysis_logic import SkinAnalyzer
+from services.image_preprocessing import ImagePreprocessor
+from services.model_registry import model_registry
+
+# EXIF orientation -> how the camera stored an upright picture
+STORED = {
+    1: lambda image: image,
+    3: lambda image: cv2.rotate(image, cv2.ROTATE_180),
+    6: lambda image: cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE),
+    8: lambda image: cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE),
+}
+
+
+def with_exif_orientation(jpeg, orientation):
+    """Inserts an APP1 segment with just the orientation tag after the SOI marker."""
+    tiff = b"II" + struct.pack("<HI", 42, 8) + struct.pack("<HHHIHHI", 1, 0x0112, 3, 1, orientation, 0, 0)
+    payload = b"Exif\x00\x00" + tiff
+    return jpeg[:2] + b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload + jpeg[2:]
+
+
+def _upright(decoded, reference):
+    """True when the decoded image has the reference's orientation (compared on 32x32 thumbnails)."""
+    if decoded is None or (decoded.shape[0] > decoded.shape[1]) != (reference.shape[0] > reference.shape[1]):
+        return False
+    a = cv2.resize(decoded, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float64)
+    b = cv2.resize(reference, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float64)
+    return float(np.corrcoef(a.ravel(), b.ravel())[0, 1]) > 0.9
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        samples.append(time.perf_counter() - start)
+    return samples, value
+
+
+def bench_upload(data, reference, preprocessor, analyzers, repeat):
+    buf = np.frombuffer(data, np.uint8)
+    raw_samples, raw = _time(lambda: cv2.imdecode(buf, cv2.IMREAD_COLOR), repeat)
+    pre_samples, (image, info) = _time(lambda: preprocessor.decode(data), repeat)
+    report = {
+        "bytes": len(data),
+        "raw": {"decode": percentiles(raw_samples), "pixels": int(raw.shape[0] * raw.shape[1]),
+                "upright": _upright(raw, reference)},
+        "preprocessed": {"decode": percentiles(pre_samples), "pixels": int(image.shape[0] * image.shape[1]),
+                         "decode_scale": info["DecodeScale"], "upright": _upright(image, reference)},
+    }
+    if analyzers:
+        for mode, analyzer in analyzers.items():
+            samples, result = _time(lambda: analyzer.analyze_bytes(data, "benchmark"), repeat)
+            report[mode]["analyze"] = percentiles(samples)
+            report[mode]["face_detected"] = result.face_detected
+    return report
+
+
+def run(sizes, images_dir, orientations, repeat):
+    try:
+        model_registry.load()
+        models_error = None
+    except Exception as e:
+        models_error = str(e)
+
+    preprocessor = ImagePreprocessor(enabled=True)
+    analyzers = None
+    if models_error is None:
+        analyzers = {
+            "raw": SkinAnalyzer(cache=None, preprocessor=ImagePreprocessor(enabled=False)),
+            "preprocessed": SkinAnalyzer(cache=None, preprocessor=preprocessor),
+        }
+
+    uploads = {}
+    for fixture in load_fixtures(sizes, images_dir):
+        for orientation in orientations:
+            stored = STORED[orientation](fixture["image"])
+            data = with_exif_orientation(cv2.imencode(".jpg", stored)[1].tobytes(), orientation)
+            uploads[f"{fixture['name']}@{orientation}"] = bench_upload(
+                data, fixture["image"], preprocessor, analyzers, repeat
+            )
+
+    totals = {}
+    for mode in ("raw", "preprocessed"):
+        entries = [upload[mode] for upload in uploads.values()]
+        totals[mode] = {
+            "pixels": sum(entry["pixels"] for entry in entries),
+            "upright": sum(entry["upright"] for entry in entries),
+            "failed_detections": (
+                sum(not entry["face_detected"] for entry in entries) if analyzers else None
+            ),
+        }
+    return {
+        "repeat": repeat,
+        "uploads": len(uploads),
+        "bytes": sum(upload["bytes"] for upload in uploads.values()),
+        "models_ready": models_error is None,
+        "skipped_reason": models_error,
+        "totals": totals,
+        "per_upload": uploads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="*", default=list(SYNTHETIC_SIZES), choices=list(SYNTHETIC_SIZES))
+    parser.add_argument("--images", help="Optional directory with real, upright face photos.")
+    parser.add_argument("--orientations", nargs="*", type=int, default=sorted(STORED), choices=sorted(STORED))
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per upload.")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/preprocess-<time>.json).")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.images, args.orientations, args.repeat)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {write_results('preprocess', report, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
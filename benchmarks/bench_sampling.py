@@ -0,0 +1,106 @@
+"""
+Compares the single-box and multi-region skin sampling modes of SkinAnalyzer.
+
+    python -m benchmarks.bench_sampling --images path/to/photos [--repeat 20] [--max-overhead 2.0]
+
+Detection and landmarking run once per image; only the sampling stage (ROI or
+regions, lighting correction, colour metrics) is timed per mode. The report has
+the sampling latency percentiles, the regions/box overhead relative to the
+whole analysis, how often both modes agree on tone and condition, and the
+spread of the per-region means inside each face. With --max-overhead the run
+fails when the regions path is that many times slower than the box path.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_detection import IMAGE_PATTERNS
+from benchmarks.fixtures import percentiles
+from services.analysis_logic import SkinAnalysisResult, SkinAnalyzer
+
+MODES = ("box", "regions")
+
+
+def run(image_paths, repeat):
+    analyzers = {mode: SkinAnalyzer(cache=None, sampling_mode=mode) for mode in MODES}
+    timings = {"locate": [], "box": [], "regions": []}
+    outcomes = {mode: [] for mode in MODES}
+    region_spread = []
+
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+
+        start = time.perf_counter()
+        located = analyzers["box"]._locate_face(image, SkinAnalysisResult("benchmark", path))
+        timings["locate"].append(time.perf_counter() - start)
+        if located is None:
+            continue
+
+        for mode, analyzer in analyzers.items():
+            for _ in range(repeat):
+                result = SkinAnalysisResult("benchmark", path)
+                start = time.perf_counter()
+                metrics = analyzer._sample(image, located, result)
+                timings[mode].append(time.perf_counter() - start)
+            if metrics is None:
+                outcomes[mode].append(None)
+                continue
+            tone, _, condition = analyzer.rules.classify_one(*metrics)
+            outcomes[mode].append((tone, condition))
+            if mode == "regions" and len(result.regions) > 1:
+                values = np.array([[r["CrMean"], r["CbMean"], r["aMean"], r["bMean"]] for r in result.regions.values()])
+                region_spread.append(values.std(axis=0))
+
+    compared = len(outcomes["box"])
+    pairs = list(zip(outcomes["box"], outcomes["regions"]))
+    box_p50 = np.median(timings["box"]) if timings["box"] else 0.0
+    regions_p50 = np.median(timings["regions"]) if timings["regions"] else 0.0
+    locate_p50 = np.median(timings["locate"]) if timings["locate"] else 0.0
+    return {
+        "images": compared,
+        "repeat": repeat,
+        "latency": {stage: percentiles(samples) for stage, samples in timings.items() if samples},
+        "regions_vs_box": round(float(regions_p50 / box_p50), 2) if box_p50 else None,
+        "overhead_of_analysis_pct": round(float((regions_p50 - box_p50) / (locate_p50 + box_p50) * 100), 2)
+        if locate_p50 else None,
+        "agreement_rate": {
+            "tone": round(sum(b is not None and r is not None and b[0] == r[0] for b, r in pairs) / compared, 4)
+            if compared else None,
+            "condition": round(sum(b is not None and r is not None and b[1] == r[1] for b, r in pairs) / compared, 4)
+            if compared else None,
+        },
+        "mean_region_std": [round(float(v), 3) for v in np.mean(region_spread, axis=0)] if region_spread else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Directory with face photos.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed sampling runs per image and mode.")
+    parser.add_argument("--max-overhead", type=float, help="Fail when regions/box p50 exceeds this ratio.")
+    parser.add_argument("--output", help="Optional path for the JSON report.")
+    args = parser.parse_args()
+
+    image_paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(args.images, pattern)))
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    report = run(image_paths, args.repeat)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.max_overhead and report["regions_vs_box"] and report["regions_vs_box"] > args.max_overhead:
+        raise SystemExit(f"Regions sampling is {report['regions_vs_box']}x the box path (max {args.max_overhead}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Stage-level microbenchmarks of SkinAnalyzer over the fixture set.
+
+    python -m benchmarks.bench_stages [--sizes vga hd 12mp] [--images path/to/photos] [--repeat 10]
+
+Every fixture is timed per stage: decode, detect, landmarks, color metrics for
+each sampling mode, classify, plus the whole uncached analysis. Synthetic
+fixtures use template landmarks, so the color stages run even where the dlib
+models are not available; stages that need the models are then reported as
+skipped. Results go to benchmarks/results/ (or --output) for benchmarks.compare.
+"""
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.fixtures import SYNTHETIC_SIZES, load_fixtures, percentiles, write_results
+from services.analysis_logic import SkinAnalysisResult, SkinAnalyzer
+from services.model_registry import model_registry
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_fixture(fixture, analyzers, models_ready, repeat):
+    analyzer = analyzers["box"]
+    image = fixture["image"]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    stages = {
+        "decode": _time(lambda: analyzer._decode(fixture["encoded"]), repeat),
+        "decode_raw": _time(lambda: cv2.imdecode(np.frombuffer(fixture["encoded"], np.uint8), cv2.IMREAD_COLOR), repeat),
+        "grayscale": _time(lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), repeat),
+    }
+
+    located = None
+    if fixture["landmarks"] is not None:
+        points = fixture["landmarks"]
+        left, top, right, bottom = fixture["box"]
+        located = (points, (left + right) // 2, (top + bottom) // 2)
+    if models_ready:
+        stages["detect"] = _time(lambda: analyzer._detect_faces(gray), repeat)
+        faces = analyzer._detect_faces(gray)
+        if faces:
+            face = faces[0]
+            stages["landmarks"] = _time(lambda: analyzer.predictor(gray, face), repeat)
+            if located is None:
+                located = analyzer._locate_face(image, SkinAnalysisResult("benchmark", None))
+        stages["analyze_uncached"] = _time(lambda: analyzer.analyze_array(image, "benchmark"), repeat)
+
+    if located is not None:
+        for mode, sampler in analyzers.items():
+            stages[f"color_metrics_{mode}"] = _time(
+                lambda: sampler._sample(image, located, SkinAnalysisResult("benchmark", None)), repeat
+            )
+        metrics = analyzer._sample(image, located, SkinAnalysisResult("benchmark", None))
+        if metrics is not None:
+            stages["classify"] = _time(
+                lambda: analyzer._apply_metrics(SkinAnalysisResult("benchmark", None), *metrics), repeat
+            )
+
+    height, width = image.shape[:2]
+    return {
+        "size": f"{width}x{height}",
+        "stages": {stage: percentiles(samples) for stage, samples in stages.items()},
+    }
+
+
+def run(sizes, images_dir, repeat):
+    try:
+        model_registry.load()
+        models_ready, models_error = True, None
+    except Exception as e:
+        models_ready, models_error = False, str(e)
+
+    analyzers = {mode: SkinAnalyzer(cache=None, sampling_mode=mode) for mode in ("box", "regions")}
+    fixtures = load_fixtures(sizes, images_dir)
+    return {
+        "repeat": repeat,
+        "models_ready": models_ready,
+        "skipped_reason": models_error,
+        "fixtures": {fixture["name"]: bench_fixture(fixture, analyzers, models_ready, repeat) for fixture in fixtures},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="*", default=list(SYNTHETIC_SIZES), choices=list(SYNTHETIC_SIZES))
+    parser.add_argument("--images", help="Optional directory with real face photos.")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per stage and fixture.")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/stages-<time>.json).")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.images, args.repeat)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {write_results('stages', report, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
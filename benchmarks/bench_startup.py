@@ -0,0 +1,75 @@
+"""
+Measures how long the API takes to import and to start, in fresh interpreters.
+
+    python -m benchmarks.bench_startup [--repeat 5]
+
+Each run imports main, then enters the app's lifespan, and records both times
+plus which heavy modules (OpenCV, dlib, Firebase/Firestore) got loaded along the
+way. The environment is passed through, so SKINGLOSS_FIRESTORE=memory measures a
+process without credentials and SKINGLOSS_PRELOAD_MODELS=0 one that serves no
+analyses. Results go to benchmarks/results/ (or --output) for benchmarks.compare.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.fixtures import percentiles, write_results
+
+HEAVY_MODULES = ("cv2", "dlib", "gdown", "firebase_admin", "google.cloud.firestore", "numpy")
+
+_CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+modules_after_import = [m for m in {heavy!r} if m in sys.modules]
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(boot())
+print(json.dumps({{
+    "import_s": imported - started,
+    "startup_s": ready - imported,
+    "modules_after_import": modules_after_import,
+}}))
+"""
+
+
+def measure_once():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, "-c", _CHILD.format(heavy=HEAVY_MODULES)],
+        cwd=root, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run(repeat):
+    runs = [measure_once() for _ in range(repeat)]
+    return {
+        "repeat": repeat,
+        "import": percentiles([r["import_s"] for r in runs]),
+        "startup": percentiles([r["startup_s"] for r in runs]),
+        "modules_after_import": runs[-1]["modules_after_import"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to start.")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/startup-<time>.json).")
+    args = parser.parse_args()
+
+    report = run(args.repeat)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {write_results('startup', report, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
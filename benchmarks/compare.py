@@ -0,0 +1,72 @@
+"""
+Compares two benchmark result files written by the suite.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Every latency percentile (*_ms) and throughput (*_per_s) present in both files
+is listed with its relative change. The exit status is 1 when any p50/p95
+latency grew, or any throughput dropped, by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+GATED_LATENCIES = ("p50_ms", "p95_ms")
+
+
+def flatten(node, prefix=""):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, float(node)
+
+
+def compare(baseline, candidate, threshold):
+    old = dict(flatten(baseline["results"]))
+    new = dict(flatten(candidate["results"]))
+    rows, regressions = [], []
+    for key in sorted(old.keys() & new.keys()):
+        metric = key.rsplit(".", 1)[-1]
+        if not (metric.endswith("_ms") or metric.endswith("_per_s")):
+            continue
+        before, after = old[key], new[key]
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change > threshold if metric in GATED_LATENCIES else (
+            metric.endswith("_per_s") and -change > threshold
+        )
+        rows.append((key, before, after, change, worse))
+        if worse:
+            regressions.append(key)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get("suite") != candidate.get("suite"):
+        sys.exit(f"Cannot compare a '{baseline.get('suite')}' run with a '{candidate.get('suite')}' run.")
+    for name, data in (("baseline", baseline), ("candidate", candidate)):
+        env = data.get("environment", {})
+        print(f"{name}: commit {env.get('commit')} at {env.get('timestamp')} on {env.get('platform')}")
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    width = max((len(key) for key, *_ in rows), default=10)
+    for key, before, after, change, worse in rows:
+        flag = "  REGRESSION" if worse else ""
+        print(f"{key:<{width}}  {before:>12.3f}  {after:>12.3f}  {change:>+8.1f}%{flag}")
+
+    if regressions:
+        sys.exit(f"{len(regressions)} metric(s) regressed by more than {args.threshold}%.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Shared fixtures for the benchmark suite: deterministic synthetic face images at
+several resolutions (plus any real photos), a stub for the external product API,
+and helpers that write machine-readable results.
+"""
+import asyncio
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+
+import cv2
+import httpx
+import numpy as np
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+# name -> (width, height): webcam, typical upload, full-resolution phone photo
+SYNTHETIC_SIZES = {"vga": (640, 480), "hd": (1280, 960), "12mp": (4032, 3024)}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+# ==================================================
+# IMAGES
+# ==================================================
+def template_landmarks(cx, cy, scale):
+    """A rough 68-point face in dlib's landmark order, centred on (cx, cy); scale ~ half the face width."""
+    p = np.zeros((68, 2))
+    jaw = np.linspace(np.pi, 0, 17)
+    p[0:17] = np.c_[cx + scale * np.cos(jaw), cy - 0.2 * scale + 1.2 * scale * np.sin(jaw)]
+    p[17:22] = np.c_[np.linspace(cx - 0.8 * scale, cx - 0.15 * scale, 5), np.full(5, cy - 0.6 * scale)]
+    p[22:27] = np.c_[np.linspace(cx + 0.15 * scale, cx + 0.8 * scale, 5), np.full(5, cy - 0.6 * scale)]
+    p[27:31] = np.c_[np.full(4, cx), np.linspace(cy - 0.4 * scale, cy + 0.1 * scale, 4)]
+    p[31:36] = np.c_[np.linspace(cx - 0.2 * scale, cx + 0.2 * scale, 5), np.full(5, cy + 0.2 * scale)]
+    p[36:42] = np.c_[np.linspace(cx - 0.6 * scale, cx - 0.2 * scale, 6), np.full(6, cy - 0.35 * scale)]
+    p[42:48] = np.c_[np.linspace(cx + 0.2 * scale, cx + 0.6 * scale, 6), np.full(6, cy - 0.35 * scale)]
+    p[48:68] = np.c_[np.linspace(cx - 0.35 * scale, cx + 0.35 * scale, 20), np.full(20, cy + 0.5 * scale)]
+    return [(int(x), int(y)) for x, y in p]
+
+
+def synthetic_face(width, height, seed=0):
+    """A noisy background with a skin-coloured face ellipse, plus its template landmarks and face box."""
+    rng = np.random.default_rng(seed)
+    image = np.clip(rng.normal((90, 110, 120), 30, size=(height, width, 3)), 0, 255).astype(np.uint8)
+    cx, cy, scale = width // 2, height // 2, min(width, height) // 5
+    cv2.ellipse(image, (cx, cy), (scale, int(scale * 1.3)), 0, 0, 360, (120, 150, 200), -1)
+    noise = rng.normal(0, 8, size=image.shape)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    box = (cx - scale, cy - int(scale * 1.3), cx + scale, cy + int(scale * 1.3))
+    return image, template_landmarks(cx, cy, scale), box
+
+
+def load_fixtures(sizes=tuple(SYNTHETIC_SIZES), real_dir=None, seed=0):
+    """
+    [{name, image, encoded, landmarks, box}] for each synthetic size and each real photo.
+    Real photos carry no landmarks; stages that need them use the detector instead.
+    """
+    fixtures = []
+    for i, name in enumerate(sizes):
+        width, height = SYNTHETIC_SIZES[name]
+        image, landmarks, box = synthetic_face(width, height, seed + i)
+        fixtures.append({
+            "name": f"synthetic_{name}", "image": image, "encoded": cv2.imencode(".jpg", image)[1].tobytes(),
+            "landmarks": landmarks, "box": box,
+        })
+    if real_dir:
+        paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(real_dir, pattern)))
+        for path in paths:
+            with open(path, "rb") as f:
+                encoded = f.read()
+            image = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            fixtures.append({
+                "name": os.path.basename(path), "image": image, "encoded": encoded, "landmarks": None, "box": None,
+            })
+    return fixtures
+
+
+# ==================================================
+# STUB PRODUCT API
+# ==================================================
+def stub_product_transport(latency=0.05, failure_rate=0.0, seed=0):
+    """httpx transport answering like the product search API after `latency` seconds."""
+    rng = np.random.default_rng(seed)
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        if failure_rate and rng.random() < failure_rate:
+            return httpx.Response(503)
+        query = request.url.params.get("q", "")
+        items = [{"title": f"{query} #{i}", "price": f"{10 + i}.99"} for i in range(5)]
+        return httpx.Response(200, json={"items": items})
+
+    return httpx.MockTransport(handler)
+
+
+# ==================================================
+# RESULTS
+# ==================================================
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if values.size == 0:
+        return None
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def environment():
+    """What a result was measured on, so runs are only compared like for like."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "config": {k: v for k, v in sorted(os.environ.items()) if k.startswith("SKINGLOSS_")},
+    }
+
+
+def write_results(suite, report, output=None):
+    """Writes {"suite", "environment", "results"} as JSON and returns the path."""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{suite}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump({"suite": suite, "environment": environment(), "results": report}, f, indent=2)
+    return output
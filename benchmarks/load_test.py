@@ -0,0 +1,191 @@
+"""
+Concurrent end-to-end load test of the FastAPI app.
+
+    python -m benchmarks.load_test [--scenarios analyze recommendations feedback]
+                                   [--concurrency 16] [--requests 500] [--product-latency 0.05]
+
+By default the app runs in this process behind httpx's ASGI transport, with
+Firestore replaced by the in-memory fake (config/memory_firestore.py) and the
+external product API by a stub with --product-latency seconds of delay, so the
+numbers cover our own request handling, analysis and write path only. --url
+points the same scenarios at a running server instead (its Firestore and
+product API are whatever that server uses).
+
+Scenarios:
+    analyze          POST /analysis/analyze with a synthetic face image
+    recommendations  POST /recommendations/ then GET /recommendations/user/{id}
+    feedback         POST /feedback/, GET /feedback/user/{id}, GET the reference summary
+
+SKINGLOSS_PRODUCT_CACHE_TTL=0 makes every recommendation hit the stub API.
+
+Each scenario reports throughput, latency percentiles per request kind and the
+status codes seen; results go to benchmarks/results/ for benchmarks.compare.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import httpx
+
+from benchmarks.fixtures import percentiles, stub_product_transport, synthetic_face, write_results
+
+SCENARIOS = ("analyze", "recommendations", "feedback")
+TONES = ("Warm", "Cool", "Neutral")
+CONDITIONS = ("Oily", "Dry", "Balanced")
+
+
+# ==================================================
+# SCENARIOS
+# ==================================================
+async def _timed(kind, request):
+    start = time.perf_counter()
+    response = await request
+    return kind, response, time.perf_counter() - start
+
+
+async def analyze_step(client, n, image):
+    files = {"file": ("face.jpg", image, "image/jpeg")}
+    return [await _timed("analyze", client.post(
+        "/analysis/analyze", data={"user_id": f"load-user-{n % 50}"}, files=files
+    ))]
+
+
+async def recommendations_step(client, n, image):
+    user_id = f"load-user-{n % 50}"
+    body = {
+        "user_id": user_id, "skin_tone": random.choice(TONES),
+        "skin_condition": random.choice(CONDITIONS), "analysis_id": f"analysis-{n}",
+    }
+    return [
+        await _timed("generate", client.post("/recommendations/", json=body)),
+        await _timed("list_user", client.get(f"/recommendations/user/{user_id}", params={"limit": 20})),
+    ]
+
+
+async def feedback_step(client, n, image):
+    user_id, reference_id = f"load-user-{n % 50}", f"product-{n % 20}"
+    body = {
+        "user_id": user_id, "category": "Product", "reference_id": reference_id,
+        "rating": random.randint(1, 5), "comments": "load test",
+    }
+    return [
+        await _timed("add", client.post("/feedback/", json=body)),
+        await _timed("list_user", client.get(f"/feedback/user/{user_id}", params={"limit": 20})),
+        await _timed("summary", client.get(f"/feedback/reference/{reference_id}/summary")),
+    ]
+
+
+STEPS = {"analyze": analyze_step, "recommendations": recommendations_step, "feedback": feedback_step}
+
+
+async def run_scenario(client, scenario, concurrency, total, image):
+    step = STEPS[scenario]
+    counter = itertools.count()
+    latencies = defaultdict(list)
+    statuses = Counter()
+    errors = Counter()
+
+    async def worker():
+        while (n := next(counter)) < total:
+            start = time.perf_counter()
+            try:
+                responses = await step(client, n, image)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            latencies["step"].append(elapsed)
+            for kind, response, seconds in responses:
+                statuses[f"{kind}:{response.status_code}"] += 1
+                latencies[kind].append(seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    completed = len(latencies["step"])
+    return {
+        "concurrency": concurrency,
+        "steps": total,
+        "completed": completed,
+        "duration_s": round(duration, 3),
+        "steps_per_s": round(completed / duration, 2) if duration else None,
+        "latency": {kind: percentiles(samples) for kind, samples in latencies.items()},
+        "status_codes": dict(statuses),
+        "errors": dict(errors),
+    }
+
+
+# ==================================================
+# DRIVER
+# ==================================================
+@contextlib.asynccontextmanager
+async def in_process_client(product_latency):
+    """The app behind an ASGI transport, with the in-memory Firestore and the stub product API."""
+    # Imported here so --url runs do not load the app at all
+    import main
+    from config import firebase_config
+    from config.memory_firestore import MemoryFirestore
+    from services.product_api import product_api_client
+    from services.write_buffer import write_buffer
+
+    firebase_config.set_client(MemoryFirestore())
+    product_api_client.transport = stub_product_transport(product_latency)
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            yield client
+            await asyncio.to_thread(write_buffer.flush)
+
+
+async def run(args):
+    image, _, _ = synthetic_face(*[int(v) for v in args.image_size.split("x")])
+    encoded = cv2.imencode(".jpg", image)[1].tobytes()
+
+    if args.url:
+        client_context = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        client_context = in_process_client(args.product_latency)
+
+    report = {
+        "target": args.url or "in-process",
+        "product_latency_s": None if args.url else args.product_latency,
+        "image_size": args.image_size,
+        "scenarios": {},
+    }
+    async with client_context as client:
+        for scenario in args.scenarios:
+            # A short warm-up so connection setup and first-use loading are not measured
+            await run_scenario(client, scenario, min(args.concurrency, 4), args.warmup, encoded)
+            report["scenarios"][scenario] = await run_scenario(
+                client, scenario, args.concurrency, args.requests, encoded
+            )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual clients.")
+    parser.add_argument("--requests", type=int, default=500, help="Scenario steps per scenario.")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed steps before each scenario.")
+    parser.add_argument("--product-latency", type=float, default=0.05, help="Stub product API delay (s).")
+    parser.add_argument("--image-size", default="1280x960", help="WIDTHxHEIGHT of the uploaded image.")
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<time>.json).")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {write_results('load', report, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
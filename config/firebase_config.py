@@ -1,15 +1,84 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
+import os
+import threading
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate("skingloss-1d5bc-firebase-adminsdk-fbsvc-9e980c47ae")
-    firebase_admin.initialize_app(cred, {
-        "storageBucket": "skingloss-1d5bc.appspot.com"  
-    })
+# "memory" swaps Firestore for the in-process fake in config/memory_firestore.py
+# (benchmarks, load tests, local runs); no credentials are loaded then.
+FIRESTORE_BACKEND = os.environ.get("SKINGLOSS_FIRESTORE", "firebase")
+STORAGE_BUCKET = os.environ.get("SKINGLOSS_STORAGE_BUCKET", "skingloss-1d5bc.appspot.com")
+# A local Cloud Storage emulator (e.g. the Firebase emulator suite, "http://127.0.0.1:9199").
+# When set, the bucket is opened there anonymously, whichever Firestore backend is used.
+STORAGE_EMULATOR_HOST = os.environ.get("STORAGE_EMULATOR_HOST")
 
-# Firestore client
-db = firestore.client()
+# Nothing is initialized on import: the clients are created on first use, so
+# processes that never touch Firestore (and tests) need no credentials.
+_lock = threading.Lock()
+_db = None
+_bucket = None
 
-# Storage client
-bucket = storage.bucket()
 
+def _initialize_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate("skingloss-1d5bc-firebase-adminsdk-fbsvc-9e980c47ae")
+        firebase_admin.initialize_app(cred, {
+            "storageBucket": STORAGE_BUCKET
+        })
+
+
+def get_db():
+    """The Firestore client (or the in-memory fake), created on first call."""
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                if FIRESTORE_BACKEND == "memory":
+                    from config.memory_firestore import MemoryFirestore
+                    _db = MemoryFirestore()
+                else:
+                    _initialize_app()
+                    from firebase_admin import firestore
+                    _db = firestore.client()
+    return _db
+
+
+def get_bucket():
+    """
+    The Storage bucket, created on first call. None with the in-memory backend
+    unless a storage emulator is configured.
+    """
+    global _bucket
+    if _bucket is None and (STORAGE_EMULATOR_HOST or FIRESTORE_BACKEND != "memory"):
+        with _lock:
+            if _bucket is None:
+                if STORAGE_EMULATOR_HOST:
+                    from google.auth.credentials import AnonymousCredentials
+                    from google.cloud import storage
+
+                    client = storage.Client(project="skingloss-1d5bc", credentials=AnonymousCredentials())
+                    _bucket = client.bucket(STORAGE_BUCKET)
+                else:
+                    _initialize_app()
+                    from firebase_admin import storage
+                    _bucket = storage.bucket()
+    return _bucket
+
+
+def set_client(db, bucket=None):
+    """
+    Replaces the clients, e.g. with MemoryFirestore() in tests. Services read
+    the client when they are created, so call this before their first use.
+    """
+    global _db, _bucket
+    with _lock:
+        _db, _bucket = db, bucket
+
+
+def __getattr__(name):
+    # `from config.firebase_config import db` still works, creating the client at that import
+    if name == "db":
+        return get_db()
+    if name == "bucket":
+        return get_bucket()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
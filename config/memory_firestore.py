@@ -0,0 +1,345 @@
+"""
+In-memory stand-in for the Firestore client, selected with SKINGLOSS_FIRESTORE=memory.
+
+Implements the subset of google.cloud.firestore the services use: documents,
+collections and their queries (where / order_by / select / start_after / limit),
+batches, transactions usable with @firestore.transactional, get_all and
+Increment transforms. It lets the benchmarks and load tests run without
+credentials or network, so their numbers measure our code rather than Firestore.
+Data lives in this process only.
+"""
+import copy
+import threading
+import uuid
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.transforms import Increment
+
+OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+_MISSING = object()
+
+
+def _lookup(data, field_path):
+    if field_path == "__name__":
+        return _MISSING
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _resolve(value, current):
+    """Applies Increment transforms (recursively for nested maps) against the current value."""
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value._value
+    if isinstance(value, dict):
+        current = current if isinstance(current, dict) else {}
+        return {key: _resolve(item, current.get(key)) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+
+def _merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and value and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _resolve(value, target.get(key))
+
+
+# ==================================================
+# DOCUMENTS
+# ==================================================
+class MemoryDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _lookup(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection, document_id):
+        self._client = client
+        self.id = document_id
+        self.path = f"{collection}/{document_id}"
+        self._collection = collection
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._snapshot(self, field_paths)
+
+    def set(self, document_data, merge=False):
+        self._client._write([("set", self, document_data, merge)])
+
+    def update(self, field_updates):
+        self._client._write([("update", self, field_updates, False)])
+
+    def delete(self):
+        self._client._write([("delete", self, None, False)])
+
+
+# ==================================================
+# QUERIES
+# ==================================================
+class MemoryQuery:
+    def __init__(self, client, collection, filters=(), orders=(), fields=None, cursor=None, limit=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._fields = fields
+        self._cursor = cursor
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters, "orders": self._orders, "fields": self._fields,
+            "cursor": self._cursor, "limit": self._limit,
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in OPERATORS:
+            raise ValueError(f"Unsupported operator {op_string!r}")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def stream(self, transaction=None):
+        return iter(self._client._run_query(self))
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, self._collection, document_id or uuid.uuid4().hex)
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(document_data)
+        return None, ref
+
+
+# ==================================================
+# BATCHES AND TRANSACTIONS
+# ==================================================
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._write(writes)
+        return [None] * len(writes)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    Serializes with every other write through the client lock for its whole
+    lifetime, which is what @firestore.transactional's begin/commit/rollback calls map to.
+    """
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._end()
+
+    def _rollback(self):
+        self._writes = []
+        self._end()
+
+    def _end(self):
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+# ==================================================
+# CLIENT
+# ==================================================
+class MemoryFirestore:
+    def __init__(self, project="memory"):
+        self.project = project
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return MemoryCollectionReference(self, name)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return MemoryTransaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return [self._snapshot(ref, field_paths) for ref in references]
+
+    def clear(self):
+        with self._lock:
+            self._collections.clear()
+
+    def stats(self):
+        with self._lock:
+            return {name: len(docs) for name, docs in self._collections.items()}
+
+    # --------------------------------------------------
+    def _snapshot(self, ref, field_paths=None):
+        with self._lock:
+            data = self._collections.get(ref._collection, {}).get(ref.id)
+            data = copy.deepcopy(data) if data is not None else None
+        if data is not None and field_paths:
+            data = self._project(data, field_paths)
+        return MemoryDocumentSnapshot(ref, data)
+
+    @staticmethod
+    def _project(data, field_paths):
+        projected = {}
+        for path in field_paths:
+            value = _lookup(data, path)
+            if value is not _MISSING:
+                target = projected
+                *parents, leaf = path.split(".")
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+        return projected
+
+    def _write(self, writes):
+        with self._lock:
+            # Validate first so a failing batch changes nothing, like a real commit
+            for kind, ref, _, _ in writes:
+                if kind == "update" and ref.id not in self._collections.get(ref._collection, {}):
+                    raise NotFound(f"No document to update: {ref.path}")
+            for kind, ref, data, merge in writes:
+                docs = self._collections.setdefault(ref._collection, {})
+                if kind == "delete":
+                    docs.pop(ref.id, None)
+                elif kind == "set" and not merge:
+                    docs[ref.id] = _resolve(data, None)
+                elif kind == "set":
+                    _merge(docs.setdefault(ref.id, {}), data)
+                else:
+                    document = docs[ref.id]
+                    for path, value in data.items():
+                        *parents, leaf = path.split(".")
+                        target = document
+                        for part in parents:
+                            target = target.setdefault(part, {})
+                        target[leaf] = _resolve(value, target.get(leaf))
+
+    def _run_query(self, query):
+        with self._lock:
+            docs = list(self._collections.get(query._collection, {}).items())
+
+        for field_path, op, value in query._filters:
+            compare = OPERATORS[op]
+            docs = [
+                (doc_id, data) for doc_id, data in docs
+                if (field := _lookup(data, field_path)) is not _MISSING and compare(field, value)
+            ]
+
+        # Like Firestore, documents without an ordered field are left out; the ID breaks ties
+        docs.sort(key=lambda item: item[0])
+        for field_path, direction in reversed(query._orders):
+            if field_path == "__name__":
+                docs.sort(key=lambda item: item[0], reverse=direction == "DESCENDING")
+                continue
+            docs = [item for item in docs if _lookup(item[1], field_path) is not _MISSING]
+            docs.sort(key=lambda item: _lookup(item[1], field_path), reverse=direction == "DESCENDING")
+
+        if query._cursor is not None:
+            cursor_id = getattr(query._cursor, "id", None)
+            ids = [doc_id for doc_id, _ in docs]
+            docs = docs[ids.index(cursor_id) + 1:] if cursor_id in ids else []
+
+        if query._limit is not None:
+            docs = docs[:query._limit]
+
+        snapshots = []
+        for doc_id, data in docs:
+            data = copy.deepcopy(data)
+            if query._fields is not None:
+                data = self._project(data, query._fields)
+            ref = MemoryDocumentReference(self, query._collection, doc_id)
+            snapshots.append(MemoryDocumentSnapshot(ref, data))
+        return snapshots
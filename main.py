@@ -1,8 +1,59 @@
-from fastapi import FastAPI
-import config.firebase_config
-from routes import user_routes, feedback_routes, recommendation_routes, analysis_routes
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from config.firebase_config import get_bucket
+from routes import user_routes, feedback_routes, recommendation_routes, analysis_routes, dependencies
+from services.analysis_jobs import JOB_WORKERS
+from services.analysis_pool import analysis_pool, stream_limiter
+from services.model_registry import model_registry, PRELOAD_MODELS
+from services.product_api import product_api_client
+from services.write_buffer import write_buffer
+from services import instrumentation
 
-app = FastAPI(title="SkinGloss Backend")
+
+async def _preload_models():
+    try:
+        await asyncio.to_thread(model_registry.load)
+    except Exception as e:
+        print(f"Model preload failed: {e}")
+
+
+def _start_job_workers():
+    """Runs queued analysis jobs (including those left over by a restart) without waiting for a submit."""
+    if not JOB_WORKERS:
+        return
+    try:
+        if get_bucket() is None:
+            return
+        dependencies.get_job_service().start()
+    except Exception as e:
+        print(f"Analysis job workers not started: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Loaded in the background so the server can answer /ready while the models load
+    preload = asyncio.create_task(_preload_models()) if PRELOAD_MODELS else None
+    if preload is not None:
+        # No worker is forked while the preload thread may hold the registry lock
+        analysis_pool.hold_until(preload)
+    _start_job_workers()
+    # Feedback is loaded in the background too; recommendations are ranked once it is in
+    dependencies.get_ranking_index().start()
+    yield
+    if preload is not None:
+        preload.cancel()
+    # Running analysis jobs go back to the queue before the pool they use shuts down
+    await dependencies.shutdown()
+    analysis_pool.shutdown()
+    stream_limiter.shutdown()
+    await product_api_client.aclose()
+    # Commit everything still buffered before the process exits
+    await asyncio.to_thread(write_buffer.close)
+
+
+app = FastAPI(title="SkinGloss Backend", lifespan=lifespan)
 
 app.include_router(user_routes.router, prefix="/users", tags=["Users"])
 app.include_router(feedback_routes.router, prefix="/feedback", tags=["Feedback"])
@@ -12,3 +63,34 @@ app.include_router(analysis_routes.router, prefix="/analysis", tags=["Analysis"]
 @app.get("/")
 def root():
     return {"message": "Welcome to SkinGloss Backend API"}
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 only once the face models are loaded."""
+    status = model_registry.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/stats/writes")
+def write_buffer_stats():
+    """Queue size and flush latency of the Firestore write-behind buffer."""
+    return write_buffer.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint with the per-stage latency histograms."""
+    rendered = instrumentation.render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled or prometheus_client is not installed.")
+    body, content_type = rendered
+    return Response(content=body, media_type=content_type)
+
+@app.get("/debug/profile")
+async def profile(seconds: float = Query(10, gt=0, le=instrumentation.PROFILER_MAX_SECONDS)):
+    """Samples the API process for `seconds` and returns collapsed stacks for a flame graph."""
+    if not instrumentation.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (SKINGLOSS_PROFILER=1).")
+    try:
+        stacks = await asyncio.to_thread(instrumentation.sample_stacks, seconds)
+    except instrumentation.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks)
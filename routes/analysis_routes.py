@@ -1,47 +1,353 @@
-import os 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException # Added HTTPException
-from services.analysis_service import AnalysisService
-import tempfile
-import shutil 
+import asyncio
+import datetime
+import os
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from services.analysis_service import AnalysisService, TREND_DEFAULT_POINTS, TREND_MAX_POINTS, TREND_WINDOW
+from services.analysis_jobs import (
+    AnalysisJobService, JobNotFound, StorageNotConfigured, UploadNotFound, UploadTooLarge, MAX_WAIT_SECONDS
+)
+from services.analysis_pool import analysis_pool, stream_limiter, PoolSaturated, PoolTimeout, WorkerLost
+from services.result_cache import result_cache
+from services.image_preprocessing import image_preprocessor
+from services.instrumentation import stage
+from services.pagination import parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from routes.dependencies import get_analysis_service, get_job_service, new_stream_session
 
 router = APIRouter()
 
-service = AnalysisService()
+# Upload bodies are parsed as they arrive, so oversized files are rejected before they are fully
+# received, and images are kept in memory rather than spooled to temporary files.
+MAX_UPLOAD_BYTES = int(os.environ.get("SKINGLOSS_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+MAX_BATCH_IMAGES = int(os.environ.get("SKINGLOSS_MAX_BATCH_IMAGES", 20))
+# Multipart framing and form fields (user_id) allowed in a body on top of its files.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
 
-@router.post("/analyze", tags=["Analysis"])
-async def analyze_skin(user_id: str = Form(..., description="The ID of the user submitting the image."), file: UploadFile = File(..., description="The skin image file.")):
+
+class _MultipartReader:
     """
-    Accepts an image file and a user ID, performs skin analysis, 
-    saves the result to Firestore, and cleans up the temporary file.
+    Collects the form fields and files of a multipart/form-data body fed to its parser
+    chunk by chunk. Stops at the first file over max_file_bytes or the file after max_files,
+    recording the HTTP error to raise in `error`.
     """
-    temp_path = None
-    try:
- 
-        suffix = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp:
 
-            contents = await file.read()
-            temp.write(contents)
-            temp_path = temp.name 
+    def __init__(self, boundary, max_files, max_file_bytes):
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.fields = {}
+        self.files = []
+        self.error = None
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+        self._data = bytearray()
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._header_end,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def _part_begin(self):
+        self._disposition = b""
+        self._data = bytearray()
+
+    def _header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _part_data(self, data, start, end):
+        if self.error is not None:
+            return
+        self._data += data[start:end]
+        is_file = b"filename" in parse_options_header(self._disposition)[1]
+        limit = self.max_file_bytes if is_file else MULTIPART_OVERHEAD_BYTES
+        if len(self._data) > limit:
+            self.error = (413, f"Uploaded file exceeds the {self.max_file_bytes} byte limit." if is_file
+                          else "Form field is too large.")
 
-        result_data = service.analyze_and_save(user_id, temp_path)
+    def _part_end(self):
+        if self.error is not None:
+            return
+        params = parse_options_header(self._disposition)[1]
+        name = params.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in params:
+            self.fields[name] = self._data.decode("utf-8", "replace")
+        elif len(self.files) == self.max_files:
+            self.error = (413, f"A request may contain at most {self.max_files} images.")
+        else:
+            self.files.append((name, params[b"filename"].decode("utf-8", "replace"), self._data))
+
+
+async def read_images(request: Request, file_field: str, max_files: int = 1,
+                      max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    (user_id, [(filename, bytes)]) of a multipart upload, parsed from the request stream as it
+    arrives. A body whose Content-Length is already too large is rejected with 413 before any of
+    it is read, and one that grows too large (or holds a file over max_bytes) as soon as it does.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    max_body = max_files * max_bytes + MULTIPART_OVERHEAD_BYTES
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > max_body:
+        raise HTTPException(status_code=413, detail=f"Uploaded file exceeds the {max_bytes} byte limit.")
+
+    reader = _MultipartReader(params[b"boundary"], max_files, max_bytes)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_body:
+            raise HTTPException(status_code=413, detail=f"Uploaded file exceeds the {max_bytes} byte limit.")
+        reader.parser.write(chunk)
+        if reader.error is not None:
+            raise HTTPException(status_code=reader.error[0], detail=reader.error[1])
+    reader.parser.finalize()
+
+    user_id = reader.fields.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id is required.")
+    images = [(filename, data) for name, filename, data in reader.files if name == file_field]
+    if not images:
+        raise HTTPException(status_code=400, detail=f"No {file_field} was uploaded.")
+    if any(not data for _, data in images):
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    return user_id, images
+
+
+def _upload_form(file_field, description, multiple=False):
+    """OpenAPI request body of an upload endpoint, which reads its form itself (see read_images)."""
+    file_schema = {"type": "string", "format": "binary"}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["user_id", file_field],
+        "properties": {
+            "user_id": {"type": "string", "description": "The ID of the user submitting the image."},
+            file_field: {"type": "array", "items": file_schema, "description": description} if multiple
+            else {**file_schema, "description": description},
+        },
+    }}}}}
+
+
+@router.post("/analyze", tags=["Analysis"], openapi_extra=_upload_form("file", "The skin image file."))
+async def analyze_skin(request: Request, service: AnalysisService = Depends(get_analysis_service)):
+    """
+    Accepts an image file and a user ID, performs skin analysis
+    on the in-memory upload and saves the result to Firestore.
+    """
+    try:
+        with stage("analysis", "upload"):
+            user_id, [(filename, contents)] = await read_images(request, "file")
+
+        # dlib/OpenCV run in the worker pool, the blocking Firestore write in a thread.
+        with stage("analysis", "analyze"):
+            result = await analysis_pool.analyze_bytes(contents, user_id, filename)
+        result_data = await run_in_threadpool(service.save_result, result)
 
         if not result_data.get("FaceDetected", True):
              raise HTTPException(
-                status_code=400, 
+                status_code=400,
                 detail=f"Analysis failed: {result_data.get('Notes', 'No face detected or image invalid.')}"
              )
 
         return {"status": "success", "data": result_data}
-    
+
     except HTTPException:
         raise
+    except PoolSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except WorkerLost as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         print(f"Server Error during skin analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
-        
+
+
+@router.post("/analyze/batch", tags=["Analysis"],
+             openapi_extra=_upload_form("files", "The skin image files.", multiple=True))
+async def analyze_skin_batch(request: Request, service: AnalysisService = Depends(get_analysis_service)):
+    """
+    Accepts several images of one user, analyzes them in the worker pool
+    and saves all results with a single batched Firestore write.
+    """
+    try:
+        with stage("analysis", "upload"):
+            user_id, uploads = await read_images(request, "files", max_files=MAX_BATCH_IMAGES)
+        names = [filename for filename, _ in uploads]
+        images = [data for _, data in uploads]
+
+        with stage("analysis", "analyze_batch"):
+            prepared = await analysis_pool.prepare_many(images, user_id, names)
+        batch_data = await run_in_threadpool(service.finalize_and_save_batch, prepared)
+
+        return {"status": "success", "data": batch_data}
+
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except WorkerLost as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        print(f"Server Error during batch skin analysis: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
+
+
+@router.post("/jobs", tags=["Analysis"])
+def create_analysis_job(data: dict, jobs: AnalysisJobService = Depends(get_job_service)):
+    """
+    Starts an analysis whose image is uploaded straight to Cloud Storage.
+    Body: {"user_id": ..., "content_type": "image/jpeg"}. Returns the job with an
+    upload URL; send the image there, then POST /analysis/jobs/{JobID}/submit.
+    """
+    try:
+        return jobs.create_job(data["user_id"], data.get("content_type", "image/jpeg"))
+    except KeyError:
+        raise HTTPException(status_code=400, detail="user_id is required.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except StorageNotConfigured as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.post("/jobs/{job_id}/submit", tags=["Analysis"])
+async def submit_analysis_job(job_id: str, jobs: AnalysisJobService = Depends(get_job_service)):
+    """Queues the job once its image is uploaded; poll GET /analysis/jobs/{job_id} for the result."""
+    try:
+        return await jobs.submit(job_id, MAX_UPLOAD_BYTES)
+    except JobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UploadNotFound as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except StorageNotConfigured as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/jobs/{job_id}", tags=["Analysis"])
+async def get_analysis_job(job_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS),
+                           jobs: AnalysisJobService = Depends(get_job_service)):
+    """
+    Job status; "Result" holds the SkinAnalysis data once Status is "done".
+    With ?wait=N the request returns as soon as the job finishes, or after N seconds.
+    """
+    try:
+        return await jobs.wait(job_id, wait)
+    except JobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/user/{user_id}", tags=["Analysis"])
+def get_user_analyses(user_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      start_after: Optional[str] = None, fields: Optional[str] = None,
+                      service: AnalysisService = Depends(get_analysis_service)):
+    """The user's analyses, newest first; pass next_page_token as start_after for the next page."""
+    return service.get_analyses_by_user(user_id, limit, start_after, parse_fields(fields))
+
+
+@router.get("/user/{user_id}/trend", tags=["Analysis"])
+def get_user_trend(user_id: str, period: Literal["week", "month"] = "week",
+                   points: int = Query(TREND_DEFAULT_POINTS, ge=1, le=TREND_MAX_POINTS),
+                   window: int = Query(TREND_WINDOW, ge=1, le=TREND_MAX_POINTS),
+                   end: Optional[datetime.date] = None,
+                   service: AnalysisService = Depends(get_analysis_service)):
+    """
+    Weekly or monthly metric means, rolling means over `window` periods and condition/tone
+    counts for the last `points` periods up to `end`, read from the user's AnalysisRollups.
+    """
+    return service.get_trend(user_id, period, points, window, end)
+
+
+async def _receive_frames(websocket: WebSocket, session, slot: list, arrived: asyncio.Event):
+    """Keeps only the newest frame in `slot`; frames the analysis could not keep up with are dropped."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        if message.get("text") == "end":
+            return
+        data = message.get("bytes")
+        if not data:
+            continue
+        if len(data) > MAX_UPLOAD_BYTES:
+            session.dropped += 1
+            continue
+        if slot:
+            session.dropped += 1
+            slot.clear()
+        slot.append(data)
+        arrived.set()
+
+
+@router.websocket("/stream")
+async def analyze_stream(websocket: WebSocket, session=Depends(new_stream_session)):
+    """
+    Continuous analysis of a camera stream (e.g. the mirror kiosk).
+    The client sends encoded frames (JPEG/PNG) as binary messages and gets one JSON
+    result per analyzed frame with every visible face, window-averaged metrics,
+    per-stage latency and FPS. Sending the text message "end" returns the session
+    summary and closes the stream. Stream results are not saved. At most
+    SKINGLOSS_STREAM_MAX_SESSIONS streams run at once; others are closed with
+    code 1013 (try again later).
+    """
+    await websocket.accept()
+    if not stream_limiter.acquire():
+        await websocket.close(code=1013, reason="Too many concurrent streams; try again later.")
+        return
+    slot, arrived = [], asyncio.Event()
+    receiver = asyncio.create_task(_receive_frames(websocket, session, slot, arrived))
+    try:
+        while True:
+            waiter = asyncio.create_task(arrived.wait())
+            await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not arrived.is_set():
+                waiter.cancel()
+                break
+            arrived.clear()
+            frame = slot.pop()
+            result = await stream_limiter.run(session.process, frame)
+            await websocket.send_json(result)
+
+        await websocket.send_json({"Summary": session.stats()})
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        # The client went away; RuntimeError is raised when sending on a closed socket
+        pass
+    except Exception as e:
+        print(f"Server Error during stream analysis: {e}")
+        await websocket.close(code=1011)
     finally:
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
-            print(f"Cleaned up temporary file: {temp_path}")
\ No newline at end of file
+        receiver.cancel()
+        stream_limiter.release()
+
+
+@router.get("/pool/stats", tags=["Analysis"])
+def analysis_pool_stats():
+    """Queue depth and wait-time metrics of the analysis worker pool, and the camera streams running."""
+    return {**analysis_pool.stats(), "streams": stream_limiter.stats()}
+
+
+@router.get("/cache/stats", tags=["Analysis"])
+def analysis_cache_stats():
+    """Hit/miss/eviction counters of the analysis result cache."""
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+
+@router.get("/preprocess/stats", tags=["Analysis"])
+def analysis_preprocess_stats():
+    """Upload preprocessing counters: bytes and pixels decoded, rotated uploads, failed detections."""
+    return image_preprocessor.stats()
@@ -0,0 +1,76 @@
+"""
+Service singletons for the routers, created on first use and handed to the
+endpoints with FastAPI's Depends. Nothing here is built at import time, so
+importing the app needs no credentials and a process that only serves feedback
+never loads OpenCV or dlib. The lifespan in main.py calls shutdown() on exit.
+"""
+import threading
+
+_lock = threading.Lock()
+_instances = {}
+
+
+def _singleton(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = factory()
+    return instance
+
+
+def get_ranking_index():
+    from services.ranking import RankingIndex
+    return _singleton("ranking", RankingIndex)
+
+
+def get_feedback_service():
+    from services.feedback_service import FeedbackService
+    ranking = get_ranking_index()
+    return _singleton("feedback", lambda: FeedbackService(ranking=ranking))
+
+
+def get_recommendation_service():
+    from services.recommendation_service import RecommendationService
+    ranking = get_ranking_index()
+    return _singleton("recommendation", lambda: RecommendationService(ranking=ranking))
+
+
+def get_analysis_service():
+    from services.analysis_service import AnalysisService
+    return _singleton("analysis", AnalysisService)
+
+
+def get_job_service():
+    from services.analysis_jobs import AnalysisJobService
+    return _singleton("jobs", AnalysisJobService)
+
+
+def get_stream_analyzer():
+    from services.analysis_logic import SkinAnalyzer
+    from services.image_preprocessing import ImagePreprocessor
+    # Frames are never repeated, so stream sessions skip the result cache; they get their own
+    # preprocessor so frames are not counted in the upload stats of /analysis/preprocess/stats
+    return _singleton("stream_analyzer", lambda: SkinAnalyzer(cache=None, preprocessor=ImagePreprocessor()))
+
+
+def new_stream_session():
+    """A fresh StreamSession per WebSocket connection, sharing the stream analyzer."""
+    from services.stream_analysis import StreamSession
+    return StreamSession(get_stream_analyzer())
+
+
+def reset():
+    """Drops every instance; the next request creates them again."""
+    with _lock:
+        _instances.clear()
+
+
+async def shutdown():
+    """Stops the background work of the instances created so far, then drops them."""
+    for name in ("jobs", "ranking"):
+        instance = _instances.get(name)
+        if instance is not None:
+            await instance.stop()
+    reset()
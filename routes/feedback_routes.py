@@ -1,30 +1,56 @@
-from fastapi import APIRouter
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
 from services.feedback_service import FeedbackService, Feedback
+from services.pagination import parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from routes.dependencies import get_feedback_service
 
 router = APIRouter()
-feedback_service = FeedbackService()
 
 @router.post("/")
-def add_feedback(data: dict):
+def add_feedback(data: dict, feedback_service: FeedbackService = Depends(get_feedback_service)):
     feedback = Feedback(
         user_id=data["user_id"],
         category=data["category"],
         reference_id=data["reference_id"],
         rating=data["rating"],
-        comments=data.get("comments", "")
+        comments=data.get("comments", ""),
+        skin_tone=data.get("skin_tone"),
+        skin_condition=data.get("skin_condition")
     )
     return feedback_service.add_feedback(feedback)
 
 @router.get("/user/{user_id}")
-def get_user_feedback(user_id: str):
-    return feedback_service.get_feedback_by_user(user_id)
+def get_user_feedback(user_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      start_after: Optional[str] = None, fields: Optional[str] = None,
+                      feedback_service: FeedbackService = Depends(get_feedback_service)):
+    """
+    The user's feedback, newest first, as {"items": [...], "next_page_token": ...};
+    pass next_page_token as start_after for the next page. Earlier versions
+    returned a plain list of every feedback.
+    """
+    return feedback_service.get_feedback_by_user(user_id, limit, start_after, parse_fields(fields))
 
 @router.get("/reference/{reference_id}")
-def get_reference_feedback(reference_id: str):
-    return feedback_service.get_feedback_for_reference(reference_id)
+def get_reference_feedback(reference_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                           start_after: Optional[str] = None, fields: Optional[str] = None,
+                           feedback_service: FeedbackService = Depends(get_feedback_service)):
+    """
+    Feedback on a product/analysis, newest first, as {"items": [...], "next_page_token": ...};
+    pass next_page_token as start_after for the next page. Earlier versions
+    returned a plain list of every feedback.
+    """
+    return feedback_service.get_feedback_for_reference(reference_id, limit, start_after, parse_fields(fields))
+
+@router.get("/reference/{reference_id}/summary")
+def get_reference_summary(reference_id: str, feedback_service: FeedbackService = Depends(get_feedback_service)):
+    return feedback_service.get_reference_summary(reference_id)
+
+@router.get("/category/{category}/summary")
+def get_category_summary(category: str, feedback_service: FeedbackService = Depends(get_feedback_service)):
+    return feedback_service.get_category_summary(category)
 
 @router.put("/{feedback_id}")
-def update_feedback(feedback_id: str, new_data: dict):
+def update_feedback(feedback_id: str, new_data: dict, feedback_service: FeedbackService = Depends(get_feedback_service)):
     return feedback_service.update_feedback(
         feedback_id,
         new_rating=new_data.get("rating"),
@@ -32,5 +58,5 @@ def update_feedback(feedback_id: str, new_data: dict):
     )
 
 @router.delete("/{feedback_id}")
-def delete_feedback(feedback_id: str):
+def delete_feedback(feedback_id: str, feedback_service: FeedbackService = Depends(get_feedback_service)):
     return feedback_service.delete_feedback(feedback_id)
@@ -1,12 +1,14 @@
-from fastapi import APIRouter
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
 from services.recommendation_service import RecommendationService
+from services.pagination import parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from routes.dependencies import get_recommendation_service
 
 router = APIRouter()
-service = RecommendationService()
 
 @router.post("/")
-def generate_recommendation(data: dict):
-    return service.generate_recommendations(
+async def generate_recommendation(data: dict, service: RecommendationService = Depends(get_recommendation_service)):
+    return await service.generate_recommendations(
         user_id=data["user_id"],
         skin_tone=data["skin_tone"],
         skin_condition=data["skin_condition"],
@@ -14,13 +16,25 @@ def generate_recommendation(data: dict):
     )
 
 @router.get("/user/{user_id}")
-def get_user_recommendations(user_id: str):
-    return service.get_recommendations_by_user(user_id)
+def get_user_recommendations(user_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             start_after: Optional[str] = None, fields: Optional[str] = None,
+                             service: RecommendationService = Depends(get_recommendation_service)):
+    """
+    The user's recommendations, newest first, as {"items": [...], "next_page_token": ...};
+    pass next_page_token as start_after for the next page. Earlier versions
+    returned a plain list of every recommendation.
+    """
+    return service.get_recommendations_by_user(user_id, limit, start_after, parse_fields(fields))
+
+@router.get("/ranking/stats")
+def ranking_stats(service: RecommendationService = Depends(get_recommendation_service)):
+    """Size and freshness of the feedback ranking index."""
+    return service.ranking.stats()
 
 @router.get("/{recommendation_id}")
-def get_recommendation_by_id(recommendation_id: str):
+def get_recommendation_by_id(recommendation_id: str, service: RecommendationService = Depends(get_recommendation_service)):
     return service.get_recommendation_by_id(recommendation_id)
 
 @router.put("/{recommendation_id}/feedback")
-def update_feedback(recommendation_id: str, feedback: dict):
+def update_feedback(recommendation_id: str, feedback: dict, service: RecommendationService = Depends(get_recommendation_service)):
     return service.update_recommendation_feedback(recommendation_id, feedback)
@@ -0,0 +1,46 @@
+"""
+Runs queued analysis jobs outside the API processes.
+
+    python -m scripts.analysis_worker [--jobs 4] [--poll-interval 2]
+
+Claims jobs from the AnalysisJobs collection (created with POST /analysis/jobs),
+downloads their images from Cloud Storage, analyzes them in a local worker pool
+and stores the results. Start the API with SKINGLOSS_JOB_WORKERS=0 to leave all
+analysis to these workers; otherwise both share the queue. With
+STORAGE_EMULATOR_HOST set, images come from the local storage emulator.
+"""
+import argparse
+import asyncio
+
+from services.analysis_jobs import AnalysisJobService, JOB_POLL_INTERVAL
+from services.analysis_pool import analysis_pool
+from services.model_registry import model_registry
+
+
+async def run(args):
+    # Loaded before the pool forks so its workers share the models
+    await asyncio.to_thread(model_registry.load)
+    jobs = AnalysisJobService(workers=args.jobs, poll_interval=args.poll_interval)
+    jobs.start()
+    print(f"Analysis worker {jobs.worker_id} running {args.jobs} jobs at a time")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await jobs.stop()
+        analysis_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=analysis_pool.workers, help="Jobs run concurrently.")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL,
+                        help="Seconds between scans for queued jobs.")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
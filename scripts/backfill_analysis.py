@@ -0,0 +1,366 @@
+"""
+Recomputes stored SkinAnalysis documents after a change to the classification
+rules or the analysis pipeline.
+
+    # Re-score tone/condition/confidence from the stored CrMean/CbMean/aMean/bMean
+    python -m scripts.backfill_analysis rescore [--dry-run]
+
+    # Re-run the full SkinAnalyzer on the source images kept in a local directory
+    python -m scripts.backfill_analysis reanalyze --images path/to/images --workers 4
+
+    # Recompute every user's AnalysisRollups (trend data) from the stored analyses
+    python -m scripts.backfill_analysis rollups [--dry-run]
+
+    # Recompute the FeedbackSummary rating counters from the stored feedback
+    python -m scripts.backfill_analysis feedback-summaries [--dry-run]
+
+Documents are streamed in pages ordered by document ID and written back with
+batched commits. After every committed page the last document ID is stored in
+the checkpoint file, so an interrupted run resumes where it stopped (--restart
+ignores the checkpoint). Updated documents move their users' rollups in the
+same commit. The rollups mode reads every analysis, then overwrites the rollup
+documents with the totals; it needs no checkpoint, as running it again gives
+the same result, but analyses saved while it runs may be missed until the next
+run. The feedback-summaries mode does the same for the rating counters of every
+product/analysis and category: shard 0 gets the totals, the other shards are
+zeroed, and feedback stored before the counters existed is marked Counted so
+later updates and deletes move the counters; run it once after deploying the
+counters, and again whenever they drifted. With FIRESTORE_EMULATOR_HOST set the script talks to
+the Firestore emulator and needs no service account (--project names the
+emulator project).
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from services.analysis_service import ROLLUPS_COLLECTION, rollup_document, rollup_id, rollup_totals, rollup_writes
+from services.feedback_service import SUMMARY_COLLECTION, SUMMARY_SHARDS, summary_id, summary_totals
+from services.rule_engine import rule_engine
+
+COLLECTION = "SkinAnalysis"
+RESCORE_FIELDS = [
+    "CrMean", "CbMean", "aMean", "bMean", "SkinTone", "SkinCondition", "ConfidenceScore", "RulesVersion",
+    "UserID", "AnalysisDate", "FaceDetected",
+]
+FEEDBACK_COLLECTION = "Feedback"
+FEEDBACK_SUMMARY_FIELDS = ["ReferenceID", "Category", "Rating", "Counted"]
+ROLLUP_FIELDS = ["UserID", "AnalysisDate", "FaceDetected", "CrMean", "CbMean", "aMean", "bMean",
+                 "SkinTone", "SkinCondition"]
+# Updates per commit; each also moves up to four rollup documents, within the 500 write limit
+UPDATE_BATCH_SIZE = 100
+REANALYZE_FIELDS = [
+    "FaceDetected", "SkinTone", "SkinCondition", "CrMean", "CbMean", "aMean", "bMean",
+    "ConfidenceScore", "LightingAdjusted", "Recommendations", "Notes", "Landmarks", "RulesVersion",
+    "SamplingMode", "Regions", "Preprocessing",
+]
+
+
+def get_client(project):
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore as gcloud_firestore
+        return gcloud_firestore.Client(project=project)
+    from config.firebase_config import get_db
+    return get_db()
+
+
+# ==================================================
+# CHECKPOINT
+# ==================================================
+def load_checkpoint(path, mode):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("mode") != mode:
+        raise SystemExit(f"Checkpoint {path} belongs to a '{checkpoint.get('mode')}' run; use --restart.")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ==================================================
+# PAGE PROCESSORS
+# ==================================================
+def rescore_page(docs):
+    """Classifies a whole page in one vectorized call; returns {doc_id: updates} for changed docs."""
+    rows = [(doc.id, doc.to_dict()) for doc in docs]
+    rows = [(doc_id, data) for doc_id, data in rows if data.get("CrMean") is not None]
+    if not rows:
+        return {}, []
+
+    metrics = np.array([[data["CrMean"], data["CbMean"], data["aMean"], data["bMean"]] for _, data in rows],
+                       dtype=np.float64)
+    classified = rule_engine.classify(*metrics.T)
+
+    updates, diffs = {}, []
+    for i, (doc_id, data) in enumerate(rows):
+        new = {
+            "SkinTone": classified["tone"][i],
+            "SkinCondition": classified["condition"][i],
+            "ConfidenceScore": float(classified["confidence"][i]),
+            "RulesVersion": rule_engine.version,
+        }
+        diffs.append((data, new))
+        if any(data.get(field) != value for field, value in new.items()):
+            new["Recommendations"] = rule_engine.recommend(new["SkinTone"], new["SkinCondition"], "summary")
+            new["Notes"] = (f"Tone: {new['SkinTone']}, Condition: {new['SkinCondition']}, "
+                            f"Confidence: {new['ConfidenceScore']}")
+            updates[doc_id] = new
+    return updates, diffs
+
+
+_worker_analyzer = None
+
+
+def _init_worker():
+    global _worker_analyzer
+    from services.analysis_logic import SkinAnalyzer
+    # Backfills must recompute, never reuse cached results
+    _worker_analyzer = SkinAnalyzer(cache=None)
+
+
+def _reanalyze_file(path):
+    result = _worker_analyzer.analyze_image(path)
+    data = result.to_dict()
+    return {field: data[field] for field in REANALYZE_FIELDS}
+
+
+def reanalyze_page(docs, images_dir, executor):
+    """Re-runs the analyzer on the page's source images; returns {doc_id: updates} for changed docs."""
+    jobs = []
+    for doc in docs:
+        data = doc.to_dict()
+        name = os.path.basename(data.get("ImagePath") or "")
+        path = os.path.join(images_dir, name) if name else None
+        if path and os.path.exists(path):
+            jobs.append((doc.id, data, path))
+
+    updates, diffs = {}, []
+    for (doc_id, data, _), new in zip(jobs, executor.map(_reanalyze_file, [path for _, _, path in jobs])):
+        diffs.append((data, new))
+        if any(data.get(field) != value for field, value in new.items()):
+            updates[doc_id] = new
+    return updates, diffs
+
+
+# ==================================================
+# DRIVER
+# ==================================================
+def commit_updates(db, collection, updates, previous, dry_run):
+    """Updates the documents and, in the same batch, the rollups of their old and new values."""
+    if dry_run or not updates:
+        return
+    items = list(updates.items())
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        chunk = items[start:start + UPDATE_BATCH_SIZE]
+        batch = db.batch()
+        for doc_id, fields in chunk:
+            batch.update(collection.document(doc_id), fields)
+        old = [previous[doc_id] for doc_id, _ in chunk]
+        new = [{**previous[doc_id], **fields} for doc_id, fields in chunk]
+        for _, ref, data, merge in rollup_writes(db, added=new, removed=old):
+            batch.set(ref, data, merge=merge)
+        batch.commit()
+
+
+def rebuild_rollups(args):
+    """Recomputes all rollups from the stored analyses and overwrites them."""
+    db = get_client(args.project)
+    collection = db.collection(COLLECTION)
+    started = time.perf_counter()
+    totals, scanned, cursor = {}, 0, None
+    while True:
+        query = collection.order_by("__name__").limit(args.page_size).select(ROLLUP_FIELDS)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        docs = list(query.stream())
+        if not docs:
+            break
+        rollup_totals([doc.to_dict() for doc in docs], totals=totals)
+        scanned += len(docs)
+        cursor = docs[-1]
+        print(f"... {scanned} scanned, {len(totals)} rollups")
+
+    if not args.dry_run:
+        rollups = db.collection(ROLLUPS_COLLECTION)
+        items = list(totals.items())
+        for start in range(0, len(items), 500):
+            batch = db.batch()
+            for key, entry in items[start:start + 500]:
+                batch.set(rollups.document(rollup_id(*key)), rollup_document(key, entry, increment=False))
+            batch.commit()
+
+    report = {
+        "scanned": scanned,
+        "rollups": len(totals),
+        "users": len({key[0] for key in totals}),
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+        "dry_run": args.dry_run,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def rebuild_feedback_summaries(args):
+    """Recomputes the feedback rating counters, overwrites their shards and marks all feedback counted."""
+    db = get_client(args.project)
+    collection = db.collection(FEEDBACK_COLLECTION)
+    started = time.perf_counter()
+    totals, uncounted, scanned, cursor = {}, [], 0, None
+    while True:
+        query = collection.order_by("__name__").limit(args.page_size).select(FEEDBACK_SUMMARY_FIELDS)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        docs = list(query.stream())
+        if not docs:
+            break
+        pages = [doc.to_dict() for doc in docs]
+        summary_totals(pages, totals=totals)
+        uncounted += [doc.id for doc, data in zip(docs, pages) if not data.get("Counted")]
+        scanned += len(docs)
+        cursor = docs[-1]
+        print(f"... {scanned} scanned, {len(totals)} summaries")
+
+    if not args.dry_run:
+        now = datetime.datetime.now().isoformat()
+        summaries = db.collection(SUMMARY_COLLECTION)
+        writes = []
+        for (kind, key), entry in totals.items():
+            zero = {"Kind": kind, "Key": key, "Count": 0, "Sum": 0, "Histogram": {}, "LastUpdated": now}
+            writes.append((summaries.document(summary_id(kind, key, 0)), {**zero, **entry}))
+            writes += [(summaries.document(summary_id(kind, key, shard)), zero) for shard in range(1, SUMMARY_SHARDS)]
+        for start in range(0, len(writes), 500):
+            batch = db.batch()
+            for ref, data in writes[start:start + 500]:
+                batch.set(ref, data)
+            batch.commit()
+        for start in range(0, len(uncounted), 500):
+            batch = db.batch()
+            for doc_id in uncounted[start:start + 500]:
+                batch.update(collection.document(doc_id), {"Counted": True})
+            batch.commit()
+
+    report = {
+        "scanned": scanned,
+        "summaries": len(totals),
+        "marked_counted": len(uncounted),
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+        "dry_run": args.dry_run,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def summarize(diff_counter, stats, started):
+    elapsed = time.perf_counter() - started
+    return {
+        "scanned": stats["scanned"],
+        "recomputed": stats["recomputed"],
+        "updated": stats["updated"],
+        "skipped": stats["scanned"] - stats["recomputed"],
+        "elapsed_seconds": round(elapsed, 2),
+        "docs_per_second": round(stats["scanned"] / elapsed, 1) if elapsed else None,
+        "tone_changes": {f"{a} -> {b}": n for (kind, a, b), n in diff_counter.items() if kind == "tone"},
+        "condition_changes": {f"{a} -> {b}": n for (kind, a, b), n in diff_counter.items() if kind == "condition"},
+        "mean_abs_confidence_change": round(stats["confidence_delta"] / stats["recomputed"], 4)
+        if stats["recomputed"] else 0.0,
+    }
+
+
+def run(args):
+    db = get_client(args.project)
+    collection = db.collection(COLLECTION)
+    checkpoint = None if args.restart else load_checkpoint(args.checkpoint, args.mode)
+    last_doc_id = checkpoint["last_doc_id"] if checkpoint else None
+    if last_doc_id:
+        print(f"Resuming after document {last_doc_id}")
+
+    stats = Counter(checkpoint["stats"]) if checkpoint else Counter()
+    diff_counter = Counter()
+    executor = None
+    if args.mode == "reanalyze":
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker)
+
+    started = time.perf_counter()
+    cursor = collection.document(last_doc_id).get() if last_doc_id else None
+    try:
+        while True:
+            query = collection.order_by("__name__").limit(args.page_size)
+            if args.mode == "rescore":
+                query = query.select(RESCORE_FIELDS)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            docs = list(query.stream())
+            if not docs:
+                break
+
+            if args.mode == "rescore":
+                updates, diffs = rescore_page(docs)
+            else:
+                updates, diffs = reanalyze_page(docs, args.images, executor)
+            commit_updates(db, collection, updates, {doc.id: doc.to_dict() for doc in docs}, args.dry_run)
+
+            for old, new in diffs:
+                if old.get("SkinTone") != new["SkinTone"]:
+                    diff_counter[("tone", old.get("SkinTone"), new["SkinTone"])] += 1
+                if old.get("SkinCondition") != new["SkinCondition"]:
+                    diff_counter[("condition", old.get("SkinCondition"), new["SkinCondition"])] += 1
+                stats["confidence_delta"] += abs((new.get("ConfidenceScore") or 0) - (old.get("ConfidenceScore") or 0))
+            stats["scanned"] += len(docs)
+            stats["recomputed"] += len(diffs)
+            stats["updated"] += len(updates)
+
+            cursor = docs[-1]
+            if not args.dry_run:
+                save_checkpoint(args.checkpoint, {"mode": args.mode, "last_doc_id": cursor.id, "stats": dict(stats)})
+            print(f"... {stats['scanned']} scanned, {stats['updated']} updated "
+                  f"({stats['scanned'] / (time.perf_counter() - started):.0f} docs/s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    report = summarize(diff_counter, stats, started)
+    report["dry_run"] = args.dry_run
+    report["rules_version"] = rule_engine.version
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["rescore", "reanalyze", "rollups", "feedback-summaries"])
+    parser.add_argument("--images", help="Directory with the source images (reanalyze).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Analyzer processes (reanalyze).")
+    parser.add_argument("--page-size", type=int, default=300, help="Documents per page and commit (max 500).")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="Resume file; empty to disable.")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+    parser.add_argument("--dry-run", action="store_true", help="Compute and report, but write nothing.")
+    parser.add_argument("--project", default="skingloss-1d5bc", help="Project ID when using the emulator.")
+    args = parser.parse_args()
+
+    if args.mode == "reanalyze" and not args.images:
+        parser.error("reanalyze needs --images")
+    args.page_size = max(1, min(args.page_size, 500))
+    if args.mode == "rollups":
+        rebuild_rollups(args)
+    elif args.mode == "feedback-summaries":
+        rebuild_feedback_summaries(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
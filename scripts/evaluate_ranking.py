@@ -0,0 +1,239 @@
+"""
+Offline evaluation of the feedback ranking (services/ranking.py).
+
+    # Synthetic users, products and ratings with a known structure
+    python -m scripts.evaluate_ranking synthetic [--products 2000] [--users 3000] [--ratings 20]
+
+    # The product feedback stored in Firestore
+    python -m scripts.evaluate_ranking firestore [--project skingloss-1d5bc]
+
+Feedback is split by Date: the RankingIndex is built from the older part and
+asked to order each (user, segment)'s candidates, which are all products rated
+in the segment; the newer part is the ground truth. Reported per strategy:
+
+    static        the given order (what recommendations did before ranking)
+    global        global scores only, no segment or user
+    segment       segment scores, no user
+    personalized  segment scores with the user's own ratings (what the API uses)
+
+NDCG@k uses (rating - 3) for ratings above 3 as relevance; hit rate@k is the share
+of (user, segment) pairs with a product rated 4+ in the top k. The latency
+section times RankingIndex.rank() with --products products in the index. With
+FIRESTORE_EMULATOR_HOST set the firestore source reads the emulator.
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from services.ranking import FEEDBACK_FIELDS, PRODUCT_CATEGORY, RankingIndex, feedback_segment
+
+TONES = ("Warm", "Cool", "Neutral")
+CONDITIONS = ("Oily", "Dry", "Balanced")
+STRATEGIES = ("static", "global", "segment", "personalized")
+
+
+def get_client(project):
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore as gcloud_firestore
+        return gcloud_firestore.Client(project=project)
+    from config.firebase_config import get_db
+    return get_db()
+
+
+# ==================================================
+# FEEDBACK SOURCES
+# ==================================================
+def synthetic_feedback(products, users, ratings_per_user, seed=0):
+    """
+    [(feedback_id, data)] with ratings from a product quality, a per-segment
+    affinity and a user taste term, users rating popular products more often.
+    """
+    rng = np.random.default_rng(seed)
+    segments = [(tone, condition) for tone in TONES for condition in CONDITIONS]
+    quality = rng.normal(0, 0.8, products)
+    affinity = rng.normal(0, 0.8, (len(segments), products))
+    product_taste = rng.normal(0, 1, (products, 4))
+    popularity = 1 / np.arange(1, products + 1) ** 0.8
+    popularity = rng.permutation(popularity / popularity.sum())
+
+    start = np.datetime64("2025-01-01T00:00:00")
+    feedback = []
+    for user in range(users):
+        segment = int(rng.integers(len(segments)))
+        taste = rng.normal(0, 0.5, 4)
+        count = max(1, int(rng.poisson(ratings_per_user)))
+        rated = rng.choice(products, size=min(count, products), replace=False, p=popularity)
+        # Users come back to products they rated, so some are rated twice over time
+        rated = np.concatenate((rated, rng.choice(rated, size=count // 5)))
+        for product in rated:
+            value = 3 + quality[product] + affinity[segment, product] + product_taste[product] @ taste
+            rating = int(np.clip(np.rint(value + rng.normal(0, 0.7)), 1, 5))
+            date = start + np.timedelta64(int(rng.integers(0, 365 * 24 * 3600)), "s")
+            feedback.append((f"fb-{len(feedback)}", {
+                "UserID": f"user-{user}", "Category": PRODUCT_CATEGORY, "ReferenceID": f"product-{product}",
+                "Rating": rating, "Date": str(date), "SkinTone": segments[segment][0],
+                "SkinCondition": segments[segment][1],
+            }))
+    return feedback
+
+
+def firestore_feedback(project):
+    collection = get_client(project).collection("Feedback")
+    query = collection.where("Category", "==", PRODUCT_CATEGORY).select(FEEDBACK_FIELDS)
+    return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+
+# ==================================================
+# EVALUATION
+# ==================================================
+def ndcg(relevance, k):
+    gains = np.asarray(relevance[:k], dtype=np.float64)
+    discounts = 1 / np.log2(np.arange(2, gains.size + 2))
+    ideal = np.sort(np.asarray(relevance, dtype=np.float64))[::-1][:k]
+    best = float((ideal * discounts[:ideal.size]).sum())
+    return float((gains * discounts).sum()) / best if best else None
+
+
+def split(feedback, test_fraction):
+    ordered = sorted(feedback, key=lambda item: item[1].get("Date") or "")
+    cut = int(len(ordered) * (1 - test_fraction))
+    return ordered[:cut], ordered[cut:]
+
+
+def evaluate(train, test, k, prior_weight, user_weight):
+    index = RankingIndex(prior_weight=prior_weight, user_weight=user_weight, discover=0)
+    for feedback_id, data in train:
+        index.observe(feedback_id, data)
+    names, global_scores = index.scores(None, None, None)
+    positions = {name: i for i, name in enumerate(names)}
+    # What an unrated product scores: the mean training rating
+    unrated = float(np.mean([float(data["Rating"]) for _, data in train])) if train else 3.0
+
+    # Held-out ratings per (user, segment), the latest rating of a product counting
+    truth = defaultdict(dict)
+    candidates = defaultdict(set)
+    for _, data in train + test:
+        segment = feedback_segment(data)
+        if segment is not None:
+            candidates[segment].add(data["ReferenceID"])
+    for _, data in test:
+        segment = feedback_segment(data)
+        if segment is not None:
+            truth[(data["UserID"], segment)][data["ReferenceID"]] = float(data["Rating"])
+
+    rng = np.random.default_rng(0)
+    static_order = {segment: list(rng.permutation(sorted(products))) for segment, products in candidates.items()}
+    results = {strategy: {"ndcg": [], "hits": []} for strategy in STRATEGIES}
+    for (user_id, segment), ratings in truth.items():
+        if not any(rating > 3 for rating in ratings.values()):
+            continue
+        order = static_order[segment]
+        known = np.array([positions.get(name, -1) for name in order])
+        scored = {
+            "global": global_scores,
+            "segment": index.scores(None, *segment)[1],
+            "personalized": index.scores(user_id, *segment)[1],
+        }
+        for strategy in STRATEGIES:
+            if strategy == "static":
+                ranked = order
+            else:
+                scores = np.append(scored[strategy], unrated)
+                # Products only seen in the test period (known == -1) get the score of an unrated product
+                values = scores[known]
+                ranked = [order[i] for i in np.argsort(-values, kind="stable")]
+            relevance = [max(ratings.get(name, 0) - 3, 0) for name in ranked]
+            value = ndcg(relevance, k)
+            if value is not None:
+                results[strategy]["ndcg"].append(value)
+            results[strategy]["hits"].append(any(r > 0 for r in relevance[:k]))
+
+    return {
+        "train_feedback": len(train),
+        "test_feedback": len(test),
+        "evaluated_pairs": len(results["static"]["hits"]),
+        "k": k,
+        "strategies": {
+            strategy: {
+                f"ndcg@{k}": round(float(np.mean(values["ndcg"])), 4) if values["ndcg"] else None,
+                f"hit_rate@{k}": round(float(np.mean(values["hits"])), 4) if values["hits"] else None,
+            }
+            for strategy, values in results.items()
+        },
+    }
+
+
+def measure_latency(products, repeat, seed=0):
+    """rank() timings for a rule/API-sized candidate list with `products` products in the index."""
+    feedback = synthetic_feedback(products, max(100, products), 10, seed)
+    index = RankingIndex()
+    for feedback_id, data in feedback:
+        index.observe(feedback_id, data)
+    rng = np.random.default_rng(seed)
+    # Recommending every product once makes them all eligible for discovery
+    for start in range(0, products, 100):
+        index.rank([{"name": f"product-{i}"} for i in range(start, min(start + 100, products))], None, "Warm", "Oily")
+
+    samples = []
+    for _ in range(repeat):
+        candidates = [{"name": f"product-{i}"} for i in rng.choice(products, 5, replace=False)]
+        user_id = f"user-{int(rng.integers(max(100, products)))}"
+        tone, condition = TONES[int(rng.integers(3))], CONDITIONS[int(rng.integers(3))]
+        start = time.perf_counter()
+        index.rank(candidates, user_id, tone, condition)
+        samples.append(time.perf_counter() - start)
+
+    values = np.asarray(samples) * 1000
+    return {
+        "products": len(index.scores(None, None, None)[0]),
+        "feedback": len(feedback),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+# ==================================================
+# ENTRY POINT
+# ==================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", choices=["synthetic", "firestore"])
+    parser.add_argument("--project", default="skingloss-1d5bc", help="Emulator project ID.")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=3000, help="Synthetic users.")
+    parser.add_argument("--ratings", type=int, default=20, help="Mean ratings per synthetic user.")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Newest share of feedback held out.")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--prior-weight", type=float, default=None, help="Default: SKINGLOSS_RANKING_PRIOR_WEIGHT.")
+    parser.add_argument("--user-weight", type=float, default=None, help="Default: SKINGLOSS_RANKING_USER_WEIGHT.")
+    parser.add_argument("--latency-repeat", type=int, default=2000, help="Timed rank() calls (0 skips).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        feedback = synthetic_feedback(args.products, args.users, args.ratings, args.seed)
+    else:
+        feedback = firestore_feedback(args.project)
+    train, test = split(feedback, args.test_fraction)
+
+    defaults = RankingIndex()
+    prior_weight = defaults.prior_weight if args.prior_weight is None else args.prior_weight
+    user_weight = defaults.user_weight if args.user_weight is None else args.user_weight
+    report = {
+        "source": args.source,
+        "prior_weight": prior_weight,
+        "user_weight": user_weight,
+        "quality": evaluate(train, test, args.k, prior_weight, user_weight),
+    }
+    if args.latency_repeat:
+        report["latency"] = measure_latency(args.products, args.latency_repeat, args.seed)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import asyncio
+import datetime
+import os
+import socket
+import time
+import uuid
+from collections import Counter
+from urllib.parse import quote
+
+from config.firebase_config import get_bucket, get_db, STORAGE_EMULATOR_HOST
+from services.analysis_pool import analysis_pool, JobTimeout, PoolSaturated, PoolTimeout, WorkerLost
+from services.analysis_service import rollup_writes, store_thumbnail
+from services.instrumentation import stage
+
+# ==================================================
+# JOB CONFIGURATION
+# ==================================================
+JOBS_COLLECTION = "AnalysisJobs"
+UPLOAD_PREFIX = "uploads"
+UPLOAD_CONTENT_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+# Seconds a signed upload URL stays valid.
+UPLOAD_URL_TTL = int(os.environ.get("SKINGLOSS_UPLOAD_URL_TTL", 900))
+# Jobs this process runs concurrently; 0 only queues them for scripts/analysis_worker.py.
+JOB_WORKERS = int(os.environ.get("SKINGLOSS_JOB_WORKERS", 2))
+# Seconds between scans for queued jobs (submitted elsewhere, or left over by a restart).
+JOB_POLL_INTERVAL = float(os.environ.get("SKINGLOSS_JOB_POLL_INTERVAL", 5))
+# A running job whose worker has not finished it after this many seconds is picked up again.
+JOB_LEASE_SECONDS = float(os.environ.get("SKINGLOSS_JOB_LEASE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get("SKINGLOSS_JOB_MAX_ATTEMPTS", 3))
+# Seconds before a job is retried when the analysis pool was full.
+JOB_RETRY_DELAY = 1.0
+# Longest a status request may wait for the job to finish.
+MAX_WAIT_SECONDS = 30
+
+AWAITING_UPLOAD = "awaiting_upload"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ==================================================
+# ERRORS
+# ==================================================
+class StorageNotConfigured(Exception):
+    """Raised when no Storage bucket is available (e.g. the in-memory backend without an emulator)."""
+
+
+class JobNotFound(Exception):
+    """Raised for an unknown job ID."""
+
+
+class UploadNotFound(Exception):
+    """Raised when a job is submitted before its image was uploaded."""
+
+
+class UploadTooLarge(Exception):
+    """Raised when the uploaded object exceeds the upload size limit."""
+
+
+# ==================================================
+# ANALYSIS JOB SERVICE
+# ==================================================
+class AnalysisJobService:
+    """
+    Analysis of images uploaded straight to Cloud Storage.
+
+    The client creates a job and gets a signed upload URL, PUTs the image to the
+    bucket and submits the job. Workers claim queued jobs in a transaction,
+    download the image, analyze it in the worker pool and store the SkinAnalysis
+    document together with the finished job in one batch. Clients poll
+    GET /analysis/jobs/{id} (optionally long-polling with ?wait=) or listen to the
+    AnalysisJobs/{id} document with a Firestore client SDK.
+
+    Workers run in this process when `workers` > 0 (main.py starts them with
+    the app, so jobs left queued by a restart are picked up); scripts/analysis_worker.py
+    runs the same loop standalone. Claims are transactional, so any number of
+    processes can share the queue.
+    """
+
+    def __init__(self, db=None, bucket=None, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.db = db or get_db()
+        self.bucket = bucket if bucket is not None else get_bucket()
+        self.collection = self.db.collection(JOBS_COLLECTION)
+        self.analyses = self.db.collection("SkinAnalysis")
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue = None
+        self._enqueued = set()
+        self._tasks = []
+        # One event per job with waiters, dropped when the last of them leaves
+        self._events = {}
+        self._waiters = Counter()
+
+    def _require_bucket(self):
+        if self.bucket is None:
+            raise StorageNotConfigured("Cloud Storage is not configured (set STORAGE_EMULATOR_HOST for local runs).")
+        return self.bucket
+
+    def _image_uri(self, object_path):
+        return f"gs://{self.bucket.name}/{object_path}"
+
+    # --------------------------------------------------
+    def create_job(self, user_id, content_type="image/jpeg"):
+        """Creates a job awaiting its upload and returns it with the URL to upload the image to."""
+        bucket = self._require_bucket()
+        extension = UPLOAD_CONTENT_TYPES.get(content_type)
+        if extension is None:
+            raise ValueError(f"Unsupported content type {content_type!r}; use one of {sorted(UPLOAD_CONTENT_TYPES)}.")
+
+        job_id = str(uuid.uuid4())
+        object_path = f"{UPLOAD_PREFIX}/{user_id}/{job_id}.{extension}"
+        created = _now()
+        expires = created + datetime.timedelta(seconds=UPLOAD_URL_TTL)
+        job = {
+            "JobID": job_id,
+            "UserID": user_id,
+            "Status": AWAITING_UPLOAD,
+            "ObjectPath": object_path,
+            "ContentType": content_type,
+            "CreatedAt": created.isoformat(),
+            "Attempts": 0,
+        }
+        self.collection.document(job_id).set(job)
+
+        blob = bucket.blob(object_path)
+        if STORAGE_EMULATOR_HOST:
+            # The emulator accepts unsigned uploads, and anonymous clients cannot sign URLs
+            host = STORAGE_EMULATOR_HOST if "://" in STORAGE_EMULATOR_HOST else f"http://{STORAGE_EMULATOR_HOST}"
+            method = "POST"
+            url = f"{host}/upload/storage/v1/b/{bucket.name}/o?uploadType=media&name={quote(object_path, safe='')}"
+        else:
+            method = "PUT"
+            url = blob.generate_signed_url(
+                version="v4", expiration=expires, method=method, content_type=content_type
+            )
+        return {
+            **job,
+            "Upload": {
+                "URL": url, "Method": method, "Headers": {"Content-Type": content_type},
+                "ExpiresAt": expires.isoformat(),
+            },
+        }
+
+    def get_job(self, job_id):
+        doc = self.collection.document(job_id).get()
+        if not doc.exists:
+            raise JobNotFound(f"Analysis job {job_id} not found.")
+        return doc.to_dict()
+
+    def mark_submitted(self, job_id, max_bytes):
+        """Checks the upload and queues the job. Submitting a queued, running or finished job changes nothing."""
+        bucket = self._require_bucket()
+        job = self.get_job(job_id)
+        if job["Status"] not in (AWAITING_UPLOAD, FAILED):
+            return job
+
+        blob = bucket.get_blob(job["ObjectPath"])
+        if blob is None:
+            raise UploadNotFound(f"No image has been uploaded for job {job_id} yet.")
+        if blob.size is not None and blob.size > max_bytes:
+            raise UploadTooLarge(f"Uploaded file exceeds the {max_bytes} byte limit.")
+
+        updates = {"Status": QUEUED, "SubmittedAt": _now().isoformat(), "Attempts": 0, "Error": None}
+        self.collection.document(job_id).update(updates)
+        return {**job, **updates}
+
+    async def submit(self, job_id, max_bytes):
+        job = await asyncio.to_thread(self.mark_submitted, job_id, max_bytes)
+        if job["Status"] == QUEUED and self.workers:
+            self.start()
+            self._enqueue(job_id)
+        return job
+
+    async def wait(self, job_id, timeout):
+        """The job once it finished, or as it is after `timeout` seconds."""
+        deadline = time.monotonic() + min(timeout, MAX_WAIT_SECONDS)
+        # Jobs finished here wake their waiters at once; others are seen on the next read
+        event = self._events.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] += 1
+        try:
+            while True:
+                job = await asyncio.to_thread(self.get_job, job_id)
+                remaining = deadline - time.monotonic()
+                if job["Status"] in FINISHED or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                self._events.pop(job_id, None)
+
+    # --------------------------------------------------
+    def _claim(self, job_id):
+        """Moves a queued (or abandoned running) job to running for this worker; None if someone else has it."""
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def apply(transaction, doc_ref):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return None
+            job = doc.to_dict()
+            now = _now()
+            lease_expired = (
+                job["Status"] == RUNNING
+                and job.get("StartedAt", "") < (now - datetime.timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
+            )
+            if job["Status"] != QUEUED and not lease_expired:
+                return None
+            if job.get("Attempts", 0) >= JOB_MAX_ATTEMPTS:
+                updates = {"Status": FAILED, "FinishedAt": now.isoformat(),
+                           "Error": f"Gave up after {JOB_MAX_ATTEMPTS} attempts."}
+                transaction.update(doc_ref, updates)
+                return None
+            updates = {"Status": RUNNING, "StartedAt": now.isoformat(), "Worker": self.worker_id,
+                       "Attempts": job.get("Attempts", 0) + 1}
+            transaction.update(doc_ref, updates)
+            return {**job, **updates}
+
+        return apply(self.db.transaction(), self.collection.document(job_id))
+
+    def _release(self, job_id, attempted=False):
+        """
+        Hands a claimed job back to the queue, e.g. on shutdown or when the pool is full. Unless
+        the job actually ran (`attempted`: it timed out or killed its worker), the claim's attempt
+        is given back, so waiting for capacity never makes a job fail.
+        """
+        from firebase_admin import firestore
+
+        updates = {"Status": QUEUED, "Worker": None}
+        if not attempted:
+            updates["Attempts"] = firestore.Increment(-1)
+        self.collection.document(job_id).update(updates)
+
+    def _fail(self, job_id, error):
+        self.collection.document(job_id).update({"Status": FAILED, "FinishedAt": _now().isoformat(), "Error": error})
+
+    def _complete(self, job_id, result):
+        """
+        Stores the analysis, its rollups and the finished job in one batch, so a finished
+        job always has its result.
+        """
+        store_thumbnail(self.bucket, result)
+        data = result.to_dict()
+        updates = {"Status": DONE, "FinishedAt": _now().isoformat(), "AnalysisID": data["AnalysisID"],
+                   "Result": data, "Error": None}
+        if not data.get("FaceDetected", True):
+            updates["Status"] = FAILED
+            updates["Error"] = data.get("Notes") or "No face detected or image invalid."
+        batch = self.db.batch()
+        batch.set(self.analyses.document(data["AnalysisID"]), data)
+        for _, ref, rollup, merge in rollup_writes(self.db, [] if result.resubmission else [data]):
+            batch.set(ref, rollup, merge=merge)
+        batch.update(self.collection.document(job_id), updates)
+        batch.commit()
+
+    async def run_job(self, job_id):
+        """Claims and runs one job; returns False if it was not available to this worker."""
+        job = await asyncio.to_thread(self._claim, job_id)
+        if job is None:
+            return False
+        try:
+            with stage("jobs", "download"):
+                blob = self.bucket.blob(job["ObjectPath"])
+                data = await asyncio.to_thread(blob.download_as_bytes)
+            with stage("jobs", "analyze"):
+                result = await analysis_pool.analyze_bytes(data, job["UserID"], self._image_uri(job["ObjectPath"]))
+            with stage("jobs", "save"):
+                await asyncio.to_thread(self._complete, job_id, result)
+        except (PoolSaturated, PoolTimeout) as e:
+            # Only a job that got a worker and ran too long used up its attempt
+            await asyncio.to_thread(self._release, job_id, isinstance(e, JobTimeout))
+            raise
+        except WorkerLost as e:
+            # Maybe this image killed the worker: queued again, but the attempt counts towards the limit
+            print(f"Analysis job {job_id} lost its worker: {e}")
+            await asyncio.to_thread(self._release, job_id, True)
+        except asyncio.CancelledError:
+            # Shielded so the job still goes back to the queue while shutdown cancels us
+            await asyncio.shield(asyncio.to_thread(self._release, job_id))
+            raise
+        except Exception as e:
+            print(f"Analysis job {job_id} failed: {e}")
+            await asyncio.to_thread(self._fail, job_id, str(e))
+        event = self._events.get(job_id)
+        if event is not None:
+            event.set()
+        return True
+
+    # --------------------------------------------------
+    def _enqueue(self, job_id):
+        if job_id not in self._enqueued:
+            self._enqueued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def _pending_ids(self, limit):
+        queued = (self.collection.where("Status", "==", QUEUED)
+                  .order_by("SubmittedAt").limit(limit).select(["JobID"]).stream())
+        cutoff = (_now() - datetime.timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
+        abandoned = (self.collection.where("Status", "==", RUNNING)
+                     .where("StartedAt", "<", cutoff).limit(limit).select(["JobID"]).stream())
+        return [doc.id for doc in queued] + [doc.id for doc in abandoned]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._enqueued.discard(job_id)
+            try:
+                await self.run_job(job_id)
+            except (PoolSaturated, PoolTimeout):
+                await asyncio.sleep(JOB_RETRY_DELAY)
+                self._enqueue(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Analysis job worker error on {job_id}: {e}")
+
+    async def _sweep(self):
+        while True:
+            if self._queue.qsize() < self.workers:
+                try:
+                    for job_id in await asyncio.to_thread(self._pending_ids, self.workers * 2):
+                        self._enqueue(job_id)
+                except Exception as e:
+                    print(f"Analysis job scan failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Starts the workers and the queue scan on the running event loop; does nothing if already running."""
+        if self._tasks or not self.workers:
+            return
+        self._require_bucket()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        """Cancels the workers; jobs they were running go back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._enqueued.clear()
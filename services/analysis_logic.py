@@ -4,8 +4,43 @@ import numpy as np
 import uuid
 import datetime
 import os
-import gdown
-from config.firebase_config import db  
+import threading
+from services.model_registry import model_registry
+from services.result_cache import result_cache, image_key
+from services.image_preprocessing import image_preprocessor
+from services.rule_engine import rule_engine
+from services.instrumentation import stage
+
+# Bump whenever a change alters analysis output, so cached results are not reused.
+ANALYZER_VERSION = "3"
+
+# "downscaled" runs the HOG face detector on a copy whose long edge is at most
+# DETECT_MAX_EDGE pixels; "full" runs it on the full-resolution image.
+DETECTION_MODE = os.environ.get("SKINGLOSS_DETECTION_MODE", "downscaled")
+DETECT_MAX_EDGE = int(os.environ.get("SKINGLOSS_DETECT_MAX_EDGE", 800))
+# Exclude pixels outside the landmark polygon from lighting equalization and the
+# channel means. "0" keeps the original behaviour where they count as black pixels.
+MASKED_METRICS = os.environ.get("SKINGLOSS_MASKED_METRICS", "1") == "1"
+ROI_HALF_SIZE = 40
+# "box" samples one ROI_HALF_SIZE box around the face centre; "regions" samples the
+# forehead, both cheeks and the chin and uses the median of the region means.
+SAMPLING_MODE = os.environ.get("SKINGLOSS_SAMPLING_MODE", "box")
+# Regions smaller than this (e.g. clipped at the image border) are left out of the aggregate
+MIN_REGION_PIXELS = 16
+
+# Region boxes in units of the outer eye-corner distance (landmarks 36 and 45):
+# name -> (landmarks whose mean is the anchor, (dx, dy) offset of the centre, (width, height)).
+# Left/right are as seen in the image.
+SKIN_REGIONS = {
+    "Forehead": (list(range(17, 27)), (0.0, -0.3), (0.6, 0.25)),
+    "LeftCheek": ([1, 3, 31, 41], (0.0, 0.0), (0.25, 0.25)),
+    "RightCheek": ([15, 13, 35, 46], (0.0, 0.0), (0.25, 0.25)),
+    "Chin": ([57, 8], (0.0, 0.0), (0.35, 0.15)),
+}
+# The same table as arrays: a (regions x 68) averaging matrix for the anchors, offsets and sizes
+_REGION_ANCHORS = np.array([np.bincount(indices, minlength=68) / len(indices) for indices, _, _ in SKIN_REGIONS.values()])
+_REGION_OFFSETS = np.array([offset for _, offset, _ in SKIN_REGIONS.values()])
+_REGION_HALF_SIZES = np.array([size for _, _, size in SKIN_REGIONS.values()]) / 2
 
 
 class SkinAnalysisResult:
@@ -28,6 +63,43 @@ class SkinAnalysisResult:
         self.user_feedback = None
         self.notes = ""
         self.landmarks = []
+        self.rules_version = None
+        self.sampling_mode = None
+        self.regions = {}
+        self.preprocessing = None
+        # Encoded JPEG thumbnail; stored by the caller, which records where in thumbnail_path
+        self.thumbnail = None
+        self.thumbnail_path = None
+        self.cache_hit = False
+        # True when saving overwrites an earlier SkinAnalysis document instead of adding one
+        self.resubmission = False
+
+    @classmethod
+    def from_cached(cls, data, user_id, image_path):
+        """Rebuilds a result from a cached to_dict() without recomputing it."""
+        result = cls(user_id, image_path)
+        if data["UserID"] == user_id:
+            # Same user resubmitting: keep the ID so saving overwrites the earlier document
+            result.analysis_id = data["AnalysisID"]
+            result.analysis_date = data["AnalysisDate"]
+            result.resubmission = True
+        result.face_detected = data["FaceDetected"]
+        result.skin_tone = data["SkinTone"]
+        result.skin_condition = data["SkinCondition"]
+        result.cr_mean = data["CrMean"]
+        result.cb_mean = data["CbMean"]
+        result.a_mean = data["aMean"]
+        result.b_mean = data["bMean"]
+        result.confidence_score = data["ConfidenceScore"]
+        result.lighting_adjusted = data["LightingAdjusted"]
+        result.recommendations = list(data["Recommendations"])
+        result.notes = data["Notes"]
+        result.landmarks = list(data["Landmarks"])
+        result.rules_version = data.get("RulesVersion")
+        result.sampling_mode = data.get("SamplingMode")
+        result.regions = dict(data.get("Regions") or {})
+        result.cache_hit = True
+        return result
 
     def to_dict(self):
         return {
@@ -47,115 +119,384 @@ class SkinAnalysisResult:
             "Recommendations": self.recommendations,
             "UserFeedback": self.user_feedback,
             "Notes": self.notes,
-            "Landmarks": self.landmarks
+            "Landmarks": self.landmarks,
+            "RulesVersion": self.rules_version,
+            "SamplingMode": self.sampling_mode,
+            "Regions": self.regions,
+            "Preprocessing": self.preprocessing,
+            "ThumbnailPath": self.thumbnail_path
         }
 
 
 class SkinAnalyzer:
-    def __init__(self):
-
-        # --- Google Drive Model Download ---
-        drive_id = "1-HTqUcR9a76I5zrJk95ZrXD6dzH-jowL"
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.model_path = os.path.join(current_dir, "shape_predictor_68_face_landmarks.dat")
-        url = f"https://drive.google.com/uc?id={drive_id}"
-
-        # If model not exists → download
-        if not os.path.exists(self.model_path):
-            print("Downloading face landmark model from Google Drive...")
-            gdown.download(url, self.model_path, quiet=False)
-            print("Download complete!")
-
-        # Load detector + predictor
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor(self.model_path)
-
-
-    def _adjust_lighting(self, roi):
-        ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCrCb)
-        y, cr, cb = cv2.split(ycrcb)
-        y = cv2.equalizeHist(y)
-        adjusted = cv2.merge([y, cr, cb])
-        return cv2.cvtColor(adjusted, cv2.COLOR_YCrCb2BGR)
-
-    def _calculate_metrics(self, roi):
-        ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCrCb)
-        lab = cv2.cvtColor(roi, cv2.COLOR_BGR2LAB)
-        _, cr, cb = cv2.split(ycrcb)
-        l, a, b = cv2.split(lab)
-        return np.mean(cr), np.mean(cb), np.mean(a), np.mean(b)
+    def __init__(self, detection_mode=DETECTION_MODE, detect_max_edge=DETECT_MAX_EDGE, registry=None,
+                 cache=result_cache, rules=None, masked_metrics=MASKED_METRICS, sampling_mode=SAMPLING_MODE,
+                 preprocessor=None):
+        if sampling_mode not in ("box", "regions"):
+            raise ValueError(f"Unknown sampling mode: {sampling_mode}")
+        self.detection_mode = detection_mode
+        self.detect_max_edge = detect_max_edge
+        self.masked_metrics = masked_metrics
+        self.sampling_mode = sampling_mode
+        # Per-thread scratch buffers for the ROI pipeline, keyed by ROI shape
+        self._local = threading.local()
+        self.cache = cache
+        self.rules = rules or rule_engine
+        # Detector + predictor come from the shared registry and load on first use
+        self.registry = registry or model_registry
+        self.preprocessor = preprocessor or image_preprocessor
 
-    def _classify_tone(self, cr, cb, a, b):
-        tone = "Neutral"
-        confidence = 0.6
-        if cr > 150 and b > 140:
-            tone, confidence = "Warm", min((cr - 145) / 40, 1.0)
-        elif cr < 145 and cb > 120:
-            tone, confidence = "Cool", min((150 - cr) / 40, 1.0)
+    @property
+    def detector(self):
+        return self.registry.detector
+
+    @property
+    def predictor(self):
+        return self.registry.predictor
+
+    def _decode(self, data):
+        """(image, preprocessing info): upright and bounded to the working resolution, see image_preprocessing."""
+        return self.preprocessor.decode(data)
+
+    def _finish_upload(self, result, image, info):
+        """Attaches what preprocessing did and the thumbnail to a result analyzed from an upload."""
+        result.preprocessing = info
+        result.thumbnail = self.preprocessor.thumbnail(image)
+        self.preprocessor.record_detection(info, result.face_detected)
+        return result
+
+    def _detect_faces(self, gray):
+        """HOG face detection, on a downscaled copy when the image is larger than needed."""
+        height, width = gray.shape[:2]
+        long_edge = max(height, width)
+        if self.detection_mode == "full" or long_edge <= self.detect_max_edge:
+            return list(self.detector(gray))
+
+        scale = self.detect_max_edge / long_edge
+        small = cv2.resize(gray, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+        # Map the rectangles back to full resolution for landmarking and the ROI crop
+        return [
+            dlib.rectangle(
+                int(face.left() / scale), int(face.top() / scale),
+                int(face.right() / scale), int(face.bottom() / scale)
+            )
+            for face in self.detector(small)
+        ]
+
+    # --- ROI pipeline ---
+    def _buffers(self, shape):
+        """Preallocated scratch arrays for an ROI (or region canvas) of the given (h, w, 3) shape."""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        if shape not in buffers:
+            if len(buffers) >= 8:
+                buffers.clear()
+            h, w = shape[:2]
+            buffers[shape] = {
+                "mask": np.empty((h, w), np.uint8),
+                "y": np.empty((h, w), np.uint8),
+                "skin": np.empty((h, w, 3), np.uint8),
+                "ycrcb": np.empty((h, w, 3), np.uint8),
+                "bgr": np.empty((h, w, 3), np.uint8),
+                "lab": np.empty((h, w, 3), np.uint8),
+                "canvas": np.empty((h, w, 3), np.uint8),
+            }
+        return buffers[shape]
+
+    def _sample_region(self, image, points, cx, cy):
+        """
+        Crops the ROI box around (cx, cy) and builds the landmark mask for that box only.
+        Returns (roi, mask, buffers), or None when the box or the masked area is empty.
+        """
+        height, width = image.shape[:2]
+        x0, y0 = max(cx - ROI_HALF_SIZE, 0), max(cy - ROI_HALF_SIZE, 0)
+        x1, y1 = min(cx + ROI_HALF_SIZE, width), min(cy + ROI_HALF_SIZE, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        roi = image[y0:y1, x0:x1]
+        buffers = self._buffers(roi.shape)
+        mask = buffers["mask"]
+        mask.fill(0)
+
+        # The 68 landmarks do not form a convex polygon, and fillConvexPoly's fill of such
+        # a polygon depends on where it gets clipped. Rasterizing into the polygon's bounding
+        # box (clipped to the image, like the full-frame mask was) keeps the mask identical.
+        polygon = np.asarray(points, dtype=np.int32)
+        px0, py0 = np.maximum(polygon.min(axis=0), 0)
+        px1, py1 = np.minimum(polygon.max(axis=0) + 1, (width, height))
+        ox0, oy0, ox1, oy1 = max(x0, px0), max(y0, py0), min(x1, px1), min(y1, py1)
+        if ox1 > ox0 and oy1 > oy0:
+            face_mask = np.zeros((py1 - py0, px1 - px0), np.uint8)
+            cv2.fillConvexPoly(face_mask, polygon - (px0, py0), 255)
+            mask[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] = face_mask[oy0 - py0:oy1 - py0, ox0 - px0:ox1 - px0]
+
+        if self.masked_metrics and not cv2.countNonZero(mask):
+            return None
+        return roi, mask, buffers
+
+    def _adjust_lighting(self, roi, mask, buffers):
+        """
+        Equalizes the luma of the ROI in the preallocated buffers and returns the corrected BGR ROI.
+        In masked mode only the polygon pixels build the histogram.
+        """
+        if not self.masked_metrics:
+            # Original behaviour: pixels outside the polygon are black and take part
+            skin = buffers["skin"]
+            skin.fill(0)
+            roi = cv2.bitwise_and(roi, roi, dst=skin, mask=mask)
+
+        ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCrCb, dst=buffers["ycrcb"])
+        y = cv2.extractChannel(ycrcb, 0, dst=buffers["y"])
+        if self.masked_metrics:
+            cv2.LUT(y, self._equalization_lut(y, mask), dst=y)
         else:
-            tone, confidence = "Neutral", 0.7
-        return tone, round(confidence, 2)
+            cv2.equalizeHist(y, dst=y)
+        cv2.insertChannel(y, ycrcb, 0)
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=buffers["bgr"])
+
+    @staticmethod
+    def _equalization_lut(y, mask):
+        """cv2.equalizeHist's mapping, built from the histogram of the masked pixels only."""
+        hist = cv2.calcHist([y], [0], mask, [256], [0, 256]).ravel()
+        first = int(np.flatnonzero(hist)[0])
+        total = hist.sum()
+        if hist[first] == total:
+            return np.full(256, first, np.uint8)
+        cdf = np.cumsum(hist) - hist[first]
+        lut = np.clip(np.rint(cdf * (255.0 / (total - hist[first]))), 0, 255)
+        lut[:first] = 0
+        return lut.astype(np.uint8)
+
+    def _convert(self, bgr, buffers):
+        # The corrected ROI is converted back to YCrCb: the BGR round trip rounds Cr/Cb
+        ycrcb = cv2.cvtColor(bgr, cv2.COLOR_BGR2YCrCb, dst=buffers["ycrcb"])
+        lab = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB, dst=buffers["lab"])
+        return ycrcb, lab
+
+    def _calculate_metrics(self, bgr, mask, buffers):
+        """Cr/Cb/a/b means in one masked pass per colour space."""
+        ycrcb, lab = self._convert(bgr, buffers)
+        mean_mask = mask if self.masked_metrics else None
+        _, cr, cb, _ = cv2.mean(ycrcb, mask=mean_mask)
+        _, a, b, _ = cv2.mean(lab, mask=mean_mask)
+        return cr, cb, a, b
+
+    def _channel_samples(self, bgr, mask, buffers):
+        """The per-pixel (Cr, Cb, a, b) values _calculate_metrics averages, as a compact k x 4 array."""
+        ycrcb, lab = self._convert(bgr, buffers)
+        channels = np.concatenate((ycrcb[:, :, 1:3], lab[:, :, 1:3]), axis=2)
+        if self.masked_metrics:
+            return channels[mask > 0]
+        return channels.reshape(-1, 4)
+
+    def _measure(self, image, points, cx, cy):
+        """Channel means of the skin box centred on (cx, cy), or None when it is empty."""
+        sample = self._sample_region(image, points, cx, cy)
+        if sample is None:
+            return None
+        roi, mask, buffers = sample
+        return self._calculate_metrics(self._adjust_lighting(roi, mask, buffers), mask, buffers)
+
+    def _region_boxes(self, points, width, height):
+        """(x0, y0, x1, y1) of every SKIN_REGIONS box, clipped to the image, as an int array."""
+        points = np.asarray(points, dtype=np.float64)
+        scale = np.hypot(*(points[45] - points[36]))
+        centres = _REGION_ANCHORS @ points + _REGION_OFFSETS * scale
+        half = _REGION_HALF_SIZES * scale
+        boxes = np.rint(np.hstack((centres - half, centres + half))).astype(np.intp)
+        return np.clip(boxes, 0, [width, height, width, height])
+
+    def _measure_regions(self, image, points):
+        """
+        Channel means of every skin region in one pass: the region crops are packed side
+        by side into one canvas, which is lighting-corrected and converted once, and each
+        region's sums are read from an integral image of the (Cr, Cb, a, b) channels.
+        Returns (median of the region means, {region: metrics}), or None when no region is usable.
+        """
+        height, width = image.shape[:2]
+        boxes = self._region_boxes(points, width, height)
+        widths = (boxes[:, 2] - boxes[:, 0]).clip(0)
+        heights = (boxes[:, 3] - boxes[:, 1]).clip(0)
+        valid = widths * heights >= MIN_REGION_PIXELS
+        if not valid.any():
+            return None
+        boxes, widths, heights = boxes[valid], widths[valid], heights[valid]
+
+        offsets = np.concatenate(([0], np.cumsum(widths)[:-1]))
+        canvas_shape = (int(heights.max()), int(widths.sum()), 3)
+        buffers = self._buffers(canvas_shape)
+        canvas, mask = buffers["canvas"], buffers["mask"]
+        mask.fill(0)
+        for (x0, y0, x1, y1), offset in zip(boxes, offsets):
+            canvas[:y1 - y0, offset:offset + x1 - x0] = image[y0:y1, x0:x1]
+            mask[:y1 - y0, offset:offset + x1 - x0] = 255
+
+        ycrcb, lab = self._convert(self._adjust_lighting(canvas, mask, buffers), buffers)
+        channels = np.concatenate((ycrcb[:, :, 1:3], lab[:, :, 1:3]), axis=2)
+        integral = cv2.integral(channels, sdepth=cv2.CV_64F)
+
+        x0, x1 = offsets, offsets + widths
+        sums = integral[heights, x1] - integral[0, x1] - integral[heights, x0] + integral[0, x0]
+        means = sums / (widths * heights)[:, np.newaxis]
+
+        names = [name for name, ok in zip(SKIN_REGIONS, valid) if ok]
+        regions = {
+            name: {
+                "CrMean": round(float(cr), 2), "CbMean": round(float(cb), 2),
+                "aMean": round(float(a), 2), "bMean": round(float(b), 2),
+                "Pixels": int(w * h),
+            }
+            for name, (cr, cb, a, b), w, h in zip(names, means, widths, heights)
+        }
+        return tuple(np.median(means, axis=0)), regions
+
+    def _sample(self, image, located, result):
+        """Channel means for the configured sampling mode; None when nothing could be sampled."""
+        result.sampling_mode = self.sampling_mode
+        if self.sampling_mode == "box":
+            return self._measure(image, *located)
+
+        points, _, _ = located
+        measured = self._measure_regions(image, points)
+        if measured is None:
+            return None
+        metrics, result.regions = measured
+        return metrics
+
+    # --- Classification (rules live in config/classification_rules.json) ---
+    def _classify_tone(self, cr, cb, a, b):
+        tone, confidence, _ = self.rules.classify_one(cr, cb, a, b)
+        return tone, confidence
 
     def _detect_condition(self, cr, cb, a, b):
-        if a > 140 and b < 130:
-            return "Oily"
-        elif b > 150:
-            return "Dry"
-        else:
-            return "Balanced"
+        return self.rules.classify_one(cr, cb, a, b)[2]
 
     def _recommend_products(self, tone, condition):
-        rules = {
-            ("Warm", "Oily"): ["Oil-Free Moisturizer", "Matte Sunscreen"],
-            ("Cool", "Dry"): ["Hydrating Cream", "Aloe Soothing Gel"],
-            ("Neutral", "Balanced"): ["Gentle Cleanser", "Light Moisturizer"]
-        }
-        return rules.get((tone, condition), ["General Skincare Kit"])
+        return self.rules.recommend(tone, condition, "summary")
 
     def analyze_image(self, image_path, user_id="UnknownUser"):
+        """Analyze an image stored on disk; it goes through the same preprocessing as uploads."""
+        try:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        return self.analyze_bytes(data, user_id, image_path)
+
+    def analyze_bytes(self, data, user_id="UnknownUser", image_path=None):
+        """Analyze an encoded image (JPEG/PNG...) held in memory, e.g. an upload buffer."""
+        with stage("analysis", "decode"):
+            image, info = self._decode(data)
+        return self._finish_upload(self.analyze_array(image, user_id, image_path), image, info)
+
+    def version(self):
+        """Identifies everything that changes the output for a given image."""
+        return (f"{ANALYZER_VERSION}:{self.rules.version}:{self.detection_mode}:{self.detect_max_edge}:"
+                f"{int(self.masked_metrics)}:{self.sampling_mode}:{self.preprocessor.version()}")
+
+    def analyze_array(self, image, user_id="UnknownUser", image_path=None):
+        """Analyze an already decoded BGR image, reusing a cached result for identical pixels."""
+        if image is None or self.cache is None:
+            return self._analyze_uncached(image, user_id, image_path)
+
+        with stage("analysis", "cache_lookup"):
+            key = image_key(image, self.version())
+            cached = self.cache.get(key)
+        if cached is not None:
+            return SkinAnalysisResult.from_cached(cached, user_id, image_path)
+
+        result = self._analyze_uncached(image, user_id, image_path)
+        self.cache.put(key, result.to_dict())
+        return result
+
+    def _analyze_uncached(self, image, user_id, image_path):
+        result = SkinAnalysisResult(user_id, image_path)
+        located = self._locate_face(image, result)
+        if located is None:
+            return result
+
+        with stage("analysis", "color_metrics"):
+            metrics = self._sample(image, located, result)
+        if metrics is None:
+            result.notes = "ROI is empty or invalid."
+            return result
+
+        with stage("analysis", "classify"):
+            self._apply_metrics(result, *metrics)
+        return result
+
+    def prepare_bytes(self, data, user_id="UnknownUser", image_path=None):
+        with stage("analysis", "decode"):
+            image, info = self._decode(data)
+        result, samples = self.prepare_array(image, user_id, image_path)
+        return self._finish_upload(result, image, info), samples
+
+    def prepare_array(self, image, user_id="UnknownUser", image_path=None):
+        """
+        Runs detection, landmarking and lighting correction.
+        Returns (result, samples) where samples is a k x 4 (Cr, Cb, a, b) array whose mean
+        finalize_batch uses as the image's metrics: the skin pixels in box mode, the single
+        aggregated row in regions mode. samples is None when the analysis stopped early.
+        """
         result = SkinAnalysisResult(user_id, image_path)
-        image = cv2.imread(image_path)
+        located = self._locate_face(image, result)
+        if located is None:
+            return result, None
 
+        if self.sampling_mode == "regions":
+            with stage("analysis", "color_metrics"):
+                metrics = self._sample(image, located, result)
+            if metrics is None:
+                result.notes = "ROI is empty or invalid."
+                return result, None
+            return result, np.array([metrics], dtype=np.float64)
+
+        result.sampling_mode = self.sampling_mode
+        with stage("analysis", "color_metrics"):
+            sample = self._sample_region(image, *located)
+            if sample is None:
+                result.notes = "ROI is empty or invalid."
+                return result, None
+
+            roi, mask, buffers = sample
+            return result, self._channel_samples(self._adjust_lighting(roi, mask, buffers), mask, buffers)
+
+    def _locate_face(self, image, result):
+        """Detection and landmarking. Returns (points, cx, cy) of the first face, or None."""
         if image is None:
             result.notes = "Image not found or unreadable."
-            return result
+            return None
 
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.detector(gray)
+        with stage("analysis", "detect"):
+            faces = self._detect_faces(gray)
         if not faces:
             result.notes = "No face detected."
-            return result
+            return None
 
         face = faces[0]
         result.face_detected = True
 
-        landmarks = self.predictor(gray, face)
+        with stage("analysis", "landmarks"):
+            landmarks = self.predictor(gray, face)
         points = [(landmarks.part(i).x, landmarks.part(i).y) for i in range(68)]
         result.landmarks = [{"x": x, "y": y} for x, y in points]
 
-        mask = np.zeros_like(image)
-        cv2.fillConvexPoly(mask, np.array(points, dtype=np.int32), (255, 255, 255))
-        skin_region = cv2.bitwise_and(image, mask)
-
         cx = face.left() + face.width() // 2
         cy = face.top() + face.height() // 2
-        box_size = 40
-        roi = skin_region[cy - box_size:cy + box_size, cx - box_size:cx + box_size]
-
-        if roi.size == 0:
-            result.notes = "ROI is empty or invalid."
-            return result
-
-        roi = self._adjust_lighting(roi)
-        cr_mean, cb_mean, a_mean, b_mean = self._calculate_metrics(roi)
+        return points, cx, cy
 
+    def _apply_metrics(self, result, cr_mean, cb_mean, a_mean, b_mean, classification=None):
         result.cr_mean = round(float(cr_mean), 2)
         result.cb_mean = round(float(cb_mean), 2)
         result.a_mean = round(float(a_mean), 2)
         result.b_mean = round(float(b_mean), 2)
 
-        tone, confidence = self._classify_tone(cr_mean, cb_mean, a_mean, b_mean)
-        condition = self._detect_condition(cr_mean, cb_mean, a_mean, b_mean)
+        tone, confidence, condition = classification or self.rules.classify_one(cr_mean, cb_mean, a_mean, b_mean)
+        result.rules_version = self.rules.version
 
         result.skin_tone = tone
         result.skin_condition = condition
@@ -163,4 +504,71 @@ class SkinAnalyzer:
         result.recommendations = self._recommend_products(tone, condition)
         result.notes = f"Tone: {tone}, Condition: {condition}, Confidence: {confidence}"
 
-        return result
+    # --- Batch analysis ---
+    def analyze_batch(self, images, user_id="UnknownUser", image_names=None):
+        """
+        Analyze several encoded images of the same user.
+        The API fans prepare_bytes out over the worker pool and only calls finalize_batch;
+        this method is the in-process equivalent.
+        """
+        image_names = image_names or [None] * len(images)
+        prepared = [self.prepare_bytes(data, user_id, name) for data, name in zip(images, image_names)]
+        return self.finalize_batch(prepared)
+
+    def finalize_batch(self, prepared):
+        """
+        Computes the Cr/Cb/a/b means of all prepared images in one vectorized step
+        and classifies each result. `prepared` is a list of (result, samples) pairs.
+        """
+        samples = [channels for _, channels in prepared if channels is not None]
+        if samples:
+            counts = np.array([len(channels) for channels in samples])
+            offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            means = np.add.reduceat(np.concatenate(samples).astype(np.float64), offsets, axis=0) / counts[:, np.newaxis]
+            classified = self.rules.classify(*means.T)
+
+        results = []
+        index = 0
+        for result, channels in prepared:
+            if channels is not None:
+                classification = (
+                    classified["tone"][index], float(classified["confidence"][index]), classified["condition"][index]
+                )
+                self._apply_metrics(result, *means[index], classification=classification)
+                index += 1
+            results.append(result)
+        return results
+
+    def aggregate_results(self, results):
+        """Tone/condition for a whole set of analyses, based on the mean of their metrics."""
+        analyzed = [r for r in results if r.cr_mean is not None]
+        summary = {
+            "ImagesSubmitted": len(results),
+            "ImagesAnalyzed": len(analyzed),
+            "SkinTone": None,
+            "SkinCondition": None,
+            "ConfidenceScore": 0.0,
+            "ToneVotes": {},
+            "ConditionVotes": {},
+        }
+        if not analyzed:
+            return summary
+
+        metrics = np.array([[r.cr_mean, r.cb_mean, r.a_mean, r.b_mean] for r in analyzed]).mean(axis=0)
+        cr_mean, cb_mean, a_mean, b_mean = (float(m) for m in metrics)
+        tone, confidence, condition = self.rules.classify_one(cr_mean, cb_mean, a_mean, b_mean)
+
+        for r in analyzed:
+            summary["ToneVotes"][r.skin_tone] = summary["ToneVotes"].get(r.skin_tone, 0) + 1
+            summary["ConditionVotes"][r.skin_condition] = summary["ConditionVotes"].get(r.skin_condition, 0) + 1
+
+        summary.update({
+            "SkinTone": tone,
+            "SkinCondition": condition,
+            "ConfidenceScore": confidence,
+            "CrMean": round(cr_mean, 2),
+            "CbMean": round(cb_mean, 2),
+            "aMean": round(a_mean, 2),
+            "bMean": round(b_mean, 2),
+        })
+        return summary
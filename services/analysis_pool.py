@@ -0,0 +1,304 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# ==================================================
+# POOL CONFIGURATION
+# ==================================================
+ANALYSIS_WORKERS = max(1, int(os.environ.get("SKINGLOSS_ANALYSIS_WORKERS", os.cpu_count() or 1)))
+# Jobs allowed to wait for a free worker before new requests are rejected with 429.
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("SKINGLOSS_ANALYSIS_QUEUE_SIZE", ANALYSIS_WORKERS * 4))
+# Seconds a queued job may wait for a worker before it is rejected with 503.
+ANALYSIS_QUEUE_TIMEOUT = float(os.environ.get("SKINGLOSS_ANALYSIS_QUEUE_TIMEOUT", 30))
+# Seconds a worker may take on one job before the request gives up with 503; the slot stays
+# taken until the worker really finishes, so a stuck job never lets the pool run more jobs than it has workers.
+ANALYSIS_JOB_TIMEOUT = float(os.environ.get("SKINGLOSS_ANALYSIS_JOB_TIMEOUT", 120))
+# Concurrent camera streams (WebSocket /analysis/stream); more are closed with 1013 (try again later).
+STREAM_MAX_SESSIONS = max(1, int(os.environ.get("SKINGLOSS_STREAM_MAX_SESSIONS", 2)))
+
+
+# ==================================================
+# WORKER PROCESS SIDE
+# ==================================================
+_worker_analyzer = None
+
+
+def _init_worker():
+    """
+    Create the worker's analyzer. Models preloaded in the parent are inherited
+    through fork; otherwise they load once here on first use.
+    """
+    global _worker_analyzer
+    from services.analysis_logic import SkinAnalyzer
+    _worker_analyzer = SkinAnalyzer()
+
+
+def _analyze_in_worker(image_bytes, user_id, image_name):
+    return _worker_analyzer.analyze_bytes(image_bytes, user_id, image_name)
+
+
+def _prepare_in_worker(image_bytes, user_id, image_name):
+    return _worker_analyzer.prepare_bytes(image_bytes, user_id, image_name)
+
+
+# ==================================================
+# ERRORS
+# ==================================================
+class PoolSaturated(Exception):
+    """Raised when the wait queue is full and the job was not accepted."""
+
+
+class PoolTimeout(Exception):
+    """Raised when a job waited longer than the queue timeout for a worker, or ran past the job timeout."""
+
+
+class JobTimeout(PoolTimeout):
+    """Raised when a job got a worker but ran past the job timeout."""
+
+
+class WorkerLost(Exception):
+    """Raised when the worker process running the job died (e.g. killed for memory or crashed in dlib)."""
+
+
+# ==================================================
+# ANALYSIS POOL
+# ==================================================
+class AnalysisPool:
+    """Bounded process pool that keeps dlib/OpenCV work off the event loop."""
+
+    def __init__(self, workers=ANALYSIS_WORKERS, queue_size=ANALYSIS_QUEUE_SIZE,
+                 queue_timeout=ANALYSIS_QUEUE_TIMEOUT, job_timeout=ANALYSIS_JOB_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.job_timeout = job_timeout
+        self._executor = None
+        self._startup = None
+        self._slots = asyncio.Semaphore(workers)
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._hung = 0
+        self._lost = 0
+        self._restarts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # fork lets workers share the models already loaded by the parent
+            context = None
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context, initializer=_init_worker
+            )
+        return self._executor
+
+    def _discard_executor(self, executor):
+        """Drops a broken executor; the next job starts a fresh one."""
+        if self._executor is executor:
+            self._executor = None
+            self._restarts += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, args):
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            return executor, loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # Broken by an earlier job's worker; this job has not run, so it gets a fresh executor
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            return executor, loop.run_in_executor(executor, fn, *args)
+
+    def _release_slot(self, future=None):
+        if future is not None and not future.cancelled():
+            # Retrieved so a late failure of an abandoned job is not reported as unhandled
+            future.exception()
+        self._running -= 1
+        self._completed += 1
+        self._slots.release()
+
+    def hold_until(self, startup):
+        """
+        Holds jobs back until `startup` (the model preload task) is done. Workers are
+        forked on demand, and one forked while another thread is inside
+        ModelRegistry.load() would start with its lock held.
+        """
+        self._startup = startup
+
+    async def _wait_for_startup(self):
+        startup = self._startup
+        if startup is None or startup.done():
+            return
+        # asyncio.wait, unlike wait_for, leaves the startup task running when this job gives up
+        done, _ = await asyncio.wait({startup}, timeout=self.queue_timeout)
+        if not done:
+            self._timed_out += 1
+            raise PoolTimeout(f"Face models did not finish loading within {self.queue_timeout}s.")
+
+    # --------------------------------------------------
+    def _admit(self, jobs=1):
+        if self._pending + jobs > self.workers + self.queue_size:
+            self._rejected += jobs
+            raise PoolSaturated(f"Analysis queue is full ({self.queue_size} waiting).")
+        self._pending += jobs
+
+    async def _execute(self, fn, args):
+        enqueued_at = time.perf_counter()
+        try:
+            await self._wait_for_startup()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._timed_out += 1
+                raise PoolTimeout(f"No analysis worker became free within {self.queue_timeout}s.")
+
+            waited = time.perf_counter() - enqueued_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._running += 1
+            deferred = False
+            try:
+                executor, future = self._submit(fn, args)
+                try:
+                    # Shielded: a timeout gives up waiting, but the worker keeps the job
+                    return await asyncio.wait_for(asyncio.shield(future), timeout=self.job_timeout)
+                except asyncio.TimeoutError:
+                    self._hung += 1
+                    # The worker is still busy with the job: its slot is freed once it really finishes
+                    future.add_done_callback(self._release_slot)
+                    deferred = True
+                    raise JobTimeout(f"Analysis did not finish within {self.job_timeout}s.")
+                except asyncio.CancelledError:
+                    # The request went away; same as a timeout, the worker still has the job
+                    if not future.done():
+                        future.add_done_callback(self._release_slot)
+                        deferred = True
+                    raise
+                except BrokenProcessPool:
+                    self._lost += 1
+                    self._discard_executor(executor)
+                    raise WorkerLost("The analysis worker stopped unexpectedly; please retry.")
+            finally:
+                if not deferred:
+                    self._release_slot()
+        finally:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process, waiting at most queue_timeout for a free slot."""
+        self._admit()
+        return await self._execute(fn, args)
+
+    async def map(self, fn, arg_list):
+        """
+        Run fn over every argument tuple, results in order. The batch holds at most `workers`
+        places in the queue at a time and its other items take over places as earlier ones
+        finish, so a batch of any size fits an idle pool; it is admitted or rejected as a whole
+        on those first places.
+        """
+        lanes = min(len(arg_list), self.workers)
+        self._admit(lanes)
+        results = [None] * len(arg_list)
+        items = iter(enumerate(arg_list))
+
+        async def lane(index, args):
+            while True:
+                results[index] = await self._execute(fn, args)
+                try:
+                    index, args = next(items)
+                except StopIteration:
+                    return
+                # Takes over the place the finished item just left
+                self._pending += 1
+
+        await asyncio.gather(*(lane(*next(items)) for _ in range(lanes)))
+        return results
+
+    async def analyze_bytes(self, image_bytes, user_id, image_name=None):
+        """Analyze an in-memory image in the pool and return the SkinAnalysisResult."""
+        return await self.run(_analyze_in_worker, image_bytes, user_id, image_name)
+
+    async def prepare_many(self, images, user_id, image_names):
+        """Detection/landmarking for a batch; returns (result, samples) pairs for SkinAnalyzer.finalize_batch."""
+        return await self.map(_prepare_in_worker, [
+            (image_bytes, user_id, name) for image_bytes, name in zip(images, image_names)
+        ])
+
+    # --------------------------------------------------
+    def stats(self):
+        """Queue depth and wait-time metrics."""
+        started = self._completed + self._running
+        return {
+            "workers": self.workers,
+            "queue_capacity": self.queue_size,
+            "queue_depth": self._pending - self._running,
+            "running": self._running,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+            "job_timeouts": self._hung,
+            "workers_lost": self._lost,
+            "executor_restarts": self._restarts,
+            "avg_wait_seconds": round(self._wait_total / started, 4) if started else 0.0,
+            "max_wait_seconds": round(self._wait_max, 4),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# ==================================================
+# STREAM LIMITER
+# ==================================================
+class StreamLimiter:
+    """
+    Bounds the camera streams analyzed in the API process. Stream sessions keep
+    tracker state between frames, so they cannot move to the worker pool; instead
+    at most `max_sessions` run at once, each frame on a thread of their own
+    executor rather than the API's request threadpool.
+    """
+
+    def __init__(self, max_sessions=STREAM_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._executor = None
+        self._active = 0
+        self._rejected = 0
+
+    def acquire(self):
+        """Takes a stream slot; False when all are in use."""
+        if self._active >= self.max_sessions:
+            self._rejected += 1
+            return False
+        self._active += 1
+        return True
+
+    def release(self):
+        self._active -= 1
+
+    async def run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_sessions, thread_name_prefix="stream")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def stats(self):
+        return {"max_sessions": self.max_sessions, "active": self._active, "rejected": self._rejected}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+analysis_pool = AnalysisPool()
+stream_limiter = StreamLimiter()
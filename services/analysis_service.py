@@ -1,16 +1,279 @@
-from services.analysis_logic import SkinAnalyzer
-from config.firebase_config import db
-import uuid
+import datetime
+import os
+from collections import Counter
+from config.firebase_config import get_bucket, get_db
+from services.write_buffer import write_buffer
+from services.instrumentation import instrumented, stage
+from services.pagination import fetch_page, new_read_cache, InvalidPageToken, DEFAULT_PAGE_SIZE
+
+THUMBNAIL_PREFIX = "thumbnails"
+
+# ==================================================
+# ROLLUP CONFIGURATION
+# ==================================================
+ANALYSIS_COLLECTION = "SkinAnalysis"
+# One document per user, period and week/month, e.g. AnalysisRollups/{user}_week_2026-W42
+ROLLUPS_COLLECTION = "AnalysisRollups"
+ROLLUP_PERIODS = ("week", "month")
+ROLLUP_METRICS = ("CrMean", "CbMean", "aMean", "bMean")
+# Periods averaged together for a trend point's rolling means
+TREND_WINDOW = int(os.environ.get("SKINGLOSS_TREND_WINDOW", 4))
+TREND_DEFAULT_POINTS = 12
+TREND_MAX_POINTS = 104
+
+
+def store_thumbnail(bucket, result):
+    """Uploads the result's thumbnail, if it has one, and records its gs:// path on the result."""
+    if result.thumbnail is None or bucket is None:
+        return
+    path = f"{THUMBNAIL_PREFIX}/{result.user_id}/{result.analysis_id}.jpg"
+    try:
+        bucket.blob(path).upload_from_string(result.thumbnail, content_type="image/jpeg")
+    except Exception as e:
+        # The analysis is still saved, just without a thumbnail
+        print(f"Thumbnail upload failed for {result.analysis_id}: {e}")
+        return
+    result.thumbnail_path = f"gs://{bucket.name}/{path}"
+
+
+# ==================================================
+# ROLLUPS
+# ==================================================
+def period_start(period, when):
+    """First day of the week (Monday) or month containing `when`."""
+    day = when.date() if isinstance(when, datetime.datetime) else when
+    if period == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown period: {period}")
+
+
+def period_key(period, start):
+    """"2026-W42" or "2026-10" for a period starting on `start`."""
+    if period == "week":
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{start.year}-{start.month:02d}"
+
+
+def recent_periods(period, end, count):
+    """Start dates of the `count` periods up to the one containing `end`, oldest first."""
+    start = period_start(period, end)
+    starts = [start]
+    for _ in range(count - 1):
+        # The previous week starts 7 days earlier, the previous month on the 1st before this one
+        previous = start - datetime.timedelta(days=7 if period == "week" else 1)
+        start = period_start(period, previous)
+        starts.append(start)
+    return starts[::-1]
+
+
+def rollup_id(user_id, period, start):
+    return f"{user_id}_{period}_{period_key(period, start)}"
+
+
+def rollup_totals(added=(), removed=(), totals=None):
+    """
+    {(user_id, period, period start): {"Count", "Sums", "Conditions", "Tones"}} summed over
+    analysis dicts, `removed` ones counting negatively, optionally into existing `totals`.
+    Analyses without metrics are left out.
+    """
+    totals = {} if totals is None else totals
+    for analyses, sign in ((added, 1), (removed, -1)):
+        for data in analyses:
+            if not data.get("FaceDetected") or any(data.get(metric) is None for metric in ROLLUP_METRICS):
+                continue
+            try:
+                when = datetime.datetime.fromisoformat(data["AnalysisDate"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            for period in ROLLUP_PERIODS:
+                key = (data["UserID"], period, period_start(period, when))
+                entry = totals.get(key)
+                if entry is None:
+                    entry = totals[key] = {
+                        "Count": 0, "Sums": dict.fromkeys(ROLLUP_METRICS, 0.0),
+                        "Conditions": Counter(), "Tones": Counter(),
+                    }
+                entry["Count"] += sign
+                for metric in ROLLUP_METRICS:
+                    entry["Sums"][metric] += sign * float(data[metric])
+                if data.get("SkinCondition"):
+                    entry["Conditions"][data["SkinCondition"]] += sign
+                if data.get("SkinTone"):
+                    entry["Tones"][data["SkinTone"]] += sign
+    return totals
+
+
+def rollup_document(key, entry, increment=True):
+    """The AnalysisRollups document for one rollup_totals() entry, as Increments or absolute values."""
+    from firebase_admin import firestore
+
+    value = firestore.Increment if increment else (lambda v: v)
+    user_id, period, start = key
+    document = {
+        "UserID": user_id,
+        "Period": period,
+        "Key": period_key(period, start),
+        "Start": start.isoformat(),
+        "Count": value(entry["Count"]),
+        "Sums": {metric: value(total) for metric, total in entry["Sums"].items()},
+        "LastUpdated": datetime.datetime.now().isoformat(),
+    }
+    for field in ("Conditions", "Tones"):
+        counts = {label: value(n) for label, n in entry[field].items() if n}
+        # A merged empty map would replace the stored counts rather than leave them alone
+        if counts or not increment:
+            document[field] = counts
+    return document
+
+
+def rollup_writes(db, added=(), removed=()):
+    """
+    Write-buffer ("set", ref, data, merge) tuples moving the weekly and monthly rollups
+    by the added/removed analyses. Committed in the same batch as the analyses, so the
+    rollups always match the stored documents.
+    """
+    rollups = db.collection(ROLLUPS_COLLECTION)
+    return [
+        ("set", rollups.document(rollup_id(*key)), rollup_document(key, entry), True)
+        for key, entry in rollup_totals(added, removed).items()
+        # An analysis re-scored without any change moves nothing
+        if entry["Count"] or any(entry["Sums"].values()) or any(entry["Conditions"].values())
+        or any(entry["Tones"].values())
+    ]
+
+
+def _rolled_up(results):
+    """Results that add a SkinAnalysis document; a resubmission overwrites one already counted."""
+    return [result.to_dict() for result in results if not result.resubmission]
+
 
 class AnalysisService:
     """Service to analyze skin images and save results to Firestore."""
-    def __init__(self):
-        self.analyzer = SkinAnalyzer()
+    def __init__(self, db=None, bucket=None):
+        self.db = db or get_db()
+        self.bucket = bucket
+        self.collection = self.db.collection(ANALYSIS_COLLECTION)
+        self.rollups = self.db.collection(ROLLUPS_COLLECTION)
+        self.read_cache = new_read_cache()
+        self._analyzer = None
+
+    def _invalidate_user(self, user_id):
+        self.read_cache.invalidate_where(lambda key: key[1] == user_id)
+
+    @property
+    def analyzer(self):
+        # Created on first use: saving results from the worker pool needs no OpenCV/dlib in this process
+        if self._analyzer is None:
+            from services.analysis_logic import SkinAnalyzer
+            self._analyzer = SkinAnalyzer()
+        return self._analyzer
 
     def analyze_and_save(self, user_id, image_path):
-        result = self.analyzer.analyze_image(image_path, user_id)
+        with stage("analysis", "analyze"):
+            result = self.analyzer.analyze_image(image_path, user_id)
+        return self.save_result(result)
+
+    def _store_thumbnail(self, result):
+        if result.thumbnail is not None:
+            with stage("analysis", "thumbnail"):
+                store_thumbnail(self.bucket if self.bucket is not None else get_bucket(), result)
+
+    def save_result(self, result):
+        self._store_thumbnail(result)
         data = result.to_dict()
 
-        # Save to Firestore
-        db.collection("SkinAnalysis").document(data["AnalysisID"]).set(data)
-        return data
\ No newline at end of file
+        # Save to Firestore (batched by the write-behind buffer), together with the user's rollups.
+        # Waits for the commit: clients list their history right after an analysis.
+        with stage("analysis", "save"):
+            write_buffer.group(
+                [("set", self.collection.document(data["AnalysisID"]), data, False)]
+                + rollup_writes(self.db, _rolled_up([result])),
+                wait=True,
+            )
+        self._invalidate_user(result.user_id)
+        return data
+
+    def finalize_and_save_batch(self, prepared):
+        """Finishes a batch prepared by the worker pool and stores it."""
+        return self.save_batch(self.analyzer.finalize_batch(prepared))
+
+    def save_batch(self, results):
+        """Stores all results with batched writes and returns per-image data plus the set aggregate."""
+        for result in results:
+            self._store_thumbnail(result)
+        docs = [result.to_dict() for result in results]
+
+        with stage("analysis", "save_batch"):
+            write_buffer.group(
+                [("set", self.collection.document(data["AnalysisID"]), data, False) for data in docs]
+                + rollup_writes(self.db, _rolled_up(results)),
+                wait=True,
+            )
+        for user_id in {result.user_id for result in results}:
+            self._invalidate_user(user_id)
+
+        return {"results": docs, "aggregate": self.analyzer.aggregate_results(results)}
+
+    # --------------------------------------------------
+    @instrumented("analysis", "list_user")
+    def get_analyses_by_user(self, user_id, limit=DEFAULT_PAGE_SIZE, start_after=None, fields=None):
+        """Retrieve a user's analyses, newest first, one page at a time."""
+        key = ("list", user_id, limit, start_after, tuple(fields) if fields else None)
+        page = self.read_cache.get(key)
+        if page is None:
+            try:
+                page = fetch_page(self.collection, "UserID", user_id, "AnalysisDate", limit, start_after, fields)
+            except InvalidPageToken:
+                return {"error": "Invalid page token."}
+            self.read_cache.set(key, page)
+        if not page["items"] and not start_after:
+            return {**page, "message": "No analyses found for this user."}
+        return page
+
+    # --------------------------------------------------
+    @instrumented("analysis", "trend")
+    def get_trend(self, user_id, period="week", points=TREND_DEFAULT_POINTS, window=TREND_WINDOW, end=None):
+        """
+        The user's last `points` weeks/months up to `end` (default today), oldest first:
+        per period the analysis count, metric means, condition and tone counts, and the
+        metric means over the trailing `window` periods. Reads points + window - 1 rollup
+        documents by ID, however long the history.
+        """
+        end = end or datetime.date.today()
+        key = ("trend", user_id, period, points, window, end.isoformat())
+        trend = self.read_cache.get(key)
+        if trend is not None:
+            return trend
+
+        starts = recent_periods(period, end, points + window - 1)
+        refs = [self.rollups.document(rollup_id(user_id, period, start)) for start in starts]
+        found = {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+        rollups = [found.get(ref.id, {}) for ref in refs]
+
+        def means(count, sums):
+            return {metric: round(sums.get(metric, 0.0) / count, 2) if count else None for metric in ROLLUP_METRICS}
+
+        trend_points = []
+        for i in range(window - 1, len(starts)):
+            rollup = rollups[i]
+            count = rollup.get("Count", 0)
+            trailing = rollups[i - window + 1:i + 1]
+            rolling_count = sum(r.get("Count", 0) for r in trailing)
+            rolling_sums = {m: sum(r.get("Sums", {}).get(m, 0.0) for r in trailing) for m in ROLLUP_METRICS}
+            trend_points.append({
+                "Period": period_key(period, starts[i]),
+                "Start": starts[i].isoformat(),
+                "Count": count,
+                "Means": means(count, rollup.get("Sums", {})),
+                "RollingCount": rolling_count,
+                "RollingMeans": means(rolling_count, rolling_sums),
+                "Conditions": {label: n for label, n in rollup.get("Conditions", {}).items() if n},
+                "Tones": {label: n for label, n in rollup.get("Tones", {}).items() if n},
+            })
+
+        trend = {"UserID": user_id, "Period": period, "Window": window, "Points": trend_points}
+        self.read_cache.set(key, trend)
+        return trend
@@ -1,6 +1,12 @@
 import datetime
+import hashlib
+import os
+import random
 import uuid
-from firebase_admin import firestore
+from config.firebase_config import get_db
+from services.write_buffer import write_buffer
+from services.pagination import fetch_page, new_read_cache, InvalidPageToken, DEFAULT_PAGE_SIZE
+from services.instrumentation import instrumented
 
 # ==================================================
 # FEEDBACK DATA MODEL
@@ -8,13 +14,15 @@ from firebase_admin import firestore
 class Feedback:
     """Model for user feedback on product recommendation or skin analysis results."""
 
-    def __init__(self, user_id, category, reference_id, rating, comments=""):
+    def __init__(self, user_id, category, reference_id, rating, comments="", skin_tone=None, skin_condition=None):
         """
         :param user_id: ID of the user giving feedback
         :param category: 'Product' or 'Analysis'
         :param reference_id: The ID of the product or analysis being rated
         :param rating: Integer rating (1-5)
         :param comments: Optional text feedback
+        :param skin_tone: Optional skin tone of the recommendation the product came from
+        :param skin_condition: Optional skin condition of that recommendation
         """
         self.feedback_id = str(uuid.uuid4())
         self.user_id = user_id
@@ -22,18 +30,80 @@ class Feedback:
         self.reference_id = reference_id
         self.rating = rating
         self.comments = comments
+        self.skin_tone = skin_tone
+        self.skin_condition = skin_condition
         self.date = datetime.datetime.now().isoformat()
+        self.updated_at = self.date
 
     def to_dict(self):
-        return {
+        data = {
             "FeedbackID": self.feedback_id,
             "UserID": self.user_id,
             "Category": self.category,
             "ReferenceID": self.reference_id,
             "Rating": self.rating,
             "Comments": self.comments,
-            "Date": self.date
+            "Date": self.date,
+            "UpdatedAt": self.updated_at
         }
+        # The segment a product rating counts towards in recommendation ranking
+        if self.skin_tone and self.skin_condition:
+            data["SkinTone"] = self.skin_tone
+            data["SkinCondition"] = self.skin_condition
+        return data
+
+
+# Rating aggregates per ReferenceID/Category are spread over this many counter
+# documents so popular references do not hit the per-document write limit.
+SUMMARY_SHARDS = int(os.environ.get("SKINGLOSS_FEEDBACK_SUMMARY_SHARDS", 4))
+RATING_VALUES = (1, 2, 3, 4, 5)
+INVALID_RATING = {"error": "Rating must be an integer from 1 to 5."}
+
+
+def valid_rating(rating):
+    # bool is an int subclass; True must not count as a 1-star rating
+    return isinstance(rating, int) and not isinstance(rating, bool) and rating in RATING_VALUES
+
+
+# ==================================================
+# SUMMARY COUNTERS
+# ==================================================
+SUMMARY_COLLECTION = "FeedbackSummary"
+SUMMARY_KINDS = (("reference", "ReferenceID"), ("category", "Category"))
+
+
+def summary_id(kind, key, shard):
+    """
+    Counter document ID, e.g. "reference_<sha1 of the ReferenceID>_2". The key is hashed
+    because product names come from the product API and may contain "/"; the raw value
+    is kept in the document's Key field.
+    """
+    digest = hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+    return f"{kind}_{digest}_{shard}"
+
+
+def summary_totals(feedbacks, totals=None):
+    """
+    {(kind, key): {"Count", "Sum", "Histogram"}} over Feedback documents, counted the way
+    add_feedback counts them; used to rebuild the counters (scripts/backfill_analysis.py).
+    """
+    totals = {} if totals is None else totals
+    for data in feedbacks:
+        try:
+            rating = int(data.get("Rating"))
+        except (TypeError, ValueError):
+            rating = None
+        for kind, field in SUMMARY_KINDS:
+            key = data.get(field)
+            if key is None:
+                continue
+            entry = totals.setdefault((kind, key), {"Count": 0, "Sum": 0, "Histogram": {}})
+            entry["Count"] += 1
+            if rating is not None:
+                entry["Sum"] += rating
+                if rating in RATING_VALUES:
+                    entry["Histogram"][str(rating)] = entry["Histogram"].get(str(rating), 0) + 1
+    return totals
 
 
 # ==================================================
@@ -41,58 +111,205 @@ class Feedback:
 # ==================================================
 class FeedbackService:
     """Handles CRUD operations for user feedback."""
-    def __init__(self):
-        self.db = firestore.client()
+    def __init__(self, db=None, ranking=None):
+        self.db = db or get_db()
         self.collection = self.db.collection("Feedback")
+        self.read_cache = new_read_cache()
+        self.summaries = self.db.collection(SUMMARY_COLLECTION)
+        # RankingIndex told about every feedback written here; others reach it with its next refresh
+        self.ranking = ranking
+
+    def _invalidate(self, user_id=None, reference_id=None):
+        """Drops cached listings that may contain feedback of this user/reference."""
+        self.read_cache.invalidate_where(
+            lambda key: (key[0] == "user" and key[1] == user_id) or (key[0] == "reference" and key[1] == reference_id)
+        )
+
+    def _list(self, kind, field, value, limit, start_after, fields, empty_message):
+        key = (kind, value, limit, start_after, tuple(fields) if fields else None)
+        page = self.read_cache.get(key)
+        if page is None:
+            try:
+                page = fetch_page(self.collection, field, value, "Date", limit, start_after, fields)
+            except InvalidPageToken:
+                return {"error": "Invalid page token."}
+            self.read_cache.set(key, page)
+        if not page["items"] and not start_after:
+            return {**page, "message": empty_message}
+        return page
 
     # --------------------------------------------------
+    @instrumented("feedback", "add")
     def add_feedback(self, feedback: Feedback):
         """Add a new feedback entry."""
-        self.collection.document(feedback.feedback_id).set(feedback.to_dict())
+        if not valid_rating(feedback.rating):
+            return INVALID_RATING
+        # Counted: the summary counters include this feedback, so updates and deletes move them.
+        # Feedback stored before the counters existed lacks it until the counters are rebuilt.
+        data = {**feedback.to_dict(), "Counted": True}
+        # The feedback document and its aggregate counters are committed in the same batch. The
+        # call waits for that commit (the write buffer commits waited writes at once), so an update
+        # or delete right after finds the document and a failed commit reaches the caller.
+        write_buffer.group(
+            [("set", self.collection.document(feedback.feedback_id), data, False)]
+            + self._summary_writes(data, count=1, ratings={feedback.rating: 1}),
+            wait=True,
+        )
+        self._invalidate(feedback.user_id, feedback.reference_id)
+        if self.ranking is not None:
+            self.ranking.observe(feedback.feedback_id, data)
         return {"message": "Feedback added successfully", "FeedbackID": feedback.feedback_id}
 
     # --------------------------------------------------
-    def get_feedback_by_user(self, user_id: str):
-        """Retrieve all feedback given by a specific user."""
-        docs = self.collection.where("UserID", "==", user_id).stream()
-        feedback_list = [doc.to_dict() for doc in docs]
-        return feedback_list if feedback_list else {"message": "No feedback found for this user."}
+    @instrumented("feedback", "list_user")
+    def get_feedback_by_user(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                             start_after: str = None, fields: list = None):
+        """Retrieve feedback given by a specific user, newest first, one page at a time."""
+        return self._list("user", "UserID", user_id, limit, start_after, fields,
+                          "No feedback found for this user.")
 
     # --------------------------------------------------
-    def get_feedback_for_reference(self, reference_id: str):
-        """Retrieve feedback for a particular product/analysis."""
-        docs = self.collection.where("ReferenceID", "==", reference_id).stream()
-        feedback_list = [doc.to_dict() for doc in docs]
-        return feedback_list if feedback_list else {"message": "No feedback found for this reference."}
+    @instrumented("feedback", "list_reference")
+    def get_feedback_for_reference(self, reference_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                                   start_after: str = None, fields: list = None):
+        """Retrieve feedback for a particular product/analysis, newest first, one page at a time."""
+        return self._list("reference", "ReferenceID", reference_id, limit, start_after, fields,
+                          "No feedback found for this reference.")
 
     # --------------------------------------------------
+    @instrumented("feedback", "update")
     def update_feedback(self, feedback_id: str, new_rating: int = None, new_comments: str = None):
         """Allow user to update their feedback."""
-        doc_ref = self.collection.document(feedback_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            return {"error": "Feedback not found."}
+        from firebase_admin import firestore
 
+        if new_rating is not None and not valid_rating(new_rating):
+            return INVALID_RATING
         updates = {}
         if new_rating is not None:
             updates["Rating"] = new_rating
         if new_comments is not None:
             updates["Comments"] = new_comments
 
-        if updates:
-            updates["Date"] = datetime.datetime.now().isoformat()
-            doc_ref.update(updates)
-            return {"message": "Feedback updated successfully."}
-        else:
+        @firestore.transactional
+        def apply(transaction, doc_ref):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return None
+            current = doc.to_dict()
+            if not updates:
+                return current
+
+            # Date stays the creation time listings are ordered by; UpdatedAt moves
+            updates["UpdatedAt"] = datetime.datetime.now().isoformat()
+            transaction.update(doc_ref, updates)
+            old_rating = current.get("Rating")
+            if new_rating is not None and new_rating != old_rating and current.get("Counted"):
+                for _, ref, data, merge in self._summary_writes(current, count=0, ratings={old_rating: -1, new_rating: 1}):
+                    transaction.set(ref, data, merge=merge)
+            return current
+
+        current = apply(self.db.transaction(), self.collection.document(feedback_id))
+        if current is None:
+            return {"error": "Feedback not found."}
+        if not updates:
             return {"message": "No updates made."}
 
+        self._invalidate(current.get("UserID"), current.get("ReferenceID"))
+        if self.ranking is not None:
+            self.ranking.observe(feedback_id, {**current, **updates})
+        return {"message": "Feedback updated successfully."}
+
     # --------------------------------------------------
+    @instrumented("feedback", "delete")
     def delete_feedback(self, feedback_id: str):
         """Delete a feedback record."""
-        doc_ref = self.collection.document(feedback_id)
-        if doc_ref.get().exists:
-            doc_ref.delete()
-            return {"message": "Feedback deleted successfully."}
-        else:
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def apply(transaction, doc_ref):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return None
+            current = doc.to_dict()
+            transaction.delete(doc_ref)
+            if current.get("Counted"):
+                for _, ref, data, merge in self._summary_writes(current, count=-1, ratings={current.get("Rating"): -1}):
+                    transaction.set(ref, data, merge=merge)
+            return current
+
+        current = apply(self.db.transaction(), self.collection.document(feedback_id))
+        if current is None:
             return {"error": "Feedback not found."}
 
+        self._invalidate(current.get("UserID"), current.get("ReferenceID"))
+        if self.ranking is not None:
+            self.ranking.forget(feedback_id)
+        return {"message": "Feedback deleted successfully."}
+
+    # --------------------------------------------------
+    def _summary_refs(self, kind, key):
+        return [self.summaries.document(summary_id(kind, key, shard)) for shard in range(SUMMARY_SHARDS)]
+
+    def _summary_writes(self, feedback: dict, count: int, ratings: dict):
+        """
+        Increment writes for the ReferenceID and Category aggregates of one feedback.
+        `ratings` maps rating -> +1/-1 for the histogram and sum.
+        """
+        from firebase_admin import firestore
+
+        rating_sum = 0
+        histogram = {}
+        for rating, delta in ratings.items():
+            try:
+                rating = int(rating)
+            except (TypeError, ValueError):
+                continue
+            rating_sum += rating * delta
+            if rating in RATING_VALUES:
+                histogram[str(rating)] = firestore.Increment(delta)
+
+        data = {
+            "Sum": firestore.Increment(rating_sum),
+            "LastUpdated": datetime.datetime.now().isoformat(),
+        }
+        # A merged empty map would replace the stored histogram rather than leave it alone
+        if histogram:
+            data["Histogram"] = histogram
+        if count:
+            data["Count"] = firestore.Increment(count)
+
+        writes = []
+        for kind, field in SUMMARY_KINDS:
+            key = feedback.get(field)
+            if key is None:
+                continue
+            # Any shard will do; reads sum all of them
+            ref = random.choice(self._summary_refs(kind, key))
+            writes.append(("set", ref, {"Kind": kind, "Key": key, **data}, True))
+        return writes
+
+    def _read_summary(self, kind, key):
+        summary = {"Count": 0, "Sum": 0, "Histogram": {str(r): 0 for r in RATING_VALUES}, "LastUpdated": None}
+        for doc in self.db.get_all(self._summary_refs(kind, key)):
+            if not doc.exists:
+                continue
+            shard = doc.to_dict()
+            summary["Count"] += shard.get("Count", 0)
+            summary["Sum"] += shard.get("Sum", 0)
+            for rating, value in shard.get("Histogram", {}).items():
+                summary["Histogram"][rating] = summary["Histogram"].get(rating, 0) + value
+            if shard.get("LastUpdated") and (summary["LastUpdated"] is None or shard["LastUpdated"] > summary["LastUpdated"]):
+                summary["LastUpdated"] = shard["LastUpdated"]
+
+        summary["Average"] = round(summary["Sum"] / summary["Count"], 2) if summary["Count"] else None
+        return summary
+
+    @instrumented("feedback", "reference_summary")
+    def get_reference_summary(self, reference_id: str):
+        """Rating aggregate of a product/analysis, read from its counter shards."""
+        return {"ReferenceID": reference_id, **self._read_summary("reference", reference_id)}
+
+    @instrumented("feedback", "category_summary")
+    def get_category_summary(self, category: str):
+        """Rating aggregate of all feedback in a category."""
+        return {"Category": category, **self._read_summary("category", category)}
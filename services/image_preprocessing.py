@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+
+# ==================================================
+# PREPROCESSING CONFIGURATION
+# ==================================================
+# "0" decodes uploads as they are (OpenCV's own orientation handling, full resolution).
+PREPROCESS_ENABLED = os.environ.get("SKINGLOSS_PREPROCESS", "1") == "1"
+# Long edge of the working image every analysis runs on; 0 keeps the source resolution.
+WORKING_MAX_EDGE = int(os.environ.get("SKINGLOSS_WORKING_MAX_EDGE", 1600))
+# Long edge of the JPEG thumbnail stored next to each analysis; 0 disables thumbnails.
+THUMBNAIL_EDGE = int(os.environ.get("SKINGLOSS_THUMBNAIL_EDGE", 0))
+THUMBNAIL_QUALITY = int(os.environ.get("SKINGLOSS_THUMBNAIL_QUALITY", 70))
+
+COUNTERS = (
+    "images", "undecodable", "oriented", "reduced_decodes", "resized",
+    "bytes_in", "source_pixels", "decoded_pixels", "no_face", "no_face_oriented",
+)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+# ==================================================
+# HEADER PARSING
+# ==================================================
+def _exif_orientation(tiff):
+    """Orientation (1-8) from a TIFF-structured EXIF block; 1 when absent or malformed."""
+    try:
+        endian = {b"II": "<", b"MM": ">"}[bytes(tiff[:2])]
+        (ifd_offset,) = struct.unpack_from(endian + "I", tiff, 4)
+        (count,) = struct.unpack_from(endian + "H", tiff, ifd_offset)
+        for i in range(count):
+            tag, _, _ = struct.unpack_from(endian + "HHI", tiff, ifd_offset + 2 + 12 * i)
+            if tag == _EXIF_ORIENTATION_TAG:
+                (value,) = struct.unpack_from(endian + "H", tiff, ifd_offset + 2 + 12 * i + 8)
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _jpeg_header(data):
+    """(orientation, (width, height) or None) from the JPEG segments ahead of the scan data."""
+    orientation, size = 1, None
+    i = 2
+    while i + 4 <= len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker == 0xDA:
+            break
+        (length,) = struct.unpack_from(">H", data, i + 2)
+        if marker == 0xE1 and bytes(data[i + 4:i + 10]) == b"Exif\x00\x00":
+            orientation = _exif_orientation(memoryview(data)[i + 10:i + 2 + length])
+        elif marker in _JPEG_SOF_MARKERS and i + 9 <= len(data):
+            height, width = struct.unpack_from(">HH", data, i + 5)
+            size = (width, height)
+        i += 2 + length
+    return orientation, size
+
+
+def _png_header(data):
+    """(orientation, (width, height) or None) from the IHDR and eXIf chunks of a PNG."""
+    orientation, size = 1, None
+    i = 8
+    while i + 8 <= len(data):
+        length, kind = struct.unpack_from(">I4s", data, i)
+        if kind == b"IHDR" and i + 16 <= len(data):
+            size = struct.unpack_from(">II", data, i + 8)
+        elif kind == b"eXIf":
+            orientation = _exif_orientation(memoryview(data)[i + 8:i + 8 + length])
+        elif kind == b"IDAT":
+            break
+        i += 12 + length
+    return orientation, size
+
+
+def read_header(data):
+    """(format, orientation, (width, height) or None) without decoding the image."""
+    head = bytes(data[:8])
+    try:
+        if head[:2] == b"\xff\xd8":
+            return ("jpeg", *_jpeg_header(data))
+        if head == _PNG_SIGNATURE:
+            return ("png", *_png_header(data))
+    except struct.error:
+        pass
+    return None, 1, None
+
+
+def apply_orientation(image, orientation):
+    """Turns an image decoded as stored into the upright view its EXIF orientation describes."""
+    import cv2
+
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+# ==================================================
+# IMAGE PREPROCESSOR
+# ==================================================
+class ImagePreprocessor:
+    """
+    Turns an upload into the working image the analysis runs on.
+
+    The EXIF orientation is read from the JPEG/PNG header and applied explicitly,
+    so detection always sees an upright face whatever the decoder does. JPEGs
+    much larger than the working size are decoded with IMREAD_REDUCED_* (the
+    decoder skips the discarded DCT detail instead of resizing afterwards), then
+    every image is downscaled to at most `max_edge`. Counters live in shared
+    memory, so worker processes forked from the API report into the same totals.
+    """
+
+    def __init__(self, enabled=PREPROCESS_ENABLED, max_edge=WORKING_MAX_EDGE,
+                 thumbnail_edge=THUMBNAIL_EDGE, thumbnail_quality=THUMBNAIL_QUALITY):
+        self.enabled = enabled
+        self.max_edge = max_edge
+        self.thumbnail_edge = thumbnail_edge
+        self.thumbnail_quality = thumbnail_quality
+        self._counters = {name: multiprocessing.Value("q", 0) for name in COUNTERS}
+
+    def _count(self, name, amount=1):
+        counter = self._counters[name]
+        with counter.get_lock():
+            counter.value += amount
+
+    def version(self):
+        """Part of the analyzer version: preprocessing changes the pixels the metrics see."""
+        return f"p{self.max_edge}" if self.enabled else "raw"
+
+    def _reduction(self, size):
+        """Largest IMREAD_REDUCED factor that still leaves at least max_edge pixels on the long edge."""
+        if not self.max_edge or size is None:
+            return 1
+        long_edge = max(size)
+        for factor in (8, 4, 2):
+            if long_edge >= self.max_edge * factor:
+                return factor
+        return 1
+
+    # --------------------------------------------------
+    def decode(self, data):
+        """
+        (image, info): the upright, size-bounded BGR image (None if undecodable) and
+        a dict describing what was done, which analyses store as "Preprocessing".
+        """
+        import cv2
+
+        buf = np.frombuffer(data, dtype=np.uint8)
+        if not buf.size:
+            return None, None
+        if not self.enabled:
+            return cv2.imdecode(buf, cv2.IMREAD_COLOR), None
+
+        image_format, orientation, size = read_header(data)
+        factor = self._reduction(size) if image_format == "jpeg" else 1
+        flags = {
+            1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8,
+        }[factor] | cv2.IMREAD_IGNORE_ORIENTATION
+        image = cv2.imdecode(buf, flags)
+
+        self._count("images")
+        self._count("bytes_in", buf.size)
+        if image is None:
+            self._count("undecodable")
+            return None, None
+        if factor > 1:
+            self._count("reduced_decodes")
+        if orientation != 1:
+            self._count("oriented")
+        height, width = image.shape[:2]
+        source_size = size or (width, height)
+        self._count("source_pixels", source_size[0] * source_size[1])
+        self._count("decoded_pixels", width * height)
+
+        image = apply_orientation(image, orientation)
+        height, width = image.shape[:2]
+        if self.max_edge and max(height, width) > self.max_edge:
+            scale = self.max_edge / max(height, width)
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            self._count("resized")
+
+        info = {
+            "Format": image_format,
+            "Orientation": orientation,
+            "SourceSize": list(source_size),
+            "DecodeScale": factor,
+            "WorkingSize": [image.shape[1], image.shape[0]],
+            "Bytes": int(buf.size),
+        }
+        return image, info
+
+    def thumbnail(self, image):
+        """A compact JPEG of the working image, or None when thumbnails are disabled."""
+        if not self.thumbnail_edge or image is None:
+            return None
+        import cv2
+
+        height, width = image.shape[:2]
+        scale = min(1.0, self.thumbnail_edge / max(height, width))
+        small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, self.thumbnail_quality])
+        return encoded.tobytes() if ok else None
+
+    def record_detection(self, info, face_detected):
+        """Counts failed detections, separately for uploads that needed rotating."""
+        if info is None or face_detected:
+            return
+        self._count("no_face")
+        if info["Orientation"] != 1:
+            self._count("no_face_oriented")
+
+    # --------------------------------------------------
+    def stats(self):
+        counts = {name: counter.value for name, counter in self._counters.items()}
+        images = counts["images"]
+        counts["enabled"] = self.enabled
+        counts["working_max_edge"] = self.max_edge
+        counts["avg_bytes_in"] = round(counts["bytes_in"] / images) if images else 0
+        counts["decoded_pixel_ratio"] = (
+            round(counts["decoded_pixels"] / counts["source_pixels"], 4) if counts["source_pixels"] else 0.0
+        )
+        counts["no_face_rate"] = round(counts["no_face"] / images, 4) if images else 0.0
+        counts["no_face_rate_oriented"] = (
+            round(counts["no_face_oriented"] / counts["oriented"], 4) if counts["oriented"] else 0.0
+        )
+        return counts
+
+
+image_preprocessor = ImagePreprocessor()
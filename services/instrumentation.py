@@ -0,0 +1,176 @@
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# ==================================================
+# INSTRUMENTATION CONFIGURATION
+# ==================================================
+# Stage durations as Prometheus histograms (needs prometheus_client). The analysis
+# stages run in the worker processes: set PROMETHEUS_MULTIPROC_DIR to an empty,
+# writable directory so /metrics aggregates them.
+METRICS_ENABLED = os.environ.get("SKINGLOSS_METRICS", "1") == "1" and prometheus_client is not None
+# One OpenTelemetry span per stage (needs opentelemetry-api; the exporter is configured by the deployment).
+TRACING_ENABLED = os.environ.get("SKINGLOSS_TRACING", "0") == "1" and otel_trace is not None
+# Allows GET /debug/profile, which samples the stacks of the API process for a few seconds.
+PROFILER_ENABLED = os.environ.get("SKINGLOSS_PROFILER", "0") == "1"
+PROFILER_MAX_SECONDS = 60
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+if METRICS_ENABLED:
+    _stage_seconds = prometheus_client.Histogram(
+        "skingloss_stage_seconds", "Duration of one pipeline stage.", ["pipeline", "stage"], buckets=STAGE_BUCKETS
+    )
+    _stage_errors = prometheus_client.Counter(
+        "skingloss_stage_errors_total", "Pipeline stages that raised.", ["pipeline", "stage"]
+    )
+_tracer = otel_trace.get_tracer("skingloss") if TRACING_ENABLED else None
+
+
+class _Stage:
+    """Times one stage into the histogram and wraps it in a span, whichever is enabled."""
+    __slots__ = ("pipeline", "name", "start", "span")
+
+    def __init__(self, pipeline, name):
+        self.pipeline = pipeline
+        self.name = name
+        self.span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self.span = _tracer.start_as_current_span(f"{self.pipeline}.{self.name}")
+            self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if METRICS_ENABLED:
+            _stage_seconds.labels(self.pipeline, self.name).observe(elapsed)
+            if exc_type is not None:
+                _stage_errors.labels(self.pipeline, self.name).inc()
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+ENABLED = METRICS_ENABLED or TRACING_ENABLED
+
+
+def stage(pipeline, name):
+    """
+    Context manager around one pipeline stage:
+
+        with stage("analysis", "detect"):
+            faces = self._detect_faces(gray)
+
+    A shared no-op when metrics and tracing are both disabled.
+    """
+    return _Stage(pipeline, name) if ENABLED else _NOOP_STAGE
+
+
+def record_error(pipeline, name):
+    """Counts a failure of a stage that handled its error instead of raising it."""
+    if METRICS_ENABLED:
+        _stage_errors.labels(pipeline, name).inc()
+
+
+def instrumented(pipeline, name=None):
+    """Decorator form of stage() for whole (sync or async) methods; leaves them untouched when disabled."""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        stage_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Stage(pipeline, stage_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Stage(pipeline, stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ==================================================
+# EXPOSITION
+# ==================================================
+def render_metrics():
+    """(body, content type) in the Prometheus text format, or None when metrics are disabled."""
+    if not METRICS_ENABLED:
+        return None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# ==================================================
+# SAMPLING PROFILER
+# ==================================================
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+_profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Samples the Python stacks of every thread of this process for `seconds` and returns
+    them in collapsed-stack format ("frame;frame;frame count" per line), which
+    flamegraph.pl and speedscope read directly. Blocking; run it in a thread.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being recorded.")
+    try:
+        counts = Counter()
+        own_thread = threading.get_ident()
+        deadline = time.perf_counter() + min(seconds, PROFILER_MAX_SECONDS)
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+    finally:
+        _profile_lock.release()
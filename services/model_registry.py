@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+import time
+
+# ==================================================
+# MODEL CONFIGURATION
+# ==================================================
+MODEL_DIR = os.environ.get("SKINGLOSS_MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+LANDMARK_MODEL_PATH = os.environ.get(
+    "SKINGLOSS_LANDMARK_MODEL",
+    os.path.join(MODEL_DIR, "shape_predictor_68_face_landmarks.dat")
+)
+# Expected SHA-256 of the landmark model. When unset, the ".sha256" file written
+# next to the model after a download is used instead (if present).
+LANDMARK_MODEL_SHA256 = os.environ.get("SKINGLOSS_LANDMARK_MODEL_SHA256")
+# Downloading from Google Drive is opt-in; pods are expected to ship the model.
+ALLOW_MODEL_DOWNLOAD = os.environ.get("SKINGLOSS_ALLOW_MODEL_DOWNLOAD", "0") == "1"
+# Load models from the startup hook instead of on the first analysis.
+PRELOAD_MODELS = os.environ.get("SKINGLOSS_PRELOAD_MODELS", "1") == "1"
+LANDMARK_MODEL_DRIVE_ID = "1-HTqUcR9a76I5zrJk95ZrXD6dzH-jowL"
+
+
+class ModelNotAvailable(Exception):
+    """Raised when a model file is missing or fails verification."""
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ==================================================
+# MODEL REGISTRY
+# ==================================================
+class ModelRegistry:
+    """
+    Loads the dlib face detector and landmark predictor once per process.
+
+    Loading happens on first use, or up front via load() from the startup hook.
+    Worker processes forked after load() inherit the loaded models, so the
+    predictor's memory is shared copy-on-write instead of being read again.
+    """
+
+    def __init__(self, model_path=LANDMARK_MODEL_PATH, expected_sha256=LANDMARK_MODEL_SHA256,
+                 allow_download=ALLOW_MODEL_DOWNLOAD):
+        self.model_path = model_path
+        self.expected_sha256 = expected_sha256
+        self.allow_download = allow_download
+        self._lock = threading.Lock()
+        self._detector = None
+        self._predictor = None
+        self._error = None
+        self._load_seconds = None
+        # A child forked while another thread held the lock would otherwise wait on it forever
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------
+    def _checksum_file(self):
+        return self.model_path + ".sha256"
+
+    def _download(self):
+        import gdown
+
+        os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+        url = f"https://drive.google.com/uc?id={LANDMARK_MODEL_DRIVE_ID}"
+        print("Downloading face landmark model from Google Drive...")
+        gdown.download(url, self.model_path, quiet=False)
+        print("Download complete!")
+
+        if self.expected_sha256 is None:
+            with open(self._checksum_file(), "w") as f:
+                f.write(file_sha256(self.model_path))
+
+    def _verify(self):
+        expected = self.expected_sha256
+        if expected is None and os.path.exists(self._checksum_file()):
+            with open(self._checksum_file()) as f:
+                expected = f.read().strip()
+        if expected is None:
+            return
+
+        actual = file_sha256(self.model_path)
+        if actual != expected.lower():
+            raise ModelNotAvailable(
+                f"Checksum mismatch for {self.model_path}: expected {expected}, got {actual}."
+            )
+
+    # --------------------------------------------------
+    def load(self):
+        """Loads all models; safe to call repeatedly and from several threads."""
+        if self.is_ready():
+            return
+        with self._lock:
+            if self.is_ready():
+                return
+            started = time.perf_counter()
+            try:
+                if not os.path.exists(self.model_path):
+                    if not self.allow_download:
+                        raise ModelNotAvailable(
+                            f"Landmark model not found at {self.model_path}. "
+                            "Set SKINGLOSS_LANDMARK_MODEL/SKINGLOSS_MODEL_DIR or SKINGLOSS_ALLOW_MODEL_DOWNLOAD=1."
+                        )
+                    self._download()
+                self._verify()
+
+                import dlib
+                self._detector = dlib.get_frontal_face_detector()
+                self._predictor = dlib.shape_predictor(self.model_path)
+                self._error = None
+            except Exception as e:
+                self._error = str(e)
+                raise
+            self._load_seconds = round(time.perf_counter() - started, 3)
+            print(f"Face models loaded from {self.model_path} in {self._load_seconds}s")
+
+    def is_ready(self):
+        return self._detector is not None and self._predictor is not None
+
+    @property
+    def detector(self):
+        self.load()
+        return self._detector
+
+    @property
+    def predictor(self):
+        self.load()
+        return self._predictor
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "model_path": self.model_path,
+            "load_seconds": self._load_seconds,
+            "error": self._error,
+        }
+
+
+model_registry = ModelRegistry()
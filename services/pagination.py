@@ -0,0 +1,61 @@
+import os
+
+from services.ttl_cache import TTLCache
+
+# ==================================================
+# PAGINATION CONFIGURATION
+# ==================================================
+DEFAULT_PAGE_SIZE = int(os.environ.get("SKINGLOSS_DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("SKINGLOSS_MAX_PAGE_SIZE", 200))
+# Listing responses are cached briefly; the write paths invalidate them.
+READ_CACHE_TTL = float(os.environ.get("SKINGLOSS_READ_CACHE_TTL", 30))
+READ_CACHE_ENTRIES = int(os.environ.get("SKINGLOSS_READ_CACHE_ENTRIES", 2048))
+# firestore.Query.DESCENDING, spelled out so listing does not import the client library
+DESCENDING = "DESCENDING"
+
+
+class InvalidPageToken(Exception):
+    """Raised when a start_after token does not point to an existing document."""
+
+
+def new_read_cache():
+    return TTLCache(READ_CACHE_TTL, max_entries=READ_CACHE_ENTRIES)
+
+
+def parse_fields(fields):
+    """Turns a comma separated `fields` query parameter into a list for select()."""
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
+
+def fetch_page(collection, filter_field, value, order_field, limit=DEFAULT_PAGE_SIZE,
+               start_after=None, fields=None):
+    """
+    One page of documents where filter_field == value, newest first.
+
+    Returns {"items": [...], "next_page_token": ...}; the list endpoints pass it
+    through, so their responses are this object rather than the plain list they
+    returned before pagination. The page token is the ID of the last document
+    returned; the next page starts after that document. Needs a composite index on (filter_field, order_field DESC),
+    see firestore.indexes.json.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = collection.where(filter_field, "==", value).order_by(
+        order_field, direction=DESCENDING
+    )
+    if fields:
+        query = query.select(fields)
+    if start_after:
+        cursor = collection.document(start_after).get()
+        if not cursor.exists:
+            raise InvalidPageToken(start_after)
+        query = query.start_after(cursor)
+
+    # One extra document tells us whether another page exists
+    docs = list(query.limit(limit + 1).stream())
+    page = docs[:limit]
+    return {
+        "items": [doc.to_dict() for doc in page],
+        "next_page_token": page[-1].id if len(docs) > limit else None,
+    }
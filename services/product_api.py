@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+from services.ttl_cache import TTLCache, FRESH, STALE
+
+# ==================================================
+# PRODUCT API CONFIGURATION
+# ==================================================
+PRODUCT_API_URL = os.environ.get("SKINGLOSS_PRODUCT_API_URL", "https://api.shopeemock.com/search")
+PRODUCT_API_TIMEOUT = float(os.environ.get("SKINGLOSS_PRODUCT_API_TIMEOUT", 2.0))
+PRODUCT_API_MAX_CONNECTIONS = int(os.environ.get("SKINGLOSS_PRODUCT_API_MAX_CONNECTIONS", 20))
+# Results only depend on (tone, condition); serve them fresh for PRODUCT_CACHE_TTL
+# seconds and stale for PRODUCT_CACHE_STALE_TTL more while refreshing in the background.
+PRODUCT_CACHE_TTL = float(os.environ.get("SKINGLOSS_PRODUCT_CACHE_TTL", 600))
+PRODUCT_CACHE_STALE_TTL = float(os.environ.get("SKINGLOSS_PRODUCT_CACHE_STALE_TTL", 3600))
+# Consecutive failures before the breaker opens, and seconds until it lets a probe through.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("SKINGLOSS_PRODUCT_BREAKER_FAILURES", 3))
+BREAKER_RESET_SECONDS = float(os.environ.get("SKINGLOSS_PRODUCT_BREAKER_RESET", 30))
+
+
+def fallback_products(error=None):
+    product = {"name": "Fallback Moisturizer", "source": "Local"}
+    if error is not None:
+        product["error"] = str(error)
+    return [product]
+
+
+# ==================================================
+# CIRCUIT BREAKER
+# ==================================================
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; allows one probe after `reset_seconds`."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            return True
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+# ==================================================
+# PRODUCT API CLIENT
+# ==================================================
+class ProductAPIClient:
+    """Pooled async client for the external product search, with caching and a circuit breaker."""
+
+    def __init__(self, base_url=PRODUCT_API_URL, timeout=PRODUCT_API_TIMEOUT,
+                 max_connections=PRODUCT_API_MAX_CONNECTIONS, cache=None, breaker=None, transport=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cache = cache or TTLCache(PRODUCT_CACHE_TTL, PRODUCT_CACHE_STALE_TTL)
+        self.breaker = breaker or CircuitBreaker()
+        # An httpx transport to use instead of the network, e.g. the benchmarks' stub API
+        self.transport = transport
+        self._client = None
+        self._refresh_tasks = {}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    # --------------------------------------------------
+    async def fetch_products(self, tone, condition):
+        """Top products for (tone, condition); never waits on an upstream known to be failing."""
+        key = (tone, condition)
+        products, state = self.cache.get_entry(key)
+        if state == FRESH:
+            return products
+        if state == STALE:
+            self._schedule_refresh(key)
+            return products
+
+        if not self.breaker.allow():
+            return fallback_products("Product API circuit open")
+        try:
+            return await self._load(key)
+        except Exception as e:
+            return fallback_products(e)
+
+    async def _load(self, key):
+        try:
+            products = await self._request(*key)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.cache.set(key, products)
+        return products
+
+    def _schedule_refresh(self, key):
+        if key in self._refresh_tasks or not self.breaker.allow():
+            return
+
+        async def refresh():
+            try:
+                await self._load(key)
+            except Exception as e:
+                print(f"[API Fetch] Background refresh failed for {key}: {e}")
+            finally:
+                self._refresh_tasks.pop(key, None)
+
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._refresh_tasks[key] = asyncio.get_running_loop().create_task(refresh())
+
+    async def _request(self, tone, condition):
+        query = f"{tone} {condition} skincare"
+        print(f"[API Fetch] Searching external API for: {query}")
+
+        response = await self._get_client().get(self.base_url, params={"q": query})
+        if response.status_code != 200:
+            raise Exception(f"External API Error ({response.status_code})")
+
+        data = response.json()
+        # Simplify to top 3 products
+        return [
+            {"name": item["title"], "price": item.get("price", "N/A"), "source": "ShopeeMock"}
+            for item in data.get("items", [])[:3]
+        ]
+
+    # --------------------------------------------------
+    def stats(self):
+        return {"breaker_state": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+product_api_client = ProductAPIClient()
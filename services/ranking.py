@@ -0,0 +1,397 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+from config.firebase_config import get_db
+
+# ==================================================
+# RANKING CONFIGURATION
+# ==================================================
+# "0" keeps recommendations in their rule/API order.
+RANKING_ENABLED = os.environ.get("SKINGLOSS_RANKING", "1") == "1"
+# Pseudo-ratings at the parent level's score each product starts with: a product's
+# segment score moves away from its global score (and that from the mean rating)
+# only as ratings accumulate.
+RANKING_PRIOR_WEIGHT = float(os.environ.get("SKINGLOSS_RANKING_PRIOR_WEIGHT", 5))
+# Same for a user's own ratings against the segment score.
+RANKING_USER_WEIGHT = float(os.environ.get("SKINGLOSS_RANKING_USER_WEIGHT", 2))
+# Products rated above average in the segment added to the rule/API products when not already among them.
+RANKING_DISCOVER = int(os.environ.get("SKINGLOSS_RANKING_DISCOVER", 2))
+# Seconds between reads of new/updated feedback, and between full reloads (which pick up
+# feedback deleted by other processes).
+RANKING_REFRESH_INTERVAL = float(os.environ.get("SKINGLOSS_RANKING_REFRESH_INTERVAL", 30))
+RANKING_RELOAD_INTERVAL = float(os.environ.get("SKINGLOSS_RANKING_RELOAD_INTERVAL", 3600))
+# Recommended products whose details are kept for discovery; the least recently recommended go first.
+RANKING_MAX_PRODUCTS = int(os.environ.get("SKINGLOSS_RANKING_MAX_PRODUCTS", 10000))
+
+FEEDBACK_COLLECTION = "Feedback"
+FEEDBACK_FIELDS = ["UserID", "Category", "ReferenceID", "Rating", "Date", "UpdatedAt", "SkinTone", "SkinCondition"]
+PRODUCT_CATEGORY = "Product"
+# Score of a product nobody rated while there is no feedback at all
+DEFAULT_RATING = 3.0
+_INITIAL_CAPACITY = 1024
+
+
+def product_key(product):
+    """The ID feedback refers to a product by (Feedback.ReferenceID): its "id", else its name."""
+    return product.get("id") or product.get("name")
+
+
+def feedback_changed(data):
+    """When the feedback was last written: UpdatedAt, or Date for feedback stored before UpdatedAt existed."""
+    return data.get("UpdatedAt") or data.get("Date")
+
+
+def feedback_segment(data):
+    """(SkinTone, SkinCondition) the feedback was given in, or None when it was not recorded."""
+    tone, condition = data.get("SkinTone"), data.get("SkinCondition")
+    return (tone, condition) if tone and condition else None
+
+
+# ==================================================
+# AGGREGATES
+# ==================================================
+class _Aggregates:
+    """
+    Rating sums and counts per product, globally and per (tone, condition)
+    segment, as arrays indexed by product number, plus each user's own ratings.
+    Every feedback's contribution is remembered, so re-applying a feedback
+    (updated, or read again by an overlapping refresh) replaces it.
+    """
+
+    def __init__(self, capacity=_INITIAL_CAPACITY):
+        self.ids = {}
+        self.names = []
+        self.global_sum = np.zeros(capacity)
+        self.global_count = np.zeros(capacity)
+        self.segments = {}
+        self.users = {}
+        self.contributions = {}
+        self.rating_sum = 0.0
+        self.rating_count = 0
+
+    @property
+    def capacity(self):
+        return self.global_sum.size
+
+    @property
+    def mean_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else DEFAULT_RATING
+
+    def index_of(self, name):
+        index = self.ids.get(name)
+        if index is None:
+            if len(self.names) == self.capacity:
+                self._grow()
+            index = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def _grow(self):
+        def grown(array):
+            return np.concatenate((array, np.zeros_like(array)))
+
+        self.global_sum, self.global_count = grown(self.global_sum), grown(self.global_count)
+        self.segments = {key: (grown(s), grown(c)) for key, (s, c) in self.segments.items()}
+
+    def _add(self, user_id, segment, index, rating, sign):
+        self.global_sum[index] += sign * rating
+        self.global_count[index] += sign
+        if segment is not None:
+            if segment not in self.segments:
+                self.segments[segment] = (np.zeros(self.capacity), np.zeros(self.capacity))
+            segment_sum, segment_count = self.segments[segment]
+            segment_sum[index] += sign * rating
+            segment_count[index] += sign
+        if user_id is not None:
+            ratings = self.users.setdefault(user_id, {})
+            entry = ratings.setdefault(index, [0.0, 0])
+            entry[0] += sign * rating
+            entry[1] += sign
+            if not entry[1]:
+                del ratings[index]
+                if not ratings:
+                    del self.users[user_id]
+        self.rating_sum += sign * rating
+        self.rating_count += sign
+
+    def apply(self, feedback_id, data):
+        """Adds (or replaces) one Feedback document's rating; other categories only remove it."""
+        self.remove(feedback_id)
+        if data.get("Category") != PRODUCT_CATEGORY or data.get("ReferenceID") is None:
+            return
+        try:
+            rating = float(data.get("Rating"))
+        except (TypeError, ValueError):
+            return
+        contribution = (data.get("UserID"), feedback_segment(data), self.index_of(data["ReferenceID"]), rating)
+        self.contributions[feedback_id] = contribution
+        self._add(*contribution, 1)
+
+    def remove(self, feedback_id):
+        contribution = self.contributions.pop(feedback_id, None)
+        if contribution is not None:
+            self._add(*contribution, -1)
+
+    def scores(self, user_id, segment, prior_weight, user_weight):
+        """Smoothed score of every product: global <- segment <- user's own ratings."""
+        n = len(self.names)
+        mean = self.mean_rating
+        scores = (self.global_sum[:n] + prior_weight * mean) / (self.global_count[:n] + prior_weight)
+        if segment in self.segments:
+            segment_sum, segment_count = self.segments[segment]
+            scores = (segment_sum[:n] + prior_weight * scores) / (segment_count[:n] + prior_weight)
+        ratings = self.users.get(user_id)
+        if ratings:
+            index = np.fromiter(ratings.keys(), dtype=np.intp, count=len(ratings))
+            rated = np.array(list(ratings.values()), dtype=np.float64)
+            scores[index] = (rated[:, 0] + user_weight * scores[index]) / (rated[:, 1] + user_weight)
+        return scores
+
+    def evidence(self, segment):
+        """Products with at least one rating in the segment."""
+        return self.segments[segment][1][:len(self.names)] > 0
+
+
+# ==================================================
+# RANKING INDEX
+# ==================================================
+class RankingIndex:
+    """
+    Orders recommended products by the ratings they received in the Feedback
+    collection, per (tone, condition) segment and per user.
+
+    Scores are Bayesian averages: a product's global score starts at the mean
+    rating and its segment score at its global score, each weighted as
+    `prior_weight` ratings, and a user's own ratings of a product pull the
+    segment score towards them. The aggregates behind them live in memory, so
+    ranking reads no Firestore documents: they are loaded once, then kept
+    current by FeedbackService (feedback written by this process) and by a
+    background read of feedback with an UpdatedAt after the last one seen (written
+    elsewhere). A periodic full reload drops feedback deleted elsewhere.
+
+    Products are matched to feedback by product_key(); a product nobody rated
+    scores the mean rating, and one without a key is left unscored after the
+    others. Besides reordering, up to `discover` products rated above average
+    in the segment are added, among the `max_products` rated products this
+    process recommended most recently (their details are only known from there).
+    """
+
+    def __init__(self, db=None, enabled=RANKING_ENABLED, prior_weight=RANKING_PRIOR_WEIGHT,
+                 user_weight=RANKING_USER_WEIGHT, discover=RANKING_DISCOVER,
+                 refresh_interval=RANKING_REFRESH_INTERVAL, reload_interval=RANKING_RELOAD_INTERVAL,
+                 max_products=RANKING_MAX_PRODUCTS):
+        self._db = db
+        self.enabled = enabled
+        self.prior_weight = prior_weight
+        self.user_weight = user_weight
+        self.discover = discover
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.max_products = max_products
+        self._lock = threading.Lock()
+        self._aggregates = _Aggregates()
+        self._payloads = {}
+        self._replay = None
+        self._task = None
+        self.watermark = None
+        self.loaded_at = None
+        self._loaded_monotonic = None
+        self._refreshes = 0
+        self._refreshed_feedback = 0
+        self._last_refresh_s = None
+        self._refresh_errors = 0
+
+    @property
+    def db(self):
+        # Resolved on the first load, so an index used without Firestore (evaluation) never creates the client
+        if self._db is None:
+            self._db = get_db()
+        return self._db
+
+    # --------------------------------------------------
+    def observe(self, feedback_id, data):
+        """Applies a feedback document this process has just written (new or updated)."""
+        with self._lock:
+            self._aggregates.apply(feedback_id, data)
+            if self._replay is not None:
+                self._replay.append((feedback_id, data))
+
+    def forget(self, feedback_id):
+        """Removes a feedback this process has just deleted."""
+        with self._lock:
+            self._aggregates.remove(feedback_id)
+            if self._replay is not None:
+                self._replay.append((feedback_id, None))
+
+    # --------------------------------------------------
+    def scores(self, user_id, tone, condition):
+        """(product names, scores) over every product in the index."""
+        with self._lock:
+            aggregates = self._aggregates
+            return list(aggregates.names), aggregates.scores(
+                user_id, (tone, condition), self.prior_weight, self.user_weight
+            )
+
+    def rank(self, products, user_id, tone, condition):
+        """The products ordered by score, best first, each with its "score"; ties keep their order."""
+        if not self.enabled or not products:
+            return products
+        segment = (tone, condition)
+        with self._lock:
+            aggregates = self._aggregates
+            # Unrated products are not added to the index: they take the last position, the mean rating
+            unrated = len(aggregates.names)
+            payloads, positions, unkeyed = [], [], []
+            for product in products:
+                key = product_key(product)
+                if key is None:
+                    unkeyed.append(product)
+                    continue
+                index = aggregates.ids.get(key)
+                if index is None:
+                    index = unrated
+                else:
+                    self._remember(index, product)
+                payloads.append(product)
+                positions.append(index)
+            scores = aggregates.scores(user_id, segment, self.prior_weight, self.user_weight)
+            if self.discover:
+                discovered = self._discover(aggregates, scores, segment, [i for i in positions if i != unrated])
+                payloads += [self._payloads[index] for index in discovered]
+                positions += discovered
+            mean_rating = aggregates.mean_rating
+
+        candidate_scores = np.append(scores, mean_rating)[positions]
+        order = np.argsort(-candidate_scores, kind="stable")
+        return [{**payloads[i], "score": round(float(candidate_scores[i]), 3)} for i in order] + unkeyed
+
+    def _remember(self, index, product):
+        """Keeps a recommended product's details, dropping the least recently recommended beyond max_products."""
+        self._payloads.pop(index, None)
+        self._payloads[index] = product
+        if len(self._payloads) > self.max_products:
+            del self._payloads[next(iter(self._payloads))]
+
+    def _discover(self, aggregates, scores, segment, candidates):
+        """Indices of known products rated above average in the segment that are not candidates yet."""
+        if segment not in aggregates.segments:
+            return []
+        eligible = aggregates.evidence(segment) & (scores > aggregates.mean_rating)
+        eligible[candidates] = False
+        known = np.fromiter(self._payloads.keys(), dtype=np.intp, count=len(self._payloads))
+        known = known[eligible[known]]
+        if not known.size:
+            return []
+        count = min(self.discover, known.size)
+        top = known[np.argpartition(-scores[known], count - 1)[:count]]
+        return top.tolist()
+
+    # --------------------------------------------------
+    def load(self):
+        """Rebuilds the aggregates from every product feedback in Firestore."""
+        with self._lock:
+            self._replay = []
+        try:
+            aggregates = _Aggregates(max(self._aggregates.capacity, _INITIAL_CAPACITY))
+            watermark = None
+            query = self.db.collection(FEEDBACK_COLLECTION).where("Category", "==", PRODUCT_CATEGORY)
+            for doc in query.select(FEEDBACK_FIELDS).stream():
+                data = doc.to_dict()
+                aggregates.apply(doc.id, data)
+                changed = feedback_changed(data)
+                if changed and (watermark is None or changed > watermark):
+                    watermark = changed
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            # Product numbers change with the rebuild; keep what is known about recommended products
+            # that still have ratings, in the same order
+            payloads = {}
+            for product in self._payloads.values():
+                index = aggregates.ids.get(product_key(product))
+                if index is not None:
+                    payloads[index] = product
+            # Feedback written by this process while the collection was being read
+            for feedback_id, data in self._replay:
+                if data is None:
+                    aggregates.remove(feedback_id)
+                else:
+                    aggregates.apply(feedback_id, data)
+            self._aggregates, self._payloads, self._replay = aggregates, payloads, None
+            self.watermark = watermark
+        self.loaded_at = datetime.datetime.now().isoformat()
+        self._loaded_monotonic = time.monotonic()
+        return len(aggregates.contributions)
+
+    def refresh(self):
+        """Applies feedback added or updated since the newest change seen (UpdatedAt only moves forward)."""
+        if self.watermark is None:
+            return self.load()
+        start = time.perf_counter()
+        # >= rather than >: documents sharing the watermark's timestamp are re-applied, which is harmless
+        query = self.db.collection(FEEDBACK_COLLECTION).where("UpdatedAt", ">=", self.watermark).order_by("UpdatedAt")
+        count = 0
+        for doc in query.select(FEEDBACK_FIELDS).stream():
+            data = doc.to_dict()
+            with self._lock:
+                self._aggregates.apply(doc.id, data)
+            changed = feedback_changed(data)
+            if changed and changed > self.watermark:
+                self.watermark = changed
+            count += 1
+        self._refreshes += 1
+        self._refreshed_feedback += count
+        self._last_refresh_s = round(time.perf_counter() - start, 4)
+        return count
+
+    async def _run(self):
+        while True:
+            reload_due = (self._loaded_monotonic is None
+                          or time.monotonic() - self._loaded_monotonic >= self.reload_interval)
+            try:
+                await asyncio.to_thread(self.load if reload_due else self.refresh)
+            except Exception as e:
+                self._refresh_errors += 1
+                print(f"[Ranking] Feedback refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Starts loading and refreshing on the running event loop; does nothing if already running."""
+        if self._task is None and self.enabled:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # --------------------------------------------------
+    def stats(self):
+        with self._lock:
+            aggregates = self._aggregates
+            counts = {
+                "products": len(aggregates.names),
+                "segments": len(aggregates.segments),
+                "users": len(aggregates.users),
+                "feedback": len(aggregates.contributions),
+                "recommended_products": len(self._payloads),
+            }
+        return {
+            "enabled": self.enabled,
+            **counts,
+            "loaded_at": self.loaded_at,
+            "watermark": self.watermark,
+            "refreshes": self._refreshes,
+            "refreshed_feedback": self._refreshed_feedback,
+            "last_refresh_s": self._last_refresh_s,
+            "refresh_errors": self._refresh_errors,
+        }
@@ -1,7 +1,12 @@
 import uuid
 import datetime
-import requests
-from firebase_admin import firestore
+from config.firebase_config import get_db
+from services.product_api import product_api_client
+from services.write_buffer import write_buffer
+from services.rule_engine import rule_engine
+from services.ranking import RankingIndex
+from services.pagination import fetch_page, new_read_cache, InvalidPageToken, DEFAULT_PAGE_SIZE
+from services.instrumentation import instrumented, stage
 
 # ==================================================
 # PRODUCT RECOMMENDATION MODEL
@@ -35,82 +40,75 @@ class Recommendation:
 # ==================================================
 class RecommendationService:
     """Handles generation, storage, and retrieval of skincare product recommendations."""
-    def __init__(self):
-        self.db = firestore.client()
+    def __init__(self, db=None, ranking=None):
+        self.db = db or get_db()
         self.collection = self.db.collection("Recommendations")
+        self.product_api = product_api_client
+        # Shared with FeedbackService (routes/dependencies.py) so new ratings count immediately
+        self.ranking = ranking if ranking is not None else RankingIndex(self.db)
+        self.read_cache = new_read_cache()
+
+    def _invalidate_user(self, user_id):
+        self.read_cache.invalidate_where(lambda key: key[0] == user_id)
 
     # --------------------------------------------------
-    def generate_recommendations(self, user_id, skin_tone, skin_condition, analysis_id):
+    @instrumented("recommendation", "generate")
+    async def generate_recommendations(self, user_id, skin_tone, skin_condition, analysis_id):
         """Generate product recommendations using both internal rules and external API calls."""
 
         rec = Recommendation(user_id, skin_tone, skin_condition, analysis_id)
 
         # --- Internal Rule-based Logic ---
-        base_products = self._get_base_recommendations(skin_tone, skin_condition)
+        with stage("recommendation", "rules"):
+            base_products = self._get_base_recommendations(skin_tone, skin_condition)
 
         # --- Fetch products dynamically from Shopee/Taobao (Optional) ---
-        try:
-            api_products = self._fetch_products_from_api(skin_tone, skin_condition)
-        except Exception as e:
-            api_products = [{"name": "Fallback Moisturizer", "source": "Local", "error": str(e)}]
+        with stage("recommendation", "product_api"):
+            api_products = await self._fetch_products_from_api(skin_tone, skin_condition)
 
-        rec.products = base_products + api_products
+        # --- Order by learned feedback scores (segment and user) ---
+        with stage("recommendation", "rank"):
+            rec.products = self.ranking.rank(base_products + api_products, user_id, skin_tone, skin_condition)
 
         # --- Store in Firebase ---
-        self.collection.document(rec.recommendation_id).set(rec.to_dict())
+        with stage("recommendation", "save"):
+            # Awaited: clients list their recommendations right after generating one
+            await write_buffer.aset(self.collection.document(rec.recommendation_id), rec.to_dict(), wait=True)
+        self._invalidate_user(user_id)
 
         return {"message": "Recommendations generated successfully.", "data": rec.to_dict()}
 
     # --------------------------------------------------
     def _get_base_recommendations(self, tone, condition):
-        """Static fallback recommendations."""
-        rules = {
-            ("Warm", "Oily"): [
-                {"name": "Oil-Free Cleanser", "type": "Cleanser"},
-                {"name": "Matte Sunscreen SPF 50", "type": "Sunscreen"},
-            ],
-            ("Cool", "Dry"): [
-                {"name": "Hydrating Cream", "type": "Moisturizer"},
-                {"name": "Aloe Soothing Mask", "type": "Mask"},
-            ],
-            ("Neutral", "Balanced"): [
-                {"name": "Gentle Cleanser", "type": "Cleanser"},
-                {"name": "Light Moisturizer", "type": "Moisturizer"},
-            ]
-        }
-        return rules.get((tone, condition), [{"name": "Basic Skincare Kit", "type": "Set"}])
+        """Static fallback recommendations (product catalog of config/classification_rules.json)."""
+        return rule_engine.recommend(tone, condition, "catalog")
 
     # --------------------------------------------------
-    def _fetch_products_from_api(self, tone, condition):
+    async def _fetch_products_from_api(self, tone, condition):
         """
-        Example external API call to Shopee/Taobao.
-        Replace this with actual API endpoint and key if available.
+        External product search (Shopee/Taobao), see services/product_api.py.
+        Cached per (tone, condition); returns a fallback list when the API is failing.
         """
-        query = f"{tone} {condition} skincare"
-        print(f"[API Fetch] Searching external API for: {query}")
-
-        # Example pseudo endpoint (replace with actual)
-        url = f"https://api.shopeemock.com/search?q={query}"
-        response = requests.get(url, timeout=5)
-
-        if response.status_code == 200:
-            data = response.json()
-            # Simplify to top 3 products
-            return [
-                {"name": item["title"], "price": item.get("price", "N/A"), "source": "ShopeeMock"}
-                for item in data.get("items", [])[:3]
-            ]
-        else:
-            raise Exception(f"External API Error ({response.status_code})")
+        return await self.product_api.fetch_products(tone, condition)
 
     # --------------------------------------------------
-    def get_recommendations_by_user(self, user_id):
-        """Retrieve all recommendations for a user."""
-        docs = self.collection.where("UserID", "==", user_id).stream()
-        results = [doc.to_dict() for doc in docs]
-        return results if results else {"message": "No recommendations found for this user."}
+    @instrumented("recommendation", "list_user")
+    def get_recommendations_by_user(self, user_id, limit=DEFAULT_PAGE_SIZE, start_after=None, fields=None):
+        """Retrieve a user's recommendations, newest first, one page at a time."""
+        key = (user_id, limit, start_after, tuple(fields) if fields else None)
+        page = self.read_cache.get(key)
+        if page is None:
+            try:
+                page = fetch_page(self.collection, "UserID", user_id, "DateGenerated", limit, start_after, fields)
+            except InvalidPageToken:
+                return {"error": "Invalid page token."}
+            self.read_cache.set(key, page)
+        if not page["items"] and not start_after:
+            return {**page, "message": "No recommendations found for this user."}
+        return page
 
     # --------------------------------------------------
+    @instrumented("recommendation", "get")
     def get_recommendation_by_id(self, recommendation_id):
         """Retrieve a single recommendation by its ID."""
         doc_ref = self.collection.document(recommendation_id)
@@ -121,13 +119,16 @@ class RecommendationService:
             return {"error": "Recommendation not found."}
 
     # --------------------------------------------------
+    @instrumented("recommendation", "update_feedback")
     def update_recommendation_feedback(self, recommendation_id, feedback_data):
         """Attach user feedback (e.g., satisfaction or product rating)."""
         doc_ref = self.collection.document(recommendation_id)
-        if not doc_ref.get().exists:
+        doc = doc_ref.get()
+        if not doc.exists:
             return {"error": "Recommendation not found."}
 
         update_data = {"Feedback": feedback_data, "UpdatedAt": datetime.datetime.now().isoformat()}
         doc_ref.update(update_data)
+        self._invalidate_user(doc.to_dict().get("UserID"))
         return {"message": "Recommendation feedback updated successfully."}
 
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ==================================================
+# CACHE CONFIGURATION
+# ==================================================
+RESULT_CACHE_ENABLED = os.environ.get("SKINGLOSS_RESULT_CACHE", "1") == "1"
+RESULT_CACHE_ENTRIES = int(os.environ.get("SKINGLOSS_RESULT_CACHE_ENTRIES", 1024))
+# The on-disk tier is only used when a directory is configured.
+RESULT_CACHE_DIR = os.environ.get("SKINGLOSS_RESULT_CACHE_DIR")
+RESULT_CACHE_TTL = float(os.environ.get("SKINGLOSS_RESULT_CACHE_TTL", 24 * 3600))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("SKINGLOSS_RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+COUNTERS = ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions", "disk_expired")
+
+
+def image_key(image, version):
+    """Content hash of a decoded image plus the analyzer version."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{version}|{image.shape}|{image.dtype}".encode())
+    digest.update(memoryview(image if image.flags["C_CONTIGUOUS"] else image.copy()))
+    return digest.hexdigest()
+
+
+# ==================================================
+# RESULT CACHE
+# ==================================================
+class ResultCache:
+    """
+    Two-tier cache of analysis results keyed by image content.
+
+    The LRU tier lives in the process that analyzes the image. The optional disk
+    tier is shared by all workers and expires entries after `ttl` seconds, evicting
+    the oldest files once the directory grows beyond `max_bytes`. Counters are
+    allocated in shared memory so worker processes forked from the API process
+    report into the same totals.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES, cache_dir=RESULT_CACHE_DIR,
+                 ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {name: multiprocessing.Value("q", 0) for name in COUNTERS}
+        self._disk_bytes = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _count(self, name):
+        counter = self._counters[name]
+        with counter.get_lock():
+            counter.value += 1
+
+    # --------------------------------------------------
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count("memory_hits")
+                return self._entries[key]
+
+        value = self._disk_get(key)
+        if value is not None:
+            self._count("disk_hits")
+            self._memory_put(key, value)
+            return value
+
+        self._count("misses")
+        return None
+
+    def put(self, key, value):
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count("memory_evictions")
+
+    # --------------------------------------------------
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                self._count("disk_expired")
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+            return
+
+        if self._disk_bytes is None:
+            self._disk_bytes = self._scan_disk()[1]
+        else:
+            self._disk_bytes += size
+        if self._disk_bytes > self.max_bytes:
+            self._evict_disk()
+
+    def _scan_disk(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return files, total
+
+    def _evict_disk(self):
+        """Deletes expired files, then the oldest ones until the tier is back under 90% of max_bytes."""
+        files, total = self._scan_disk()
+        now = time.time()
+        for mtime, size, path in sorted(files):
+            expired = now - mtime > self.ttl
+            if not expired and total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count("disk_expired" if expired else "disk_evictions")
+        self._disk_bytes = total
+
+    # --------------------------------------------------
+    def stats(self):
+        counts = {name: counter.value for name, counter in self._counters.items()}
+        lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+        counts["hit_rate"] = round((lookups - counts["misses"]) / lookups, 4) if lookups else 0.0
+        counts["disk_enabled"] = bool(self.cache_dir)
+        return counts
+
+
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
@@ -0,0 +1,145 @@
+import copy
+import json
+import os
+
+import numpy as np
+
+# ==================================================
+# RULE ENGINE CONFIGURATION
+# ==================================================
+RULES_PATH = os.environ.get(
+    "SKINGLOSS_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "classification_rules.json")
+)
+
+OPERATORS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+
+
+class RuleConfigError(Exception):
+    """Raised when the classification rules file is malformed."""
+
+
+class _DecisionTable:
+    """
+    One ordered rule list (first match wins) compiled into flat NumPy arrays:
+    every condition is a (feature column, operator, threshold) triple, grouped
+    per rule, plus a linear or constant confidence per rule and for the default.
+    """
+
+    def __init__(self, section, features):
+        rules = section["rules"]
+        default = section["default"]
+        self.labels = np.array([rule["label"] for rule in rules] + [default["label"]], dtype=object)
+
+        columns, thresholds, operators, starts = [], [], [], []
+        for rule in rules:
+            if not rule["when"]:
+                raise RuleConfigError(f"Rule {rule['label']} has no conditions.")
+            starts.append(len(columns))
+            for feature, op, threshold in rule["when"]:
+                if op not in OPERATORS:
+                    raise RuleConfigError(f"Unknown operator {op!r} in rule {rule['label']}.")
+                columns.append(features.index(feature))
+                operators.append(op)
+                thresholds.append(float(threshold))
+        self.columns = np.array(columns, dtype=np.intp)
+        self.thresholds = np.array(thresholds, dtype=np.float64)
+        self.operators = operators
+        self.starts = np.array(starts, dtype=np.intp)
+
+        # confidence = min(direction * (x[feature] - origin) / span, max), or a constant value
+        confidences = [rule.get("confidence") for rule in rules] + [default.get("confidence")]
+        confidences = [c or {"value": 0.0} for c in confidences]
+        self.conf_constant = np.array([c.get("value", np.nan) for c in confidences], dtype=np.float64)
+        self.conf_column = np.array([features.index(c["feature"]) if "feature" in c else 0 for c in confidences])
+        self.conf_origin = np.array([c.get("origin", 0.0) for c in confidences], dtype=np.float64)
+        self.conf_direction = np.array([c.get("direction", 1.0) for c in confidences], dtype=np.float64)
+        self.conf_span = np.array([c.get("span", 1.0) for c in confidences], dtype=np.float64)
+        self.conf_max = np.array([c.get("max", np.inf) for c in confidences], dtype=np.float64)
+
+    def evaluate(self, X):
+        """Returns (label index, confidence) arrays for an N x features matrix."""
+        n = X.shape[0]
+        if len(self.starts):
+            values = X[:, self.columns]
+            passed = np.empty(values.shape, dtype=bool)
+            for op in set(self.operators):
+                cols = [i for i, o in enumerate(self.operators) if o == op]
+                passed[:, cols] = OPERATORS[op](values[:, cols], self.thresholds[cols])
+            matched = np.logical_and.reduceat(passed, self.starts, axis=1)
+            # The default rule always matches; argmax picks the first matching rule
+            matched = np.column_stack((matched, np.ones(n, dtype=bool)))
+            index = matched.argmax(axis=1)
+        else:
+            index = np.zeros(n, dtype=np.intp)
+
+        linear = self.conf_direction[index] * (X[np.arange(n), self.conf_column[index]] - self.conf_origin[index])
+        linear = np.minimum(linear / self.conf_span[index], self.conf_max[index])
+        constant = self.conf_constant[index]
+        confidence = np.where(np.isnan(constant), linear, constant)
+        return index, confidence
+
+
+# ==================================================
+# RULE ENGINE
+# ==================================================
+class RuleEngine:
+    """
+    Table-driven skin tone / condition classifier and product mapping, loaded
+    from a versioned JSON config (config/classification_rules.json).
+
+    classify() scores whole arrays of (cr, cb, a, b) tuples in one call, which is
+    what bulk re-scoring uses; classify_one() is the per-analysis wrapper.
+    """
+
+    def __init__(self, config):
+        try:
+            self.version = str(config["version"])
+            self.features = list(config["features"])
+            self.tone_table = _DecisionTable(config["tone"], self.features)
+            self.condition_table = _DecisionTable(config["condition"], self.features)
+            self.products = {
+                (entry["tone"], entry["condition"]): entry for entry in config.get("products", [])
+            }
+            self.default_products = config["default_products"]
+        except (KeyError, ValueError, TypeError) as e:
+            raise RuleConfigError(f"Invalid classification rules: {e}")
+
+    @classmethod
+    def from_file(cls, path=RULES_PATH):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    # --------------------------------------------------
+    def classify(self, cr, cb, a, b):
+        """
+        Vectorized classification. Accepts scalars or equally shaped arrays and
+        returns arrays of tone labels, confidences (rounded to 2 decimals) and condition labels.
+        """
+        X = np.column_stack([np.ravel(np.asarray(v, dtype=np.float64)) for v in (cr, cb, a, b)])
+        tone_index, confidence = self.tone_table.evaluate(X)
+        condition_index, _ = self.condition_table.evaluate(X)
+        return {
+            "tone": self.tone_table.labels[tone_index],
+            "confidence": np.round(confidence, 2),
+            "condition": self.condition_table.labels[condition_index],
+        }
+
+    def classify_one(self, cr, cb, a, b):
+        """Returns (tone, confidence, condition) for a single set of channel means."""
+        X = np.array([[cr, cb, a, b]], dtype=np.float64)
+        tone_index, confidence = self.tone_table.evaluate(X)
+        condition_index, _ = self.condition_table.evaluate(X)
+        return (
+            self.tone_table.labels[tone_index[0]],
+            float(np.round(confidence[0], 2)),
+            self.condition_table.labels[condition_index[0]],
+        )
+
+    def recommend(self, tone, condition, kind="catalog"):
+        """Products for a (tone, condition) pair. kind is "summary" (names) or "catalog" (product dicts)."""
+        entry = self.products.get((tone, condition), self.default_products)
+        return copy.deepcopy(entry[kind])
+
+
+rule_engine = RuleEngine.from_file()
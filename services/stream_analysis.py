@@ -0,0 +1,209 @@
+import os
+import time
+from collections import deque
+
+import cv2
+import dlib
+import numpy as np
+
+from services.analysis_logic import SkinAnalysisResult
+
+# ==================================================
+# STREAMING CONFIGURATION
+# ==================================================
+# Full HOG detection runs on every Nth frame; the frames in between only update the trackers.
+STREAM_REDETECT_INTERVAL = max(1, int(os.environ.get("SKINGLOSS_STREAM_REDETECT_INTERVAL", 15)))
+# Frames whose metrics are averaged per face.
+STREAM_WINDOW = max(1, int(os.environ.get("SKINGLOSS_STREAM_WINDOW", 10)))
+# A tracker below this peak-to-sidelobe ratio has lost its face and forces a re-detection.
+STREAM_MIN_TRACK_QUALITY = float(os.environ.get("SKINGLOSS_STREAM_MIN_TRACK_QUALITY", 7.0))
+# Overlap needed to keep a track's ID when a re-detection finds the same face.
+STREAM_MATCH_IOU = 0.3
+
+STAGES = ("decode", "detect", "track", "landmarks", "metrics", "classify")
+
+
+def _iou(a, b):
+    left, top = max(a.left(), b.left()), max(a.top(), b.top())
+    right, bottom = min(a.right(), b.right()), min(a.bottom(), b.bottom())
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a.width() * a.height() + b.width() * b.height() - inter
+    return inter / union if union > 0 else 0.0
+
+
+class _FaceTrack:
+    """One face followed across frames: its tracker and the metrics of the last frames."""
+
+    def __init__(self, face_id, image, rect, window):
+        self.face_id = face_id
+        self.tracker = dlib.correlation_tracker()
+        self.tracker.start_track(image, rect)
+        self.rect = rect
+        self.quality = None
+        self.metrics = deque(maxlen=window)
+
+    def restart(self, image, rect):
+        self.tracker.start_track(image, rect)
+        self.rect = rect
+        self.quality = None
+
+    def update(self, image):
+        self.quality = self.tracker.update(image)
+        position = self.tracker.get_position()
+        self.rect = dlib.rectangle(
+            int(position.left()), int(position.top()), int(position.right()), int(position.bottom())
+        )
+        return self.quality
+
+
+class StreamSession:
+    """
+    Analysis state of one camera stream.
+
+    Every frame yields one incremental result covering every visible face. Faces
+    are detected every `redetect_interval` frames (or when a tracker loses its
+    face); in between, each face's correlation tracker follows it and only the
+    landmark predictor runs inside the tracked box. Tone and condition come from
+    the mean of the face's last `window` per-frame metrics, so single noisy
+    frames do not flip the result. Results are not stored.
+    """
+
+    def __init__(self, analyzer, redetect_interval=STREAM_REDETECT_INTERVAL, window=STREAM_WINDOW,
+                 min_track_quality=STREAM_MIN_TRACK_QUALITY):
+        self.analyzer = analyzer
+        self.redetect_interval = redetect_interval
+        self.window = window
+        self.min_track_quality = min_track_quality
+        self.tracks = []
+        self.next_face_id = 0
+        self.frames = 0
+        self.dropped = 0
+        self.started = time.perf_counter()
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+        self._redetect = True
+
+    # --------------------------------------------------
+    def _detect(self, gray):
+        """Runs the detector and matches its faces to the existing tracks by overlap."""
+        faces = self.analyzer._detect_faces(gray)
+        tracks = []
+        unmatched = list(self.tracks)
+        for face in faces:
+            best = max(unmatched, key=lambda t: _iou(t.rect, face), default=None)
+            if best is not None and _iou(best.rect, face) >= STREAM_MATCH_IOU:
+                unmatched.remove(best)
+                best.restart(gray, face)
+                tracks.append(best)
+            else:
+                tracks.append(_FaceTrack(self.next_face_id, gray, face, self.window))
+                self.next_face_id += 1
+        self.tracks = tracks
+
+    def _track(self, gray):
+        for track in self.tracks:
+            if track.update(gray) < self.min_track_quality:
+                self._redetect = True
+        height, width = gray.shape[:2]
+        # Tracks that drifted completely out of the frame are dropped
+        self.tracks = [
+            t for t in self.tracks
+            if t.rect.right() > 0 and t.rect.bottom() > 0 and t.rect.left() < width and t.rect.top() < height
+        ]
+
+    def _analyze_face(self, image, gray, track, timings):
+        start = time.perf_counter()
+        rect = track.rect
+        landmarks = self.analyzer.predictor(gray, rect)
+        points = [(landmarks.part(i).x, landmarks.part(i).y) for i in range(68)]
+        cx = rect.left() + rect.width() // 2
+        cy = rect.top() + rect.height() // 2
+        timings["landmarks"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = SkinAnalysisResult(None, None)
+        metrics = self.analyzer._sample(image, (points, cx, cy), result)
+        if metrics is not None:
+            track.metrics.append(metrics)
+        timings["metrics"] += time.perf_counter() - start
+
+        face = {
+            "FaceID": track.face_id,
+            "Box": {"left": rect.left(), "top": rect.top(), "right": rect.right(), "bottom": rect.bottom()},
+            "TrackQuality": round(track.quality, 2) if track.quality is not None else None,
+            "WindowFrames": len(track.metrics),
+            "Landmarks": [{"x": x, "y": y} for x, y in points],
+        }
+        if not track.metrics:
+            face["Notes"] = "ROI is empty or invalid."
+            return face
+
+        start = time.perf_counter()
+        cr_mean, cb_mean, a_mean, b_mean = (float(m) for m in np.mean(track.metrics, axis=0))
+        tone, confidence, condition = self.analyzer.rules.classify_one(cr_mean, cb_mean, a_mean, b_mean)
+        face.update({
+            "SkinTone": tone,
+            "SkinCondition": condition,
+            "ConfidenceScore": confidence,
+            "CrMean": round(cr_mean, 2),
+            "CbMean": round(cb_mean, 2),
+            "aMean": round(a_mean, 2),
+            "bMean": round(b_mean, 2),
+            "Recommendations": self.analyzer._recommend_products(tone, condition),
+        })
+        if result.regions:
+            face["Regions"] = result.regions
+        timings["classify"] += time.perf_counter() - start
+        return face
+
+    def process(self, data):
+        """Analyzes one encoded frame and returns the incremental result."""
+        timings = dict.fromkeys(STAGES, 0.0)
+        self.frames += 1
+
+        start = time.perf_counter()
+        image, _ = self.analyzer._decode(data)
+        timings["decode"] = time.perf_counter() - start
+        if image is None:
+            return {"Frame": self.frames, "Error": "Frame could not be decoded."}
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        redetect = self._redetect or not self.tracks or (self.frames - 1) % self.redetect_interval == 0
+        start = time.perf_counter()
+        if redetect:
+            self._detect(gray)
+            self._redetect = False
+            timings["detect"] = time.perf_counter() - start
+        else:
+            self._track(gray)
+            timings["track"] = time.perf_counter() - start
+
+        faces = [self._analyze_face(image, gray, track, timings) for track in self.tracks]
+
+        for stage, seconds in timings.items():
+            self.stage_totals[stage] += seconds
+        return {
+            "Frame": self.frames,
+            "Detected": redetect,
+            "Faces": faces,
+            "LatencyMs": {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()},
+            "FrameMs": round(sum(timings.values()) * 1000, 2),
+            "FPS": self.fps(),
+            "DroppedFrames": self.dropped,
+        }
+
+    def fps(self):
+        elapsed = time.perf_counter() - self.started
+        return round(self.frames / elapsed, 2) if elapsed else None
+
+    def stats(self):
+        """Session totals, sent when the stream ends."""
+        return {
+            "Frames": self.frames,
+            "DroppedFrames": self.dropped,
+            "FPS": self.fps(),
+            "AvgLatencyMs": {
+                stage: round(total * 1000 / self.frames, 2) if self.frames else 0.0
+                for stage, total in self.stage_totals.items()
+            },
+        }
+
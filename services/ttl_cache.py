@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+class TTLCache:
+    """
+    Small thread-safe cache whose entries are fresh for `ttl` seconds and may
+    still be served as stale for another `stale_ttl` seconds while the caller
+    refreshes them (stale-while-revalidate).
+    """
+
+    def __init__(self, ttl, stale_ttl=0.0, max_entries=1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_entry(self, key):
+        """Returns (value, FRESH | STALE), or (None, None) when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age <= self.ttl:
+                self._entries.move_to_end(key)
+                return value, FRESH
+            if age <= self.ttl + self.stale_ttl:
+                return value, STALE
+            del self._entries[key]
+            return None, None
+
+    def get(self, key):
+        """Returns the value only while it is fresh."""
+        value, state = self.get_entry(key)
+        return value if state == FRESH else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose key matches predicate(key)."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
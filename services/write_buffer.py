@@ -0,0 +1,290 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config.firebase_config import get_db
+from services.instrumentation import record_error
+
+# ==================================================
+# WRITE BUFFER CONFIGURATION
+# ==================================================
+# Firestore rejects batched writes with more than 500 operations.
+FIRESTORE_BATCH_LIMIT = 500
+WRITE_BATCH_SIZE = min(int(os.environ.get("SKINGLOSS_WRITE_BATCH_SIZE", FIRESTORE_BATCH_LIMIT)), FIRESTORE_BATCH_LIMIT)
+# Seconds a write may wait in the buffer for more writes to batch with.
+WRITE_FLUSH_INTERVAL = float(os.environ.get("SKINGLOSS_WRITE_FLUSH_INTERVAL", 0.25))
+# Producers block once this many writes are waiting.
+WRITE_QUEUE_SIZE = int(os.environ.get("SKINGLOSS_WRITE_QUEUE_SIZE", 10000))
+# Durable mode makes every write wait until its batch is committed.
+WRITE_DURABLE = os.environ.get("SKINGLOSS_WRITE_DURABLE", "0") == "1"
+# Extra attempts for a batch that failed with a transient error, with exponential backoff.
+WRITE_COMMIT_RETRIES = int(os.environ.get("SKINGLOSS_WRITE_COMMIT_RETRIES", 2))
+WRITE_RETRY_DELAY = 0.2
+
+_FLUSH = "flush"
+_STOP = "stop"
+
+
+def _transient(error):
+    """Errors worth retrying the same batch for; anything else is a problem with one of its writes."""
+    from google.api_core import exceptions
+
+    return isinstance(error, (
+        exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.InternalServerError,
+        exceptions.Aborted, exceptions.TooManyRequests, ConnectionError, TimeoutError,
+    ))
+
+
+class _Op:
+    __slots__ = ("kind", "ref", "data", "merge", "future", "queued_at", "urgent")
+
+    def __init__(self, kind, ref=None, data=None, merge=False):
+        self.kind = kind
+        self.ref = ref
+        self.data = data
+        self.merge = merge
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+        # Someone is blocked on the commit: flush now instead of waiting out flush_interval
+        self.urgent = False
+
+    @property
+    def size(self):
+        # A group counts every write it contains against the batch limit
+        return len(self.data) if self.kind == "group" else 1
+
+
+# ==================================================
+# WRITE-BEHIND BUFFER
+# ==================================================
+class WriteBehindBuffer:
+    """
+    Queues Firestore writes and commits them from a background thread as batched
+    writes, whenever `batch_size` writes are waiting or `flush_interval` seconds
+    have passed since the oldest one.
+
+    Every write returns a Future resolved when its batch commits. Callers that
+    need read-after-write guarantees wait on it (durable mode does so for them);
+    the endpoints whose response is typically followed by a read of the same
+    data (adding feedback, saving analyses, generating recommendations) always
+    wait. A waited write does not sit out flush_interval: the flush thread
+    commits it at once, together with whatever else is already queued, so
+    waiting costs one commit and only fire-and-forget writes are batched over time.
+
+    A batch that fails is retried while the error is transient, then split in
+    halves until the failing writes are isolated: one bad write (e.g. an update
+    of a deleted document) only fails its own Future, and is counted in
+    failed_ops, last_error and the write_buffer/commit error metric.
+    """
+
+    def __init__(self, client=None, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL,
+                 queue_size=WRITE_QUEUE_SIZE, durable=WRITE_DURABLE):
+        self._client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durable = durable
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._carry = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._flushes = 0
+        self._committed = 0
+        self._failed = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+        self._last_flush = 0.0
+        self._wait_max = 0.0
+        self._last_error = None
+
+    @property
+    def client(self):
+        # Resolved on the first flush so importing the buffer does not create the Firestore client
+        if self._client is None:
+            self._client = get_db()
+        return self._client
+
+    # --------------------------------------------------
+    def set(self, ref, data, merge=False, wait=None):
+        return self._submit(_Op("set", ref, data, merge), wait)
+
+    def update(self, ref, data, wait=None):
+        return self._submit(_Op("update", ref, data), wait)
+
+    def delete(self, ref, wait=None):
+        return self._submit(_Op("delete", ref), wait)
+
+    def group(self, writes, wait=None):
+        """
+        Queues several writes that must land in the same batch, e.g. a document and the
+        counters derived from it. `writes` holds ("set", ref, data, merge), ("update", ref, data)
+        or ("delete", ref) tuples.
+        """
+        return self._submit(_Op("group", data=list(writes)), wait)
+
+    async def aset(self, ref, data, merge=False, wait=None):
+        """Async variant of set(); awaits the commit (if waiting, as for set) without blocking the loop."""
+        op = _Op("set", ref, data, merge)
+        op.urgent = self._waits(wait)
+        future = self._submit(op, wait=False)
+        if op.urgent:
+            await asyncio.wrap_future(future)
+        return future
+
+    def flush(self, timeout=None):
+        """Commits everything queued so far and waits for it."""
+        if self._thread is None:
+            return
+        self._submit(_Op(_FLUSH), wait=False).result(timeout)
+
+    def close(self, timeout=30):
+        """
+        Drains the queue and stops the background thread. The buffer can be used
+        again afterwards (e.g. by the next app lifespan in the same process): the
+        next write starts a new thread.
+        """
+        if self._thread is None or self._closed:
+            return
+        self._closed = True
+        self._queue.put(_Op(_STOP))
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Still committing; leave it closed rather than run two flush threads
+            return
+        with self._start_lock:
+            self._thread = None
+            self._closed = False
+
+    # --------------------------------------------------
+    def _submit(self, op, wait):
+        if self._closed:
+            raise RuntimeError("Write buffer is closed.")
+        self._ensure_started()
+        waits = self._waits(wait)
+        op.urgent = op.urgent or waits
+        self._queue.put(op)
+        if waits:
+            op.future.result()
+        return op.future
+
+    def _waits(self, wait):
+        return wait or (wait is None and self.durable)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="firestore-write-buffer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            ops = [self._carry or self._queue.get()]
+            self._carry = None
+            size = ops[0].size
+            urgent = ops[0].urgent
+            deadline = ops[0].queued_at + self.flush_interval
+            markers = []
+
+            while ops[-1].kind not in (_FLUSH, _STOP) and size < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if urgent:
+                        # A writer is blocked on this batch: take only what is already queued
+                        op = self._queue.get_nowait()
+                    elif remaining <= 0:
+                        break
+                    else:
+                        op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + op.size > self.batch_size:
+                    # Does not fit: it opens the next batch instead
+                    self._carry = op
+                    break
+                ops.append(op)
+                size += op.size
+                urgent = urgent or op.urgent
+
+            if ops[-1].kind in (_FLUSH, _STOP):
+                markers.append(ops.pop())
+            if ops:
+                self._commit(ops)
+            for marker in markers:
+                marker.future.set_result(None)
+                if marker.kind == _STOP:
+                    return
+
+    def _commit(self, ops):
+        started = time.perf_counter()
+        self._wait_max = max(self._wait_max, started - ops[0].queued_at)
+        error = self._commit_batch(ops)
+        if error is not None:
+            if len(ops) > 1:
+                # Commit the halves separately so the writes that are fine still land
+                middle = len(ops) // 2
+                self._commit(ops[:middle])
+                self._commit(ops[middle:])
+                return
+            self._failed += ops[0].size
+            self._last_error = f"{type(error).__name__}: {error}"
+            record_error("write_buffer", "commit")
+            ops[0].future.set_exception(error)
+            return
+
+        elapsed = time.perf_counter() - started
+        self._flushes += 1
+        self._committed += sum(op.size for op in ops)
+        self._flush_total += elapsed
+        self._flush_max = max(self._flush_max, elapsed)
+        self._last_flush = elapsed
+        for op in ops:
+            op.future.set_result(None)
+
+    def _commit_batch(self, ops):
+        """Commits the ops as one batch, retrying transient errors; returns the final error or None."""
+        for attempt in range(WRITE_COMMIT_RETRIES + 1):
+            try:
+                batch = self.client.batch()
+                for op in ops:
+                    if op.kind == "group":
+                        for write in op.data:
+                            self._apply(batch, *write)
+                    else:
+                        self._apply(batch, op.kind, op.ref, op.data, op.merge)
+                batch.commit()
+                return None
+            except Exception as e:
+                if attempt == WRITE_COMMIT_RETRIES or not _transient(e):
+                    return e
+                time.sleep(WRITE_RETRY_DELAY * 2 ** attempt)
+
+    @staticmethod
+    def _apply(batch, kind, ref, data=None, merge=False):
+        if kind == "set":
+            batch.set(ref, data, merge=merge)
+        elif kind == "update":
+            batch.update(ref, data)
+        else:
+            batch.delete(ref)
+
+    # --------------------------------------------------
+    def stats(self):
+        return {
+            "queue_size": self._queue.qsize(),
+            "durable": self.durable,
+            "flushes": self._flushes,
+            "committed_ops": self._committed,
+            "failed_ops": self._failed,
+            "last_error": self._last_error,
+            "avg_flush_seconds": round(self._flush_total / self._flushes, 4) if self._flushes else 0.0,
+            "max_flush_seconds": round(self._flush_max, 4),
+            "last_flush_seconds": round(self._last_flush, 4),
+            "max_buffered_seconds": round(self._wait_max, 4),
+        }
+
+
+write_buffer = WriteBehindBuffer()
@@ -0,0 +1,193 @@
+"""
+AnalysisJobService end to end against the in-memory Firestore and a fake bucket,
+with the worker pool replaced by a stub (no dlib or OpenCV needed).
+"""
+import asyncio
+import datetime
+import uuid
+
+import pytest
+
+from config import firebase_config
+from config.memory_firestore import MemoryFirestore
+from services import analysis_jobs
+from services.analysis_jobs import AnalysisJobService, DONE, JOB_MAX_ATTEMPTS, QUEUED
+from services.analysis_pool import JobTimeout, PoolSaturated
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data
+
+    def download_as_bytes(self):
+        return self.bucket.objects[self.name]
+
+    def generate_signed_url(self, **kwargs):
+        return f"https://storage.example/{self.bucket.name}/{self.name}"
+
+
+class FakeBucket:
+    name = "test-bucket"
+
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+
+class StubResult:
+    """The parts of SkinAnalysisResult the job service uses."""
+
+    thumbnail = None
+    resubmission = False
+
+    def __init__(self, user_id, image_path):
+        self.data = {
+            "AnalysisID": str(uuid.uuid4()), "UserID": user_id, "ImagePath": image_path,
+            "AnalysisDate": datetime.datetime.now().isoformat(), "FaceDetected": True,
+            "SkinTone": "Warm", "SkinCondition": "Balanced",
+            "CrMean": 150.0, "CbMean": 110.0, "aMean": 12.0, "bMean": 18.0,
+        }
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class StubPool:
+    """Analyzes every image as a warm, balanced face; blocks while `gate` is set and not released."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.images = []
+
+    async def analyze_bytes(self, data, user_id, image_path):
+        self.images.append(data)
+        if self.gate is not None:
+            await self.gate.wait()
+        return StubResult(user_id, image_path)
+
+
+class FailingPool:
+    """Raises `error` for every image, like a saturated or stuck analysis pool."""
+
+    def __init__(self, error):
+        self.error = error
+
+    async def analyze_bytes(self, data, user_id, image_path):
+        raise self.error
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    db, bucket = MemoryFirestore(), FakeBucket()
+    monkeypatch.setattr(firebase_config, "_db", db)
+    monkeypatch.setattr(firebase_config, "_bucket", bucket)
+    monkeypatch.setattr(analysis_jobs, "analysis_pool", StubPool())
+    return AnalysisJobService(db=db, bucket=bucket, workers=1, poll_interval=60)
+
+
+def upload(jobs, job):
+    jobs.bucket.blob(job["ObjectPath"]).upload_from_string(b"jpeg bytes", content_type=job["ContentType"])
+
+
+def test_create_submit_wait(jobs):
+    async def scenario():
+        job = jobs.create_job("u1")
+        upload(jobs, job)
+        submitted = await jobs.submit(job["JobID"], max_bytes=1024)
+        assert submitted["Status"] == QUEUED
+        try:
+            return await jobs.wait(job["JobID"], timeout=5)
+        finally:
+            await jobs.stop()
+
+    finished = asyncio.run(scenario())
+    assert finished["Status"] == DONE
+    analysis = jobs.analyses.document(finished["AnalysisID"]).get()
+    assert analysis.exists
+    assert analysis.to_dict()["UserID"] == "u1"
+    assert analysis_jobs.analysis_pool.images == [b"jpeg bytes"]
+
+
+def test_stop_returns_running_job_to_queue(jobs, monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(analysis_jobs, "analysis_pool", StubPool(gate=asyncio.Event()))
+        job = jobs.create_job("u1")
+        upload(jobs, job)
+        await jobs.submit(job["JobID"], max_bytes=1024)
+        while not analysis_jobs.analysis_pool.images:
+            await asyncio.sleep(0.01)
+        await jobs.stop()
+        return jobs.get_job(job["JobID"])
+
+    job = asyncio.run(scenario())
+    assert job["Status"] == QUEUED
+    assert job["Worker"] is None
+
+
+def test_capacity_failures_do_not_use_up_attempts(jobs, monkeypatch):
+    monkeypatch.setattr(analysis_jobs, "analysis_pool", FailingPool(PoolSaturated("full")))
+
+    async def scenario():
+        job = jobs.create_job("u1")
+        upload(jobs, job)
+        jobs.mark_submitted(job["JobID"], max_bytes=1024)
+        for _ in range(JOB_MAX_ATTEMPTS + 2):
+            with pytest.raises(PoolSaturated):
+                await jobs.run_job(job["JobID"])
+        return jobs.get_job(job["JobID"])
+
+    job = asyncio.run(scenario())
+    assert job["Status"] == QUEUED
+    assert job["Attempts"] == 0
+
+
+def test_job_timeouts_use_up_attempts(jobs, monkeypatch):
+    monkeypatch.setattr(analysis_jobs, "analysis_pool", FailingPool(JobTimeout("stuck")))
+
+    async def scenario():
+        job = jobs.create_job("u1")
+        upload(jobs, job)
+        jobs.mark_submitted(job["JobID"], max_bytes=1024)
+        for _ in range(JOB_MAX_ATTEMPTS):
+            with pytest.raises(JobTimeout):
+                await jobs.run_job(job["JobID"])
+        # The next claim gives up on it
+        assert await jobs.run_job(job["JobID"]) is False
+        return jobs.get_job(job["JobID"])
+
+    assert asyncio.run(scenario())["Status"] == "failed"
+
+
+def test_concurrent_waiters_are_all_woken(jobs, monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        monkeypatch.setattr(analysis_jobs, "analysis_pool", StubPool(gate=gate))
+        job = jobs.create_job("u1")
+        upload(jobs, job)
+        await jobs.submit(job["JobID"], max_bytes=1024)
+        try:
+            patient = asyncio.create_task(jobs.wait(job["JobID"], timeout=5))
+            # A waiter that gives up first must not take the other's wake-up with it
+            assert (await jobs.wait(job["JobID"], timeout=0.1))["Status"] != DONE
+            await asyncio.sleep(0.05)
+            gate.set()
+            finished = await asyncio.wait_for(patient, timeout=0.5)
+        finally:
+            await jobs.stop()
+        assert not jobs._events
+        return finished
+
+    assert asyncio.run(scenario())["Status"] == DONE
@@ -0,0 +1,142 @@
+"""
+ProductAPIClient against the benchmarks' stub product API: circuit breaker
+transitions, stale-while-revalidate caching and the local fallback.
+"""
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.fixtures import stub_product_transport
+from services.product_api import CircuitBreaker, ProductAPIClient
+from services.ttl_cache import TTLCache, FRESH
+
+RESET_SECONDS = 0.05
+
+
+class Upstream(httpx.AsyncBaseTransport):
+    """Counts requests and forwards them to the stub; `failing` switches it to answering 503."""
+
+    def __init__(self, latency=0.0):
+        self.healthy = stub_product_transport(latency=latency)
+        self.broken = stub_product_transport(latency=latency, failure_rate=1.0)
+        self.failing = False
+        self.requests = 0
+
+    async def handle_async_request(self, request):
+        self.requests += 1
+        transport = self.broken if self.failing else self.healthy
+        return await transport.handle_async_request(request)
+
+
+def make_client(upstream, ttl=60, stale_ttl=60):
+    return ProductAPIClient(
+        base_url="http://products.test/search",
+        cache=TTLCache(ttl, stale_ttl),
+        breaker=CircuitBreaker(failure_threshold=2, reset_seconds=RESET_SECONDS),
+        transport=upstream,
+    )
+
+
+def is_fallback(products):
+    return len(products) == 1 and products[0]["source"] == "Local"
+
+
+def test_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=RESET_SECONDS)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    # One probe after the reset period; a failed probe opens it again straight away
+    time.sleep(RESET_SECONDS)
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    time.sleep(RESET_SECONDS)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def test_failing_upstream_opens_breaker_and_recovers():
+    upstream = Upstream()
+    upstream.failing = True
+    client = make_client(upstream)
+
+    async def scenario():
+        try:
+            failed = [await client.fetch_products("Light", "Oily") for _ in range(2)]
+            assert all(is_fallback(products) and "503" in products[0]["error"] for products in failed)
+            assert client.stats() == {"breaker_state": CircuitBreaker.OPEN, "consecutive_failures": 2}
+
+            # Open: answered locally without calling the upstream
+            products = await client.fetch_products("Light", "Oily")
+            assert is_fallback(products) and products[0]["error"] == "Product API circuit open"
+            assert upstream.requests == 2
+
+            upstream.failing = False
+            await asyncio.sleep(RESET_SECONDS)
+            products = await client.fetch_products("Light", "Oily")
+            assert len(products) == 3 and products[0]["source"] == "ShopeeMock"
+            assert client.stats()["breaker_state"] == CircuitBreaker.CLOSED
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stale_entry_is_served_while_refreshing():
+    upstream = Upstream(latency=0.2)
+    client = make_client(upstream, ttl=0.05)
+
+    async def scenario():
+        try:
+            first = await client.fetch_products("Medium", "Dry")
+            await asyncio.sleep(0.06)
+
+            started = time.perf_counter()
+            stale = await client.fetch_products("Medium", "Dry")
+            assert time.perf_counter() - started < 0.1
+            assert stale == first
+            # A second stale hit does not start another refresh
+            await client.fetch_products("Medium", "Dry")
+            assert len(client._refresh_tasks) == 1
+
+            await asyncio.gather(*client._refresh_tasks.values())
+            assert upstream.requests == 2
+            assert client.cache.get_entry(("Medium", "Dry"))[1] == FRESH
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stale_entry_is_not_refreshed_while_breaker_is_open():
+    upstream = Upstream()
+    client = make_client(upstream, ttl=0.05)
+
+    async def scenario():
+        try:
+            cached = await client.fetch_products("Dark", "Normal")
+            upstream.failing = True
+            await asyncio.sleep(0.06)
+            # Stale, so the caller gets the cached products while the refresh fails
+            assert await client.fetch_products("Dark", "Normal") == cached
+            await asyncio.gather(*client._refresh_tasks.values())
+            # A miss has nothing cached to serve, so its failure comes back as the local product
+            assert is_fallback(await client.fetch_products("Dark", "Acne"))
+            assert client.breaker.state == CircuitBreaker.OPEN
+
+            requests = upstream.requests
+            assert await client.fetch_products("Dark", "Normal") == cached
+            assert not client._refresh_tasks and upstream.requests == requests
+            assert is_fallback(await client.fetch_products("Dark", "Acne"))
+            assert upstream.requests == requests
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
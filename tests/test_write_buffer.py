@@ -0,0 +1,144 @@
+"""
+WriteBehindBuffer against the in-memory Firestore: when batches flush, how a
+failed batch is split, what waiters see and reuse after close().
+"""
+import asyncio
+import time
+
+import pytest
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+
+from config.memory_firestore import MemoryFirestore
+from services import write_buffer as write_buffer_module
+from services.write_buffer import WriteBehindBuffer
+
+
+class FlakyFirestore(MemoryFirestore):
+    """Fails the first `failures` batch commits with a transient error."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.commits = 0
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def flaky_commit():
+            self.commits += 1
+            if self.commits <= self.failures:
+                raise ServiceUnavailable("try again")
+            return commit()
+
+        batch.commit = flaky_commit
+        return batch
+
+
+@pytest.fixture
+def db():
+    return MemoryFirestore()
+
+
+@pytest.fixture
+def make_buffer(db):
+    buffers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("client", db)
+        buffer = WriteBehindBuffer(**kwargs)
+        buffers.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in buffers:
+        buffer.close()
+
+
+def stored(db, doc_id):
+    return db.collection("Docs").document(doc_id).get().to_dict()
+
+
+def test_full_batch_commits_without_waiting_for_interval(db, make_buffer):
+    buffer = make_buffer(batch_size=3, flush_interval=30)
+    futures = [buffer.set(db.collection("Docs").document(f"d{i}"), {"i": i}, wait=False) for i in range(3)]
+    for future in futures:
+        future.result(timeout=5)
+    assert stored(db, "d2") == {"i": 2}
+    assert buffer.stats()["flushes"] == 1
+
+
+def test_interval_flushes_partial_batch(db, make_buffer):
+    buffer = make_buffer(flush_interval=0.05)
+    started = time.perf_counter()
+    buffer.set(db.collection("Docs").document("d"), {"v": 1}, wait=False).result(timeout=5)
+    assert time.perf_counter() - started >= 0.04
+    assert stored(db, "d") == {"v": 1}
+
+
+def test_waited_write_commits_at_once(db, make_buffer):
+    buffer = make_buffer(flush_interval=30)
+    background = buffer.set(db.collection("Docs").document("a"), {"v": 1}, wait=False)
+    started = time.perf_counter()
+    buffer.set(db.collection("Docs").document("b"), {"v": 2}, wait=True)
+    assert time.perf_counter() - started < 5
+    # Already queued writes go out with it
+    assert background.done()
+    assert stored(db, "a") == {"v": 1}
+
+
+def test_durable_mode_waits_by_default(db, make_buffer):
+    buffer = make_buffer(flush_interval=30, durable=True)
+    future = buffer.set(db.collection("Docs").document("d"), {"v": 1})
+    assert future.done()
+    assert stored(db, "d") == {"v": 1}
+
+
+def test_failed_batch_is_split_to_the_bad_write(db, make_buffer):
+    buffer = make_buffer(flush_interval=30)
+    collection = db.collection("Docs")
+    good = [buffer.set(collection.document(f"d{i}"), {"i": i}, wait=False) for i in range(3)]
+    bad = buffer.update(collection.document("missing"), {"v": 1}, wait=False)
+    good.append(buffer.group([("set", collection.document("d3"), {"i": 3}, False)], wait=False))
+    buffer.flush(timeout=5)
+
+    assert isinstance(bad.exception(), NotFound)
+    assert all(future.exception() is None for future in good)
+    assert stored(db, "d3") == {"i": 3}
+    stats = buffer.stats()
+    assert stats["failed_ops"] == 1
+    assert stats["committed_ops"] == 4
+    assert stats["last_error"].startswith("NotFound")
+
+
+def test_waiter_sees_commit_error(db, make_buffer):
+    buffer = make_buffer()
+    with pytest.raises(NotFound):
+        buffer.update(db.collection("Docs").document("missing"), {"v": 1}, wait=True)
+
+
+def test_transient_error_retries_whole_batch(make_buffer, monkeypatch):
+    monkeypatch.setattr(write_buffer_module, "WRITE_RETRY_DELAY", 0)
+    db = FlakyFirestore(failures=1)
+    buffer = make_buffer(client=db)
+    buffer.set(db.collection("Docs").document("d"), {"v": 1}, wait=True)
+    assert stored(db, "d") == {"v": 1}
+    assert db.commits == 2
+    assert buffer.stats()["failed_ops"] == 0
+
+
+def test_close_drains_and_buffer_can_be_reused(db, make_buffer):
+    buffer = make_buffer(flush_interval=30)
+    pending = buffer.set(db.collection("Docs").document("a"), {"v": 1}, wait=False)
+    buffer.close()
+    assert pending.done()
+    assert stored(db, "a") == {"v": 1}
+
+    buffer.set(db.collection("Docs").document("b"), {"v": 2}, wait=True)
+    assert stored(db, "b") == {"v": 2}
+
+
+def test_awaited_aset_commits_at_once(db, make_buffer):
+    buffer = make_buffer(flush_interval=30)
+    asyncio.run(buffer.aset(db.collection("Docs").document("d"), {"v": 1}, wait=True))
+    assert stored(db, "d") == {"v": 1}